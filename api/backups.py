@@ -0,0 +1,57 @@
+"""
+API endpoints for ledger backups
+"""
+
+from flask import Blueprint, request, jsonify
+from models.backups import BackupError
+from models.database import BackupManager
+
+backups_bp = Blueprint('backups', __name__, url_prefix='/api/backups')
+
+
+@backups_bp.route('', methods=['GET'])
+def list_backups():
+    """List the backup archives, newest first"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': BackupManager.list()
+        }), 200
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@backups_bp.route('', methods=['POST'])
+def start_backup():
+    """Start a backup in the background ({"full": true} forces a full one)"""
+    try:
+        data = request.get_json(silent=True) or {}
+        success, msg = BackupManager.start(True if data.get('full') else None)
+        
+        return jsonify({
+            'success': success,
+            'message': msg
+        }), 202 if success else 409
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@backups_bp.route('/<name>/restore', methods=['POST'])
+def restore_backup(name):
+    """Restore the ledger to a backup archive; its current state is backed up first"""
+    try:
+        if name not in {archive['name'] for archive in BackupManager.list()['archives']}:
+            return jsonify({'success': False, 'error': 'Backup not found'}), 404
+        try:
+            success, result = BackupManager.restore(name)
+        except BackupError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        return jsonify({
+            'success': success,
+            'data': result
+        }), 200
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
@@ -0,0 +1,48 @@
+"""
+API endpoint for the real-time change feed (Server-Sent Events)
+"""
+
+import json
+from flask import Blueprint, Response, request
+from models.database import get_tenant_store
+
+events_bp = Blueprint('events', __name__, url_prefix='/api/events')
+
+# Seconds between keep-alive comments on an idle stream
+HEARTBEAT_INTERVAL = 15
+
+
+def format_event(event):
+    """Serialise an event in text/event-stream format"""
+    lines = []
+    if event['id']:
+        lines.append(f"id: {event['id']}")
+    lines.append(f"event: {event['type']}")
+    lines.append(f"data: {json.dumps(event['data'], separators=(',', ':'))}")
+    return '\n'.join(lines) + '\n\n'
+
+
+@events_bp.route('', methods=['GET'])
+def stream_events():
+    """Stream expense and budget changes of the current tenant"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    subscription = get_tenant_store().feed.subscribe(last_event_id)
+
+    def generate():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                event = subscription.get(timeout=HEARTBEAT_INTERVAL)
+                if event is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_event(event)
+                if subscription.overflowed and event['type'] == 'resync':
+                    break
+        finally:
+            subscription.close()
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
@@ -2,109 +2,301 @@
 API endpoints for expenses management
 """
 
+import csv
+import io
 from flask import Blueprint, request, jsonify
 from datetime import datetime
-from models.database import ExpenseManager, CATEGORIES, PAYMENT_METHODS
+from models.database import ExpenseManager, RuleManager, CATEGORIES, PAYMENT_METHODS, CURRENCIES
+from models.revisions import parse_timestamp
+from models.wallets import ENTRY_TYPES
+from utils.metrics import timed
 from utils.validators import (
     validate_amount, validate_date, validate_category,
-    validate_payment_method, validate_description, sanitize_string
+    validate_payment_method, validate_currency, validate_description, sanitize_string
 )
 
 expenses_bp = Blueprint('expenses', __name__, url_prefix='/api/expenses')
 
+# Most rows one import may hold
+MAX_IMPORT_ROWS = 10000
+# CSV headers (as written by the CSV export) of the expense fields
+CSV_FIELDS = {
+    'date': 'date', 'category': 'category', 'description': 'description',
+    'payment method': 'payment_method', 'payment_method': 'payment_method',
+    'wallet': 'wallet', 'amount': 'amount', 'currency': 'currency', 'notes': 'notes',
+    'type': 'type', 'to wallet': 'to_wallet', 'to_wallet': 'to_wallet'
+}
 
-@expenses_bp.route('', methods=['GET'])
-def get_expenses():
-    """Get all expenses with optional filtering"""
+
+@timed('filter')
+def filter_expenses(expenses, category=None, payment_method=None):
+    """Apply the optional category and payment method filters"""
+    if category:
+        expenses = [e for e in expenses if e.get('category') == category]
+    if payment_method:
+        expenses = [e for e in expenses if e.get('payment_method') == payment_method]
+    return expenses
+
+
+def expense_error(data):
+    """Get the validation error of new expense data, or None"""
+    if not validate_date(data.get('date')):
+        return 'Invalid date format. Use YYYY-MM-DD'
+    
+    if not validate_category(data.get('category'), CATEGORIES):
+        return f'Invalid category. Must be one of: {", ".join(CATEGORIES)}'
+    
+    if not validate_payment_method(data.get('payment_method'), PAYMENT_METHODS):
+        return f'Invalid payment method. Must be one of: {", ".join(PAYMENT_METHODS)}'
+    
+    if not validate_amount(data.get('amount')):
+        return 'Amount must be a positive number'
+    
+    if not validate_description(data.get('description')):
+        return 'Description must be at least 2 characters'
+    
+    if data.get('currency') is not None and not validate_currency(data['currency'], CURRENCIES):
+        return f'Invalid currency. Must be one of: {", ".join(CURRENCIES)}'
+    return type_error(data)
+
+
+def type_error(data):
+    """Get the error in the type (expense, income or transfer) and wallets of expense data, or None"""
+    kind = data.get('type')
+    if kind is None:
+        return None
+    if kind not in ENTRY_TYPES:
+        return f'Invalid type. Must be one of: {", ".join(ENTRY_TYPES)}'
+    if kind != 'expense' and not data.get('wallet'):
+        return 'Income and transfers need a wallet'
+    if kind == 'transfer' and (not data.get('to_wallet') or data['to_wallet'] == data['wallet']):
+        return 'Transfers need a to_wallet other than their wallet'
+    return None
+
+
+def clean_expense(data):
+    """Sanitize validated expense data"""
+    return {
+        'date': data.get('date'),
+        'category': data.get('category'),
+        'description': sanitize_string(data.get('description', '')),
+        'amount': float(data.get('amount')),
+        'currency': data.get('currency'),
+        'payment_method': data.get('payment_method'),
+        'wallet': data.get('wallet'),
+        'receipt': data.get('receipt'),
+        'notes': sanitize_string(data.get('notes', '')),
+        'tags': data.get('tags', []),
+        'type': data.get('type'),
+        'to_wallet': data.get('to_wallet')
+    }
+
+
+def read_csv_rows(file):
+    """Read expense rows from an uploaded CSV file with a header row"""
+    text = io.TextIOWrapper(file.stream, encoding='utf-8-sig')
+    rows = []
+    for row in csv.DictReader(text):
+        expense = {}
+        for header, value in row.items():
+            field = CSV_FIELDS.get((header or '').strip().lower())
+            if field and value not in (None, ''):
+                expense[field] = value.strip()
+        rows.append(expense)
+    return rows
+
+
+# ===== SHARED HANDLERS =====
+# Return (payload, status); called by the Flask routes below and the ASGI entry point
+
+def handle_get_expenses(args):
+    """Get all expenses with optional filtering, now or as of a past timestamp"""
     try:
-        expenses = ExpenseManager.load()
-        
         # Optional filters
-        category = request.args.get('category')
-        payment_method = request.args.get('payment_method')
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
-        
-        # Apply filters
-        if category:
-            expenses = [e for e in expenses if e.get('category') == category]
-        if payment_method:
-            expenses = [e for e in expenses if e.get('payment_method') == payment_method]
-        if start_date:
-            expenses = [e for e in expenses if e.get('date') >= start_date]
-        if end_date:
-            expenses = [e for e in expenses if e.get('date') <= end_date]
+        category = args.get('category')
+        payment_method = args.get('payment_method')
+        start_date = args.get('start_date')
+        end_date = args.get('end_date')
+        as_of = args.get('as_of')
         
-        return jsonify({
+        if as_of:
+            try:
+                timestamp = parse_timestamp(as_of)
+            except ValueError:
+                return {
+                    'success': False,
+                    'error': 'as_of must be an ISO date or timestamp'
+                }, 400
+            expenses = ExpenseManager.as_of(timestamp, start_date, end_date)
+        else:
+            # Date filters only open the overlapping month partitions
+            expenses = ExpenseManager.load_range(start_date, end_date)
+        expenses = filter_expenses(expenses, category, payment_method)
+        
+        return {
             'success': True,
             'data': expenses,
             'count': len(expenses)
-        }), 200
+        }, 200
     
     except Exception as e:
-        return jsonify({
+        return {
             'success': False,
             'error': f"Failed to fetch expenses: {str(e)}"
-        }), 500
+        }, 500
+
+
+def handle_get_changes(args):
+    """Get expenses created, updated or deleted since a change version"""
+    try:
+        since = args.get('since', '0')
+        if not since.isdigit():
+            return {
+                'success': False,
+                'error': 'since must be a non-negative integer version'
+            }, 400
+        
+        changes = ExpenseManager.changes(int(since))
+        
+        return {
+            'success': True,
+            'data': changes
+        }, 200
+    
+    except Exception as e:
+        return {
+            'success': False,
+            'error': f"Failed to fetch changes: {str(e)}"
+        }, 500
+
+
+def handle_get_expense(args, expense_id):
+    """Get single expense by ID"""
+    try:
+        expense = ExpenseManager.get_by_id(expense_id)
+        
+        if not expense:
+            return {
+                'success': False,
+                'error': 'Expense not found'
+            }, 404
+        
+        return {
+            'success': True,
+            'data': expense
+        }, 200
+    
+    except Exception as e:
+        return {
+            'success': False,
+            'error': f"Error fetching expense: {str(e)}"
+        }, 500
+
+
+# ===== EXPENSES API =====
+
+@expenses_bp.route('', methods=['GET'])
+def get_expenses():
+    """Get all expenses with optional filtering, now or as of a past timestamp"""
+    payload, status = handle_get_expenses(request.args)
+    return jsonify(payload), status
+
+
+@expenses_bp.route('/changes', methods=['GET'])
+def get_changes():
+    """Get expenses created, updated or deleted since a change version"""
+    payload, status = handle_get_changes(request.args)
+    return jsonify(payload), status
 
 
 @expenses_bp.route('', methods=['POST'])
 def create_expense():
     """Create new expense with validation"""
     try:
-        data = request.get_json()
+        # Expenses sent without a category are categorised by the rules
+        data = RuleManager.categorize([request.get_json()])[0]
         
         # Validation
-        if not validate_date(data.get('date')):
+        error = expense_error(data)
+        if error:
             return jsonify({
                 'success': False,
-                'error': 'Invalid date format. Use YYYY-MM-DD'
+                'error': error
             }), 400
         
-        if not validate_category(data.get('category'), CATEGORIES):
-            return jsonify({
-                'success': False,
-                'error': f'Invalid category. Must be one of: {", ".join(CATEGORIES)}'
-            }), 400
+        # Sanitize inputs
+        success, result = ExpenseManager.add(clean_expense(data))
         
-        if not validate_payment_method(data.get('payment_method'), PAYMENT_METHODS):
+        if success:
+            # Near-duplicates of stored expenses are added but flagged with duplicate_of
+            return jsonify({
+                'success': True,
+                'message': 'Expense added successfully' if 'duplicate_of' not in result
+                           else 'Expense added; it looks like a duplicate',
+                'data': result
+            }), 201
+        else:
             return jsonify({
                 'success': False,
-                'error': f'Invalid payment method. Must be one of: {", ".join(PAYMENT_METHODS)}'
-            }), 400
+                'error': result
+            }), 500
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f"Failed to create expense: {str(e)}"
+        }), 500
+
+
+@expenses_bp.route('/import', methods=['POST'])
+def import_expenses():
+    """
+    Import expenses from a CSV upload (``file``, with the CSV export's
+    headers) or JSON ({"expenses": [...]}). Rows without a category are
+    categorised by the rules; near-duplicates of stored expenses or of
+    earlier rows are skipped unless ``skip_duplicates`` is false.
+    """
+    try:
+        if 'file' in request.files:
+            rows = read_csv_rows(request.files['file'])
+            skip_duplicates = request.form.get('skip_duplicates', 'true').lower() != 'false'
+        else:
+            data = request.get_json(silent=True) or {}
+            rows = data.get('expenses')
+            skip_duplicates = data.get('skip_duplicates', True) is not False
+            if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+                return jsonify({
+                    'success': False,
+                    'error': 'Send a CSV file or {"expenses": [...]}'
+                }), 400
         
-        if not validate_amount(data.get('amount')):
+        if len(rows) > MAX_IMPORT_ROWS:
             return jsonify({
                 'success': False,
-                'error': 'Amount must be a positive number'
+                'error': f'At most {MAX_IMPORT_ROWS} expenses can be imported at once'
             }), 400
         
-        if not validate_description(data.get('description')):
+        rows = RuleManager.categorize(rows)
+        
+        # Nothing is imported unless every row is valid
+        errors = [{'row': i + 1, 'error': error} for i, error in
+                  enumerate(expense_error(row) for row in rows) if error]
+        if errors:
             return jsonify({
                 'success': False,
-                'error': 'Description must be at least 2 characters'
+                'error': f'{len(errors)} invalid rows',
+                'rows': errors[:50]
             }), 400
         
-        # Sanitize inputs
-        expense_data = {
-            'date': data.get('date'),
-            'category': data.get('category'),
-            'description': sanitize_string(data.get('description', '')),
-            'amount': float(data.get('amount')),
-            'payment_method': data.get('payment_method'),
-            'wallet': data.get('wallet'),
-            'receipt': data.get('receipt'),
-            'notes': sanitize_string(data.get('notes', '')),
-            'tags': data.get('tags', [])
-        }
-        
-        success, result = ExpenseManager.add(expense_data)
+        success, result = ExpenseManager.import_expenses([clean_expense(row) for row in rows], skip_duplicates)
         
         if success:
             return jsonify({
                 'success': True,
-                'message': 'Expense added successfully',
-                'data': result
+                'message': f"Imported {len(result['added'])} expenses",
+                'imported': len(result['added']),
+                'duplicates': result['duplicates'],
+                'data': result['added']
             }), 201
         else:
             return jsonify({
@@ -115,17 +307,24 @@ def create_expense():
     except Exception as e:
         return jsonify({
             'success': False,
-            'error': f"Failed to create expense: {str(e)}"
+            'error': f"Failed to import expenses: {str(e)}"
         }), 500
 
 
 @expenses_bp.route('/<expense_id>', methods=['GET'])
 def get_expense(expense_id):
     """Get single expense by ID"""
+    payload, status = handle_get_expense(request.args, expense_id)
+    return jsonify(payload), status
+
+
+@expenses_bp.route('/<expense_id>/history', methods=['GET'])
+def get_expense_history(expense_id):
+    """Get the revisions of an expense, oldest first, with what each changed"""
     try:
-        expense = ExpenseManager.get_by_id(expense_id)
+        history = ExpenseManager.history(expense_id)
         
-        if not expense:
+        if history is None:
             return jsonify({
                 'success': False,
                 'error': 'Expense not found'
@@ -133,13 +332,13 @@ def get_expense(expense_id):
         
         return jsonify({
             'success': True,
-            'data': expense
+            'data': history
         }), 200
     
     except Exception as e:
         return jsonify({
             'success': False,
-            'error': f"Error fetching expense: {str(e)}"
+            'error': f"Error fetching expense history: {str(e)}"
         }), 500
 
 
@@ -159,6 +358,15 @@ def update_expense(expense_id):
         if 'amount' in data and not validate_amount(data['amount']):
             return jsonify({'success': False, 'error': 'Invalid amount'}), 400
         
+        if 'currency' in data and not validate_currency(data['currency'], CURRENCIES):
+            return jsonify({'success': False, 'error': 'Invalid currency'}), 400
+        
+        if 'type' in data or 'to_wallet' in data or 'wallet' in data:
+            expense = ExpenseManager.get_by_id(expense_id)
+            error = type_error(dict(expense or {}, **data))
+            if error:
+                return jsonify({'success': False, 'error': error}), 400
+        
         # Sanitize
         if 'description' in data:
             data['description'] = sanitize_string(data['description'])
@@ -0,0 +1,42 @@
+"""
+API endpoints for auto-categorisation rules
+"""
+
+from flask import Blueprint, request, jsonify
+from models.database import RuleManager, CATEGORIES, PAYMENT_METHODS
+from models.rules import RuleError, validate_rules
+
+rules_bp = Blueprint('rules', __name__, url_prefix='/api/rules')
+
+
+@rules_bp.route('', methods=['GET'])
+def get_rules():
+    """Get the auto-categorisation rules"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': RuleManager.load()
+        }), 200
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@rules_bp.route('', methods=['POST'])
+def update_rules():
+    """Replace the auto-categorisation rules ({"default": ..., "rules": [...]})"""
+    try:
+        try:
+            rules = validate_rules(request.get_json(silent=True), CATEGORIES, PAYMENT_METHODS)
+        except RuleError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        success, msg = RuleManager.save(rules)
+        
+        return jsonify({
+            'success': success,
+            'message': msg,
+            'data': rules if success else None
+        }), 200 if success else 500
+    
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
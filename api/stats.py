@@ -4,11 +4,17 @@ API endpoints for settings, budgets, and stats
 
 from flask import Blueprint, request, jsonify
 from datetime import datetime, timedelta
-from collections import defaultdict
 from models.database import (
     ExpenseManager, SettingsManager, BudgetManager,
     CATEGORIES, CURRENCIES
 )
+from models.budgets import budget_level
+from models.history import is_month
+from models.query import QueryError, parse_query
+from models.sketches import distribution
+from models.timeseries import GRANULARITIES
+from utils.validators import validate_date
+from utils.metrics import timed
 
 settings_bp = Blueprint('settings', __name__, url_prefix='/api/settings')
 budgets_bp = Blueprint('budgets', __name__, url_prefix='/api/budgets')
@@ -42,6 +48,10 @@ def update_settings():
         if 'currency' in data and data['currency'] in CURRENCIES:
             settings['currency'] = data['currency']
         
+        # Currency of expenses booked without one; defaults to the reporting currency
+        if 'base_currency' in data and data['base_currency'] in CURRENCIES:
+            settings['base_currency'] = data['base_currency']
+        
         if 'theme' in data and data['theme'] in ['light', 'dark']:
             settings['theme'] = data['theme']
         
@@ -61,9 +71,13 @@ def update_settings():
 
 @budgets_bp.route('', methods=['GET'])
 def get_budgets():
-    """Get all budgets"""
+    """Get the default budgets, or the effective budgets of ?period=YYYY-MM"""
     try:
-        budgets = BudgetManager.load()
+        period = request.args.get('period')
+        if period is not None and not is_month(period):
+            return jsonify({'success': False, 'error': 'period must be a YYYY-MM month'}), 400
+        
+        budgets = BudgetManager.load(period)
         return jsonify({
             'success': True,
             'data': budgets
@@ -74,10 +88,18 @@ def get_budgets():
 
 @budgets_bp.route('', methods=['POST'])
 def update_budgets():
-    """Update budgets"""
+    """Update the default budgets, or the budgets of one month when a period is given"""
     try:
         data = request.get_json()
-        budgets = BudgetManager.load()
+        period = data.get('period')
+        if period is not None and not is_month(period):
+            return jsonify({'success': False, 'error': 'period must be a YYYY-MM month'}), 400
+        
+        if period is not None and BudgetManager.is_closed(period):
+            return jsonify({'success': False, 'error': f"Budget period {period} is closed"}), 409
+        
+        # A period only stores the fields it overrides
+        budgets = BudgetManager.load() if period is None else BudgetManager.load_period(period)
         
         # Update category budgets
         for category in CATEGORIES:
@@ -94,161 +116,373 @@ def update_budgets():
             except (ValueError, TypeError):
                 pass
         
-        # Calculate total
-        budgets['total'] = sum(budgets.get(cat, 0) for cat in CATEGORIES)
+        # Carry unspent category budgets into the next month
+        if 'carry_over' in data:
+            budgets['carry_over'] = bool(data['carry_over'])
         
-        success, msg = BudgetManager.save(budgets)
+        if period is None:
+            # Calculate total
+            budgets['total'] = sum(budgets.get(cat, 0) for cat in CATEGORIES)
+        
+        success, msg = BudgetManager.save(budgets, period)
         
         return jsonify({
             'success': success,
             'message': msg,
-            'data': budgets if success else None
+            'data': (budgets if period is None else BudgetManager.load(period)) if success else None
         }), 200 if success else 500
     
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-# ===== STATISTICS API =====
-
-@stats_bp.route('', methods=['GET'])
-def get_stats():
-    """Get comprehensive statistics"""
+@budgets_bp.route('/alerts', methods=['GET'])
+def get_budget_alerts():
+    """Get the newest budget threshold alerts"""
     try:
-        expenses = ExpenseManager.load()
-        today = datetime.now().strftime('%Y-%m-%d')
-        this_month_start = datetime.now().strftime('%Y-%m-01')
-        this_week_start = (datetime.now() - timedelta(days=datetime.now().weekday())).strftime('%Y-%m-%d')
-        
-        # Filter expenses
-        today_expenses = [e for e in expenses if e.get('date') == today]
-        this_month_expenses = [e for e in expenses if e.get('date') >= this_month_start]
-        this_week_expenses = [e for e in expenses if e.get('date') >= this_week_start]
-        
-        # Calculate totals
-        def sum_expenses(exp_list):
-            return sum(e.get('amount', 0) for e in exp_list)
-        
-        total_all = sum_expenses(expenses)
-        total_today = sum_expenses(today_expenses)
-        total_week = sum_expenses(this_week_expenses)
-        total_month = sum_expenses(this_month_expenses)
-        
-        # Category breakdown
-        category_breakdown = defaultdict(float)
-        for expense in this_month_expenses:
-            category_breakdown[expense.get('category')] += expense.get('amount', 0)
-        
-        # Budget comparison
-        budgets = BudgetManager.load()
-        budget_status = {}
-        for category in CATEGORIES:
-            spent = category_breakdown.get(category, 0)
-            budget = budgets.get(category, 0)
-            percentage = (spent / budget * 100) if budget > 0 else 0
-            
-            status = 'success'
-            if percentage >= 100:
-                status = 'danger'
-            elif percentage >= 80:
-                status = 'warning'
-            
-            budget_status[category] = {
-                'spent': spent,
-                'budget': budget,
-                'remaining': max(0, budget - spent),
-                'percentage': min(100, percentage),
-                'status': status
-            }
-        
-        stats = {
-            'total': {
-                'all_time': total_all,
-                'this_month': total_month,
-                'this_week': total_week,
-                'today': total_today
-            },
-            'count': {
-                'total': len(expenses),
-                'this_month': len(this_month_expenses)
-            },
-            'average': {
-                'per_expense': total_month / len(this_month_expenses) if this_month_expenses else 0,
-                'per_day': total_month / max(1, datetime.now().day)
-            },
-            'highest': {
-                'amount': max((e.get('amount', 0) for e in this_month_expenses), default=0),
-                'category': max(category_breakdown.items(), default=('None', 0))[0]
-            },
-            'category_breakdown': dict(category_breakdown),
-            'budget_status': budget_status,
-            'monthly_progress': (total_month / budgets.get('total', 1) * 100) if budgets.get('total') else 0
-        }
-        
+        limit = request.args.get('limit', 50, type=int)
         return jsonify({
             'success': True,
-            'data': stats
+            'data': BudgetManager.alerts(max(1, min(limit, 200)))
         }), 200
-    
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@stats_bp.route('/daily', methods=['GET'])
-def get_daily_chart():
-    """Get daily spending data for charts"""
-    try:
-        expenses = ExpenseManager.load()
-        this_month_start = datetime.now().strftime('%Y-%m-01')
+# ===== STATISTICS =====
+# Pure builders of the statistics handlers below
+
+def stats_window(now):
+    """Get the (today, month start, week start) date bounds of the dashboard"""
+    today = now.strftime('%Y-%m-%d')
+    this_month_start = now.strftime('%Y-%m-01')
+    this_week_start = (now - timedelta(days=now.weekday())).strftime('%Y-%m-%d')
+    return today, this_month_start, this_week_start
+
+
+@timed('aggregate')
+def build_stats(dashboard, budgets, now):
+    """Build dashboard statistics from the partition summary totals"""
+    total_month = dashboard['this_month']
+    month_count = dashboard['month_count']
+    
+    # Category breakdown
+    category_breakdown = dashboard['categories']
+    
+    # Budget comparison
+    budget_status = {}
+    for category in CATEGORIES:
+        spent = category_breakdown.get(category, 0)
+        budget = budgets.get(category, 0)
+        percentage = (spent / budget * 100) if budget > 0 else 0
         
-        # Filter this month
-        month_expenses = [e for e in expenses if e.get('date') >= this_month_start]
+        budget_status[category] = {
+            'spent': spent,
+            'budget': budget,
+            'remaining': max(0, budget - spent),
+            'percentage': min(100, percentage),
+            'status': budget_level(spent, budget)
+        }
+    
+    return {
+        'total': {
+            'all_time': dashboard['all_time'],
+            'this_month': total_month,
+            'this_week': dashboard['this_week'],
+            'today': dashboard['today']
+        },
+        'count': {
+            'total': dashboard['count'],
+            'this_month': month_count
+        },
+        'average': {
+            'per_expense': total_month / month_count if month_count else 0,
+            'per_day': total_month / max(1, now.day)
+        },
+        'highest': {
+            'amount': dashboard['highest'],
+            'category': max(category_breakdown.items(), default=('None', 0))[0]
+        },
+        # Median / p90 / p99 of this month, overall and per category
+        'distribution': distribution([dashboard]),
+        'category_breakdown': dict(category_breakdown),
+        'budget_status': budget_status,
+        'monthly_progress': (total_month / budgets.get('total', 1) * 100) if budgets.get('total') else 0
+    }
+
+
+def validate_series_args(start, end, granularity):
+    """Get the error in time series arguments, or None"""
+    for value in (start, end):
+        if value is not None and not validate_date(value):
+            return 'from and to must be YYYY-MM-DD dates'
+    if start and end and start > end:
+        return 'from must not be after to'
+    if granularity not in GRANULARITIES + ('auto',):
+        return f"granularity must be one of: {', '.join(GRANULARITIES + ('auto',))}"
+    return None
+
+
+@timed('aggregate')
+def build_history_chart(months):
+    """Get (labels, actual, budget) series of a budget history"""
+    return (
+        [m['month'] for m in months],
+        [m['total'] for m in months],
+        [m['budget']['budget'] for m in months]
+    )
+
+
+@timed('aggregate')
+def build_daily_chart(month_summary):
+    """Get (labels, data) of the daily totals in a month summary"""
+    sorted_daily = sorted(month_summary.get('days', {}).items())
+    return [d[0] for d in sorted_daily], [d[1] for d in sorted_daily]
+
+
+@timed('aggregate')
+def build_category_chart(month_summary):
+    """Get (labels, data) of the category totals in a month summary, largest first"""
+    categories = dict(month_summary.get('categories', {}))
+    
+    # Include all categories for consistency
+    for cat in CATEGORIES:
+        categories.setdefault(cat, 0)
+    
+    # Sort by amount descending
+    sorted_cats = sorted(categories.items(), key=lambda x: x[1], reverse=True)
+    return [c[0] for c in sorted_cats], [c[1] for c in sorted_cats]
+
+
+# ===== SHARED HANDLERS =====
+# Return (payload, status); called by the Flask routes below and the ASGI entry point
+
+def handle_get_stats(args):
+    """Get comprehensive statistics"""
+    try:
+        now = datetime.now()
+        today, _, this_week_start = stats_window(now)
         
-        # Group by date
-        daily = defaultdict(float)
-        for expense in month_expenses:
-            daily[expense.get('date')] += expense.get('amount', 0)
+        # Served from the manifest summaries; no partition is opened
+        dashboard = ExpenseManager.dashboard_totals(today, this_week_start)
+        stats = build_stats(dashboard, BudgetManager.load(today[:7]), now)
         
-        # Sort by date
-        sorted_daily = sorted(daily.items())
+        return {
+            'success': True,
+            'data': stats,
+            'unconverted': ExpenseManager.unconverted()
+        }, 200
+    
+    except Exception as e:
+        return {'success': False, 'error': str(e)}, 500
+
+
+def handle_get_daily_chart(args):
+    """Get daily spending data for charts"""
+    try:
+        summary = ExpenseManager.month_summary(datetime.now().strftime('%Y-%m'))
+        labels, data = build_daily_chart(summary)
         
-        return jsonify({
+        return {
             'success': True,
-            'labels': [d[0] for d in sorted_daily],
-            'data': [d[1] for d in sorted_daily]
-        }), 200
+            'labels': labels,
+            'data': data,
+            'unconverted': summary.get('unconverted', [])
+        }, 200
     
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return {'success': False, 'error': str(e)}, 500
 
 
-@stats_bp.route('/category', methods=['GET'])
-def get_category_chart():
+def handle_get_category_chart(args):
     """Get category distribution for charts"""
     try:
-        expenses = ExpenseManager.load()
-        this_month_start = datetime.now().strftime('%Y-%m-01')
+        summary = ExpenseManager.month_summary(datetime.now().strftime('%Y-%m'))
+        labels, data = build_category_chart(summary)
+        
+        return {
+            'success': True,
+            'labels': labels,
+            'data': data,
+            'unconverted': summary.get('unconverted', [])
+        }, 200
+    
+    except Exception as e:
+        return {'success': False, 'error': str(e)}, 500
+
+
+def handle_run_stats_query(args):
+    """Group by any fields with ?group_by=month,category&metric=sum,count&filter=wallet:Cash&from=&to="""
+    try:
+        try:
+            query = parse_query(
+                args.get('group_by'), args.get('metric'),
+                args.get('filter'), args.get('from'), args.get('to')
+            )
+        except QueryError as e:
+            return {'success': False, 'error': str(e)}, 400
         
-        # Filter this month
-        month_expenses = [e for e in expenses if e.get('date') >= this_month_start]
+        result = ExpenseManager.query(query)
+        return {
+            'success': True,
+            'data': result['rows'],
+            'plan': result['plan'],
+            'unconverted': ExpenseManager.unconverted(query['from'], query['to'])
+        }, 200
+    except Exception as e:
+        return {'success': False, 'error': str(e)}, 500
+
+
+def handle_get_timeseries(args):
+    """Get spending between ?from= and ?to= (YYYY-MM-DD) by ?granularity=day|week|month|year|auto, optionally for one ?category="""
+    try:
+        start = args.get('from')
+        end = args.get('to')
+        granularity = args.get('granularity', 'auto')
+        error = validate_series_args(start, end, granularity)
+        if error:
+            return {'success': False, 'error': error}, 400
         
-        # Group by category
-        categories = defaultdict(float)
-        for expense in month_expenses:
-            categories[expense.get('category')] += expense.get('amount', 0)
+        return dict(
+            ExpenseManager.timeseries(start, end, granularity, args.get('category')),
+            success=True,
+            unconverted=ExpenseManager.unconverted(start, end)
+        ), 200
+    except Exception as e:
+        return {'success': False, 'error': str(e)}, 500
+
+
+def handle_get_forecast(args):
+    """Get end-of-month and next-month spending forecasts, per category and overall"""
+    try:
+        return {
+            'success': True,
+            'data': ExpenseManager.forecast()
+        }, 200
+    except Exception as e:
+        return {'success': False, 'error': str(e)}, 500
+
+
+def handle_get_percentiles(args):
+    """Get the median, p90 and p99 of amounts overall and per category between ?from= and ?to= (YYYY-MM)"""
+    try:
+        start = args.get('from')
+        end = args.get('to')
+        for value in (start, end):
+            if value is not None and not is_month(value):
+                return {'success': False, 'error': 'from and to must be YYYY-MM months'}, 400
         
-        # Include all categories for consistency
-        for cat in CATEGORIES:
-            categories.setdefault(cat, 0)
+        return {
+            'success': True,
+            'data': ExpenseManager.distribution(start, end)
+        }, 200
+    except Exception as e:
+        return {'success': False, 'error': str(e)}, 500
+
+
+def handle_get_anomalies(args):
+    """Get expenses between ?from= and ?to= (YYYY-MM-DD) far outside their category's typical range"""
+    try:
+        start = args.get('from')
+        end = args.get('to')
+        for value in (start, end):
+            if value is not None and not validate_date(value):
+                return {'success': False, 'error': 'from and to must be YYYY-MM-DD dates'}, 400
+        
+        anomalies = ExpenseManager.anomalies(start, end)
+        return {
+            'success': True,
+            'data': anomalies,
+            'count': len(anomalies)
+        }, 200
+    except Exception as e:
+        return {'success': False, 'error': str(e)}, 500
+
+
+def handle_get_history(args):
+    """Get monthly budget vs actual between ?from= and ?to= (YYYY-MM), served from month-close snapshots"""
+    try:
+        start = args.get('from')
+        end = args.get('to')
+        for value in (start, end):
+            if value is not None and not is_month(value):
+                return {'success': False, 'error': 'from and to must be YYYY-MM months'}, 400
         
-        # Sort by amount descending
-        sorted_cats = sorted(categories.items(), key=lambda x: x[1], reverse=True)
+        months = BudgetManager.history(start, end)
+        labels, actual, budget = build_history_chart(months)
         
-        return jsonify({
+        return {
             'success': True,
-            'labels': [c[0] for c in sorted_cats],
-            'data': [c[1] for c in sorted_cats]
-        }), 200
+            'data': months,
+            'labels': labels,
+            'actual': actual,
+            'budget': budget
+        }, 200
     
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return {'success': False, 'error': str(e)}, 500
+
+
+# ===== STATISTICS API =====
+
+@stats_bp.route('', methods=['GET'])
+def get_stats():
+    """Get comprehensive statistics"""
+    payload, status = handle_get_stats(request.args)
+    return jsonify(payload), status
+
+
+@stats_bp.route('/daily', methods=['GET'])
+def get_daily_chart():
+    """Get daily spending data for charts"""
+    payload, status = handle_get_daily_chart(request.args)
+    return jsonify(payload), status
+
+
+@stats_bp.route('/category', methods=['GET'])
+def get_category_chart():
+    """Get category distribution for charts"""
+    payload, status = handle_get_category_chart(request.args)
+    return jsonify(payload), status
+
+
+@stats_bp.route('/query', methods=['GET'])
+def run_stats_query():
+    """Group by any fields with ?group_by=month,category&metric=sum,count&filter=wallet:Cash&from=&to="""
+    payload, status = handle_run_stats_query(request.args)
+    return jsonify(payload), status
+
+
+@stats_bp.route('/timeseries', methods=['GET'])
+def get_timeseries():
+    """Get spending between ?from= and ?to= (YYYY-MM-DD) by ?granularity=day|week|month|year|auto, optionally for one ?category="""
+    payload, status = handle_get_timeseries(request.args)
+    return jsonify(payload), status
+
+
+@stats_bp.route('/forecast', methods=['GET'])
+def get_forecast():
+    """Get end-of-month and next-month spending forecasts, per category and overall"""
+    payload, status = handle_get_forecast(request.args)
+    return jsonify(payload), status
+
+
+@stats_bp.route('/percentiles', methods=['GET'])
+def get_percentiles():
+    """Get the median, p90 and p99 of amounts overall and per category between ?from= and ?to= (YYYY-MM)"""
+    payload, status = handle_get_percentiles(request.args)
+    return jsonify(payload), status
+
+
+@stats_bp.route('/anomalies', methods=['GET'])
+def get_anomalies():
+    """Get expenses between ?from= and ?to= (YYYY-MM-DD) far outside their category's typical range"""
+    payload, status = handle_get_anomalies(request.args)
+    return jsonify(payload), status
+
+
+@stats_bp.route('/history', methods=['GET'])
+def get_history():
+    """Get monthly budget vs actual between ?from= and ?to= (YYYY-MM), served from month-close snapshots"""
+    payload, status = handle_get_history(request.args)
+    return jsonify(payload), status
@@ -0,0 +1,78 @@
+"""
+API endpoints for wallet balances
+"""
+
+from flask import Blueprint, request, jsonify
+from models.database import WalletManager
+from utils.validators import validate_date
+
+wallets_bp = Blueprint('wallets', __name__, url_prefix='/api/wallets')
+
+
+# ===== SHARED HANDLERS =====
+# Return (payload, status); called by the Flask routes below and the ASGI entry point
+
+def handle_get_wallets(args):
+    """Get the balance of every wallet, now or at the end of ?date=YYYY-MM-DD"""
+    try:
+        day = args.get('date')
+        if day is not None and not validate_date(day):
+            return {'success': False, 'error': 'Invalid date format. Use YYYY-MM-DD'}, 400
+        
+        return {
+            'success': True,
+            'data': WalletManager.balances(day)
+        }, 200
+    except Exception as e:
+        return {'success': False, 'error': str(e)}, 500
+
+
+def handle_get_wallet_history(args, wallet):
+    """Get the balance of a wallet over time between ?from= and ?to= (YYYY-MM-DD)"""
+    try:
+        start = args.get('from')
+        end = args.get('to')
+        for value in (start, end):
+            if value is not None and not validate_date(value):
+                return {'success': False, 'error': 'from and to must be YYYY-MM-DD dates'}, 400
+        
+        balance = next((w for w in WalletManager.balances() if w['name'] == wallet), None)
+        if balance is None:
+            return {'success': False, 'error': 'Wallet not found'}, 404
+        
+        return {
+            'success': True,
+            'wallet': wallet,
+            'data': WalletManager.history(wallet, start, end),
+            'unconverted': balance['unconverted']
+        }, 200
+    except Exception as e:
+        return {'success': False, 'error': str(e)}, 500
+
+
+# ===== WALLETS API =====
+
+@wallets_bp.route('', methods=['GET'])
+def get_wallets():
+    """Get the balance of every wallet, now or at the end of ?date=YYYY-MM-DD"""
+    payload, status = handle_get_wallets(request.args)
+    return jsonify(payload), status
+
+
+@wallets_bp.route('/<wallet>/history', methods=['GET'])
+def get_wallet_history(wallet):
+    """Get the balance of a wallet over time between ?from= and ?to= (YYYY-MM-DD)"""
+    payload, status = handle_get_wallet_history(request.args, wallet)
+    return jsonify(payload), status
+
+
+@wallets_bp.route('/reconcile', methods=['POST'])
+def reconcile_wallets():
+    """Rebuild wallet balances from the ledger and report any drift"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': WalletManager.reconcile()
+        }), 200
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
@@ -1,102 +1,15 @@
 from flask import Flask, render_template, request, jsonify
 from datetime import datetime, timedelta
-import json
-import os
-from collections import defaultdict
-import uuid
+from models.database import (
+    ExpenseManager, SettingsManager, BudgetManager, RuleManager,
+    CATEGORIES, PAYMENT_METHODS, CURRENCIES
+)
 
 app = Flask(__name__)
 app.config['JSON_SORT_KEYS'] = False
 
-# Database files
-DATA_FILE = 'expenses.json'
-SETTINGS_FILE = 'settings.json'
-BUDGETS_FILE = 'budgets.json'
-
-# Constants
-CATEGORIES = ['Food', 'Transportation', 'Entertainment', 'Shopping', 'Utilities', 'Healthcare', 'Others']
-PAYMENT_METHODS = ['Cash', 'UPI', 'Card', 'Bank Transfer']
-
-CURRENCIES = {
-    'USD': {'symbol': '$', 'name': 'US Dollar'},
-    'EUR': {'symbol': '€', 'name': 'Euro'},
-    'GBP': {'symbol': '£', 'name': 'British Pound'},
-    'INR': {'symbol': '₹', 'name': 'Indian Rupee'},
-    'BDT': {'symbol': '৳', 'name': 'Bangladeshi Taka'},
-    'JPY': {'symbol': '¥', 'name': 'Japanese Yen'},
-    'AUD': {'symbol': 'A$', 'name': 'Australian Dollar'},
-    'CAD': {'symbol': 'C$', 'name': 'Canadian Dollar'},
-    'CHF': {'symbol': 'CHF', 'name': 'Swiss Franc'},
-    'SGD': {'symbol': 'S$', 'name': 'Singapore Dollar'}
-}
-
-DEFAULT_SETTINGS = {
-    'currency': 'USD',
-    'theme': 'dark',
-    'wallets': [
-        {'id': 1, 'name': 'Cash', 'balance': 0},
-        {'id': 2, 'name': 'Bank', 'balance': 0},
-        {'id': 3, 'name': 'Paytm', 'balance': 0},
-        {'id': 4, 'name': 'Credit Card', 'balance': 0}
-    ]
-}
-
-DEFAULT_BUDGETS = {
-    'Food': 250,
-    'Transportation': 150,
-    'Entertainment': 200,
-    'Shopping': 300,
-    'Utilities': 150,
-    'Healthcare': 100,
-    'Others': 100,
-    'total': 1250
-}
-
-# Database operations
-def load_expenses():
-    """Load expenses from JSON file"""
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return []
-    return []
-
-def save_expenses(expenses):
-    """Save expenses to JSON file"""
-    with open(DATA_FILE, 'w') as f:
-        json.dump(expenses, f, indent=2)
-
-def load_settings():
-    """Load settings from JSON file"""
-    if os.path.exists(SETTINGS_FILE):
-        try:
-            with open(SETTINGS_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return DEFAULT_SETTINGS.copy()
-    return DEFAULT_SETTINGS.copy()
-
-def save_settings(settings):
-    """Save settings to JSON file"""
-    with open(SETTINGS_FILE, 'w') as f:
-        json.dump(settings, f, indent=2)
-
-def load_budgets():
-    """Load budgets from JSON file"""
-    if os.path.exists(BUDGETS_FILE):
-        try:
-            with open(BUDGETS_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return DEFAULT_BUDGETS.copy()
-    return DEFAULT_BUDGETS.copy()
-
-def save_budgets(budgets):
-    """Save budgets to JSON file"""
-    with open(BUDGETS_FILE, 'w') as f:
-        json.dump(budgets, f, indent=2)
+# Expenses, settings and budgets live in the shared storage engine
+# (models/storage.py); move an old ./expenses.json into data/ to import it
 
 # Routes
 @app.route('/')
@@ -107,7 +20,7 @@ def index():
 @app.route('/api/settings', methods=['GET'])
 def get_settings():
     """Get current settings with available currencies and categories"""
-    settings = load_settings()
+    settings = SettingsManager.load()
     settings['currencies'] = CURRENCIES
     settings['categories'] = CATEGORIES
     settings['payment_methods'] = PAYMENT_METHODS
@@ -117,22 +30,26 @@ def get_settings():
 def update_settings():
     """Update settings"""
     data = request.get_json()
-    settings = load_settings()
+    settings = SettingsManager.load()
     
     if 'currency' in data:
         settings['currency'] = data['currency']
+    if 'base_currency' in data:
+        settings['base_currency'] = data['base_currency']
     if 'theme' in data:
         settings['theme'] = data['theme']
     if 'wallets' in data:
         settings['wallets'] = data['wallets']
     
-    save_settings(settings)
+    success, msg = SettingsManager.save(settings)
+    if not success:
+        return jsonify({'error': msg}), 500
     return jsonify(settings)
 
 @app.route('/api/expenses', methods=['GET'])
 def get_expenses():
     """Get all expenses with optional sorting"""
-    expenses = load_expenses()
+    expenses = ExpenseManager.load()
     sort_by = request.args.get('sort', 'date')
     order = request.args.get('order', 'desc')
     
@@ -148,7 +65,8 @@ def get_expenses():
 @app.route('/api/expenses', methods=['POST'])
 def add_expense():
     """Add new expense with full validation"""
-    data = request.get_json()
+    # Expenses sent without a category are categorised by the rules
+    data = RuleManager.categorize([request.get_json()])[0]
     
     # Comprehensive validation
     try:
@@ -174,61 +92,65 @@ def add_expense():
     if not payment_method or payment_method not in PAYMENT_METHODS:
         return jsonify({'error': 'Valid payment method is required'}), 400
     
-    expenses = load_expenses()
+    currency = data.get('currency')
+    if currency is not None and currency not in CURRENCIES:
+        return jsonify({'error': 'Valid currency is required'}), 400
     
-    new_expense = {
-        'id': str(uuid.uuid4()),
+    success, new_expense = ExpenseManager.add({
         'date': data.get('date'),
         'category': category,
         'description': description,
         'amount': amount,
+        'currency': currency,
         'payment_method': payment_method,
         'wallet': data.get('wallet', ''),
         'receipt': data.get('receipt', ''),
-        'notes': data.get('notes', ''),
-        'timestamp': datetime.now().isoformat()
-    }
-    
-    expenses.append(new_expense)
-    save_expenses(expenses)
+        'notes': data.get('notes', '')
+    })
+    if not success:
+        return jsonify({'error': new_expense}), 500
     
     return jsonify(new_expense), 201
 
 @app.route('/api/expenses/<expense_id>', methods=['DELETE'])
 def delete_expense(expense_id):
     """Delete an expense by ID"""
-    expenses = load_expenses()
-    original_length = len(expenses)
-    expenses = [e for e in expenses if e['id'] != expense_id]
-    
-    if len(expenses) == original_length:
+    if ExpenseManager.get_by_id(expense_id) is None:
         return jsonify({'error': 'Expense not found'}), 404
     
-    save_expenses(expenses)
+    success, msg = ExpenseManager.delete(expense_id)
+    if not success:
+        return jsonify({'error': msg}), 500
     return jsonify({'message': 'Expense deleted'})
 
 @app.route('/api/budgets', methods=['GET'])
 def get_budgets():
     """Get all budgets"""
-    budgets = load_budgets()
+    budgets = BudgetManager.load()
     return jsonify(budgets)
 
 @app.route('/api/budgets', methods=['POST'])
 def update_budgets():
     """Update budgets"""
     data = request.get_json()
-    save_budgets(data)
+    success, msg = BudgetManager.save(data)
+    if not success:
+        return jsonify({'error': msg}), 500
     return jsonify(data)
 
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     """Get comprehensive statistics"""
-    expenses = load_expenses()
-    budgets = load_budgets()
+    budgets = BudgetManager.load()
     now = datetime.now()
-    current_month = now.strftime('%Y-%m')
+    today = now.strftime('%Y-%m-%d')
+    start_of_week = (now - timedelta(days=now.weekday())).strftime('%Y-%m-%d')
+    
+    # Served from the partition summaries; no expense is loaded
+    totals = ExpenseManager.totals()
+    dashboard = ExpenseManager.dashboard_totals(today, start_of_week)
     
-    if not expenses:
+    if not totals['count']:
         return jsonify({
             'total_spent': 0,
             'month_spent': 0,
@@ -244,22 +166,11 @@ def get_stats():
             'average_expense': 0
         })
     
-    total_spent = sum(e['amount'] for e in expenses)
-    month_spent = sum(e['amount'] for e in expenses if e['date'].startswith(current_month))
-    
-    # Weekly stats
-    start_of_week = now - timedelta(days=now.weekday())
-    week_spent = sum(e['amount'] for e in expenses if datetime.strptime(e['date'], '%Y-%m-%d').date() >= start_of_week.date())
-    
-    # Today stats
-    today = now.strftime('%Y-%m-%d')
-    today_spent = sum(e['amount'] for e in expenses if e['date'] == today)
+    total_spent = totals['total']
+    month_spent = dashboard['this_month']
     
     # Category breakdown
-    category_spent = defaultdict(float)
-    for expense in expenses:
-        if expense['date'].startswith(current_month):
-            category_spent[expense['category']] += expense['amount']
+    category_spent = dashboard['categories']
     
     # Budget status
     budget_status = {}
@@ -277,32 +188,29 @@ def get_stats():
     return jsonify({
         'total_spent': total_spent,
         'month_spent': month_spent,
-        'week_spent': week_spent,
-        'today_spent': today_spent,
+        'week_spent': dashboard['this_week'],
+        'today_spent': dashboard['today'],
         'month_budget': budgets.get('total', 0),
         'month_remaining': max(0, budgets.get('total', 0) - month_spent),
         'month_budget_percentage': (month_spent / budgets.get('total', 1) * 100) if budgets.get('total', 0) > 0 else 0,
-        'expense_count': len(expenses),
+        'expense_count': totals['count'],
         'category_spent': dict(category_spent),
         'budget_status': budget_status,
-        'highest_expense': max(e['amount'] for e in expenses),
-        'average_expense': total_spent / len(expenses)
+        'highest_expense': totals['highest'],
+        'average_expense': total_spent / totals['count']
     })
 
 @app.route('/api/charts/daily', methods=['GET'])
 def get_daily_chart():
     """Get daily expense chart data"""
-    expenses = load_expenses()
     month = request.args.get('month', datetime.now().strftime('%Y-%m'))
     category = request.args.get('category', '')
     
-    filtered = [e for e in expenses if e['date'].startswith(month)]
+    summary = ExpenseManager.month_summary(month)
     if category:
-        filtered = [e for e in filtered if e['category'] == category]
-    
-    daily_data = defaultdict(float)
-    for expense in filtered:
-        daily_data[expense['date']] += expense['amount']
+        daily_data = summary.get('category_days', {}).get(category, {})
+    else:
+        daily_data = summary.get('days', {})
     
     sorted_dates = sorted(daily_data.keys())
     
@@ -315,14 +223,9 @@ def get_daily_chart():
 @app.route('/api/charts/category', methods=['GET'])
 def get_category_chart():
     """Get category distribution chart data"""
-    expenses = load_expenses()
     month = request.args.get('month', datetime.now().strftime('%Y-%m'))
     
-    filtered = [e for e in expenses if e['date'].startswith(month)]
-    
-    category_data = defaultdict(float)
-    for expense in filtered:
-        category_data[expense['category']] += expense['amount']
+    category_data = ExpenseManager.month_summary(month).get('categories', {})
     
     labels = list(category_data.keys())
     data = list(category_data.values())
@@ -3,21 +3,48 @@ Expense Tracker - Production Ready Flask Application
 Complete refactor with modular architecture, security, and best practices
 """
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 import os
+import time
 from datetime import datetime
 
 # Import API blueprints
 from api.expenses import expenses_bp
 from api.stats import settings_bp, budgets_bp, stats_bp
 from api.upload import upload_bp
-from models.database import CATEGORIES, PAYMENT_METHODS, CURRENCIES
+from api.events import events_bp
+from api.wallets import wallets_bp
+from api.rules import rules_bp
+from api.backups import backups_bp
+from models.database import CATEGORIES, PAYMENT_METHODS, CURRENCIES, get_registry
+from models.tenants import TenantError, current_tenant
+from utils.logger import setup_logging, current_request_id, new_request_id, log_access
+from utils.metrics import METRICS, Profiler, current_endpoint, span
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """JSON provider that times response serialisation as a request span"""
+
+    def dumps(self, obj, **kwargs):
+        with span('serialize'):
+            return super().dumps(obj, **kwargs)
+
 
 # Initialize Flask app
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-key-change-in-production')
 app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024  # 5MB max upload size
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'static', 'uploads')
+# Only trust X-Tenant-ID when an authenticating proxy sets it
+app.config['TRUST_TENANT_HEADER'] = os.environ.get('TRUST_TENANT_HEADER') == '1'
+# Profiling is off unless PROFILE_DIR is set; then X-Profile: 1 or the sample rate triggers it
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR')
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+app.json = TimedJSONProvider(app)
+
+profiler = Profiler(app.config['PROFILE_DIR'], app.config['PROFILE_SAMPLE_RATE'])
+setup_logging()
 
 # Register API blueprints
 app.register_blueprint(expenses_bp)
@@ -25,6 +52,10 @@ app.register_blueprint(settings_bp)
 app.register_blueprint(budgets_bp)
 app.register_blueprint(stats_bp)
 app.register_blueprint(upload_bp)
+app.register_blueprint(events_bp)
+app.register_blueprint(wallets_bp)
+app.register_blueprint(rules_bp)
+app.register_blueprint(backups_bp)
 
 
 # ===== ERROR HANDLERS =====
@@ -67,6 +98,12 @@ def index():
         return render_template('500.html'), 500
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Request and span latencies in the Prometheus text format"""
+    return Response(METRICS.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -91,10 +128,78 @@ def inject_constants():
 # ===== LOGGING & MONITORING =====
 
 @app.before_request
-def log_request():
-    """Log incoming requests"""
+def start_timer():
+    """Assign the request ID and start timing the request, and profiling it when sampled"""
+    request.request_id_token = current_request_id.set(new_request_id(request.headers.get('X-Request-ID')))
+    endpoint = request.url_rule.rule if request.url_rule else '<unmatched>'
+    request.endpoint_token = current_endpoint.set(endpoint)
+    request.started_at = time.perf_counter()
+    request.profile = profiler.start() if profiler.wants(request.headers) else None
+
+
+@app.after_request
+def record_timing(response):
+    """Record the request latency, write the access log and dump the profile"""
+    started_at = getattr(request, 'started_at', None)
+    if started_at is None:
+        return response
+    elapsed = time.perf_counter() - started_at
+    endpoint = current_endpoint.get()
+    METRICS.observe_request(request.method, endpoint, response.status_code, elapsed)
     if not request.path.startswith('/static'):
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {request.method} {request.path}")
+        log_access(request.method, request.path, endpoint, response.status_code, elapsed)
+    response.headers['X-Request-ID'] = current_request_id.get()
+    profile = getattr(request, 'profile', None)
+    if profile is not None:
+        request.profile = None
+        response.headers['X-Profile-File'] = os.path.basename(profiler.stop(profile, endpoint, elapsed))
+    return response
+
+
+@app.teardown_request
+def stop_timer(exc):
+    """Stop timing once the request is done"""
+    profile = getattr(request, 'profile', None)
+    if profile is not None:
+        profiler.stop(profile, current_endpoint.get(), time.perf_counter() - request.started_at)
+    token = getattr(request, 'endpoint_token', None)
+    if token is not None:
+        current_endpoint.reset(token)
+    token = getattr(request, 'request_id_token', None)
+    if token is not None:
+        current_request_id.reset(token)
+
+
+# ===== TENANCY =====
+
+@app.before_request
+def resolve_tenant():
+    """Scope storage to the tenant named by the request"""
+    if not request.path.startswith('/api/'):
+        return None
+    registry = get_registry()
+    try:
+        tenant_id = registry.resolve(
+            request.headers, trust_header=app.config['TRUST_TENANT_HEADER']
+        )
+    except TenantError as e:
+        return jsonify({'success': False, 'error': str(e)}), 401
+    # Pinned, so the store is not evicted while the request uses it
+    request.tenant_pin = (registry, registry.acquire(tenant_id))
+    request.tenant_token = current_tenant.set(tenant_id)
+    return None
+
+
+@app.teardown_request
+def reset_tenant(exc):
+    """Restore the default tenant and unpin its store once the request is done"""
+    token = getattr(request, 'tenant_token', None)
+    if token is not None:
+        current_tenant.reset(token)
+    pin = getattr(request, 'tenant_pin', None)
+    if pin is not None:
+        registry, store = pin
+        registry.release(store)
 
 
 # ===== CORS & SECURITY =====
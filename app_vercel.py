@@ -1,17 +1,17 @@
 from flask import Flask, render_template, request, jsonify
 from datetime import datetime, timedelta
-import json
-import os
 from collections import defaultdict
+from models import database
+from models.database import ExpenseManager, SettingsManager, BudgetManager, get_expense_store
+from models.wallets import is_spending
 
 app = Flask(__name__)
 app.config['JSON_SORT_KEYS'] = False
 
 # Use in-memory storage for Vercel compatibility
 # Data persists during session but resets on redeploy
-expenses_db = None
-settings_db = None
-budgets_db = None
+database.set_storage_backend('memory')
+_seeded = False
 
 # Currency definitions
 CURRENCIES = {
@@ -61,41 +61,43 @@ DEFAULT_BUDGETS = {
     'Others': 100
 }
 
-def load_expenses():
-    """Load expenses from database"""
-    global expenses_db
-    if expenses_db is None:
-        expenses_db = SAMPLE_EXPENSES.copy()
-    return expenses_db
+@app.before_request
+def seed_storage():
+    """Load the sample ledger and defaults into a fresh in-memory store"""
+    global _seeded
+    if _seeded:
+        return
+    store = get_expense_store()
+    if not ExpenseManager.totals()['count']:
+        ExpenseManager.save(SAMPLE_EXPENSES)
+    if store.load_document('settings') is None:
+        SettingsManager.save(DEFAULT_SETTINGS)
+    if store.load_document('budgets') is None:
+        BudgetManager.save(DEFAULT_BUDGETS)
+    _seeded = True
 
-def save_expenses(expenses):
-    """Save expenses to database"""
-    global expenses_db
-    expenses_db = expenses
+def expense_categories(expense):
+    """Get the category list of a stored expense"""
+    return expense.get('categories') or [expense.get('category')]
 
-def load_settings():
-    """Load settings from database"""
-    global settings_db
-    if settings_db is None:
-        settings_db = DEFAULT_SETTINGS.copy()
-    return settings_db
+def to_response(expense):
+    """Present a stored expense with this app's category list"""
+    return dict(expense, categories=expense_categories(expense))
 
-def save_settings(settings):
-    """Save settings to database"""
-    global settings_db
-    settings_db = settings
-
-def load_budgets():
-    """Load budgets from database"""
-    global budgets_db
-    if budgets_db is None:
-        budgets_db = DEFAULT_BUDGETS.copy()
-    return budgets_db
-
-def save_budgets(budgets):
-    """Save budgets to database"""
-    global budgets_db
-    budgets_db = budgets
+def filter_expenses(categories, month):
+    """Load the spending of a month (all when empty) in any of the given categories"""
+    if month:
+        expenses = [
+            e for e in ExpenseManager.load_range(f"{month}-01", f"{month}-31")
+            if (e.get('date') or '').startswith(month)
+        ]
+    else:
+        expenses = ExpenseManager.load()
+    # Income and transfers are not spending
+    expenses = [e for e in expenses if is_spending(e)]
+    if categories:
+        expenses = [e for e in expenses if any(cat in expense_categories(e) for cat in categories)]
+    return expenses
 
 def get_category_emoji(category):
     """Get emoji for category"""
@@ -110,27 +112,6 @@ def get_category_emoji(category):
     }
     return emojis.get(category, '📝')
 
-def calculate_total(expense_list):
-    """Calculate total amount from expenses"""
-    return sum(expense['amount'] for expense in expense_list)
-
-def get_current_month_expenses(expenses):
-    """Get expenses for current month"""
-    now = datetime.now()
-    current_month = now.strftime('%Y-%m')
-    return [e for e in expenses if e['date'].startswith(current_month)]
-
-def get_current_week_expenses(expenses):
-    """Get expenses for current week"""
-    now = datetime.now()
-    start_of_week = now - timedelta(days=now.weekday())
-    return [e for e in expenses if datetime.strptime(e['date'], '%Y-%m-%d').date() >= start_of_week.date()]
-
-def get_today_expenses(expenses):
-    """Get expenses for today"""
-    today = datetime.now().strftime('%Y-%m-%d')
-    return [e for e in expenses if e['date'] == today]
-
 @app.route('/')
 def index():
     """Render main page"""
@@ -139,7 +120,7 @@ def index():
 @app.route('/api/settings', methods=['GET'])
 def get_settings():
     """Get current settings"""
-    settings = load_settings()
+    settings = SettingsManager.load()
     settings_copy = settings.copy()
     settings_copy['currencies'] = CURRENCIES
     return jsonify(settings_copy)
@@ -148,19 +129,19 @@ def get_settings():
 def update_settings():
     """Update settings"""
     data = request.get_json()
-    settings = load_settings()
+    settings = SettingsManager.load()
     
     if 'currency' in data:
         settings['currency'] = data['currency']
     
-    save_settings(settings)
+    SettingsManager.save(settings)
     return jsonify(settings)
 
 @app.route('/api/expenses', methods=['GET'])
 def get_expenses():
     """Get all expenses"""
-    expenses = load_expenses()
-    return jsonify(expenses)
+    expenses = ExpenseManager.load()
+    return jsonify([to_response(e) for e in expenses])
 
 @app.route('/api/expenses', methods=['POST'])
 def add_expense():
@@ -180,106 +161,92 @@ def add_expense():
     if not data.get('payment_method') or not data.get('wallet'):
         return jsonify({'error': 'Payment method and wallet are required'}), 400
     
-    expenses = load_expenses()
-    
-    new_expense = {
+    # Stored with the shared schema: the first selected category
+    success, new_expense = ExpenseManager.add({
         'date': data.get('date', datetime.now().strftime('%Y-%m-%d')),
-        'categories': data.get('categories', []),
+        'category': data['categories'][0],
         'description': data.get('description', ''),
         'amount': float(data.get('amount', 0)),
         'payment_method': data.get('payment_method', ''),
         'wallet': data.get('wallet', '')
-    }
-    
-    expenses.append(new_expense)
-    save_expenses(expenses)
+    })
+    if not success:
+        return jsonify({'error': new_expense}), 500
     
-    return jsonify(new_expense), 201
+    return jsonify(to_response(new_expense)), 201
 
 @app.route('/api/expenses/<int:index>', methods=['DELETE'])
 def delete_expense(index):
     """Delete expense by index"""
-    expenses = load_expenses()
+    expenses = ExpenseManager.load()
     
     if 0 <= index < len(expenses):
-        deleted = expenses.pop(index)
-        save_expenses(expenses)
-        return jsonify({'message': 'Expense deleted', 'deleted': deleted})
+        deleted = expenses[index]
+        ExpenseManager.delete(deleted['id'])
+        return jsonify({'message': 'Expense deleted', 'deleted': to_response(deleted)})
     
     return jsonify({'error': 'Expense not found'}), 404
 
 @app.route('/api/budgets', methods=['GET'])
 def get_budgets():
     """Get budgets"""
-    budgets = load_budgets()
+    budgets = BudgetManager.load()
     return jsonify(budgets)
 
 @app.route('/api/budgets', methods=['POST'])
 def update_budgets():
     """Update budgets"""
     data = request.get_json()
-    save_budgets(data)
+    BudgetManager.save(data)
     return jsonify(data)
 
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     """Get expense statistics"""
-    expenses = load_expenses()
+    now = datetime.now()
+    today = now.strftime('%Y-%m-%d')
+    start_of_week = (now - timedelta(days=now.weekday())).strftime('%Y-%m-%d')
+    
+    # Served from the partition summaries; no expense is loaded
+    totals = ExpenseManager.totals()
+    dashboard = ExpenseManager.dashboard_totals(today, start_of_week)
     
-    total_balance = calculate_total(expenses)
-    monthly_expenses = get_current_month_expenses(expenses)
-    monthly_total = calculate_total(monthly_expenses)
-    weekly_expenses = get_current_week_expenses(expenses)
-    weekly_total = calculate_total(weekly_expenses)
-    today_expenses = get_today_expenses(expenses)
-    today_total = calculate_total(today_expenses)
-    average_daily = total_balance / max(len(expenses), 1)
+    total_balance = totals['total']
+    average_daily = total_balance / max(totals['count'], 1)
     
     return jsonify({
         'total_balance': total_balance,
-        'monthly_total': monthly_total,
-        'weekly_total': weekly_total,
-        'today_total': today_total,
+        'monthly_total': dashboard['this_month'],
+        'weekly_total': dashboard['this_week'],
+        'today_total': dashboard['today'],
         'average_daily': average_daily,
-        'expense_count': len(expenses)
+        'expense_count': totals['count']
     })
 
 @app.route('/api/expenses/summary', methods=['GET'])
 def get_summary():
     """Get expense summary"""
-    expenses = load_expenses()
+    totals = ExpenseManager.totals()
     
-    if not expenses:
+    if not totals['count']:
         return jsonify({'count': 0, 'total': 0, 'highest': 0})
     
-    total = calculate_total(expenses)
-    highest = max(expense['amount'] for expense in expenses)
-    
     return jsonify({
-        'count': len(expenses),
-        'total': total,
-        'highest': highest
+        'count': totals['count'],
+        'total': totals['total'],
+        'highest': totals['highest']
     })
 
 @app.route('/api/charts/daily', methods=['GET'])
 def get_daily_chart():
     """Get daily expense chart data"""
-    expenses = load_expenses()
-    
     # Get filters
     categories = request.args.getlist('categories')
     month = request.args.get('month', '')
     
-    # Filter expenses
-    filtered = expenses
-    if categories:
-        filtered = [e for e in filtered if any(cat in e.get('categories', []) for cat in categories)]
-    if month:
-        filtered = [e for e in filtered if e['date'].startswith(month)]
-    
     # Group by date
     daily_data = defaultdict(float)
-    for expense in filtered:
+    for expense in filter_expenses(categories, month):
         daily_data[expense['date']] += expense['amount']
     
     # Sort by date
@@ -296,23 +263,14 @@ def get_daily_chart():
 @app.route('/api/charts/category', methods=['GET'])
 def get_category_chart():
     """Get category distribution chart data"""
-    expenses = load_expenses()
-    
     # Get filters
     categories = request.args.getlist('categories')
     month = request.args.get('month', '')
     
-    # Filter expenses
-    filtered = expenses
-    if categories:
-        filtered = [e for e in filtered if any(cat in e.get('categories', []) for cat in categories)]
-    if month:
-        filtered = [e for e in filtered if e['date'].startswith(month)]
-    
     # Group by category
     category_data = defaultdict(float)
-    for expense in filtered:
-        for cat in expense.get('categories', []):
+    for expense in filter_expenses(categories, month):
+        for cat in expense_categories(expense):
             category_data[cat] += expense['amount']
     
     labels = list(category_data.keys())
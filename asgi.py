@@ -0,0 +1,349 @@
+"""
+Expense Tracker - ASGI entry point
+Serves the read endpoints, receipt uploads and the change feed natively on an
+event loop with storage offloaded to a thread pool; every other route falls
+back to the Flask app from app_new.py, which runs in the thread pool as well.
+
+Run with: uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import io
+import json
+import re
+import sys
+import time
+from urllib.parse import parse_qs
+
+from werkzeug.datastructures import Headers
+from werkzeug.formparser import parse_form_data
+
+from app_new import app as flask_app
+from api.events import HEARTBEAT_INTERVAL, format_event
+from api.expenses import handle_get_expenses, handle_get_changes, handle_get_expense
+from api.stats import (
+    handle_get_stats, handle_get_daily_chart, handle_get_category_chart, handle_get_history,
+    handle_run_stats_query, handle_get_timeseries, handle_get_forecast, handle_get_percentiles,
+    handle_get_anomalies
+)
+from api.wallets import handle_get_wallets, handle_get_wallet_history
+from models.database import get_registry, get_tenant_store
+from models.tenants import TenantError, current_tenant
+from utils.filehandler import save_uploaded_file
+from utils.logger import current_request_id, new_request_id, log_access
+from utils.metrics import METRICS, current_endpoint, span
+
+
+# Same headers app_new.set_security_headers adds to Flask responses
+SECURITY_HEADERS = [
+    (b'x-content-type-options', b'nosniff'),
+    (b'x-frame-options', b'SAMEORIGIN'),
+    (b'x-xss-protection', b'1; mode=block'),
+    (b'referrer-policy', b'strict-origin-when-cross-origin'),
+]
+
+
+class RequestTooLarge(Exception):
+    """Raised when a request body exceeds MAX_CONTENT_LENGTH"""
+
+
+class Request:
+    """Minimal view of an ASGI HTTP request"""
+
+    def __init__(self, scope, receive, params):
+        self.scope = scope
+        self.receive = receive
+        self.params = params
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = Headers([
+            (k.decode('latin-1'), v.decode('latin-1')) for k, v in scope['headers']
+        ])
+        self.args = {
+            k: v[0] for k, v in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()
+        }
+
+    async def body(self):
+        """Read the full request body without blocking the loop"""
+        limit = flask_app.config.get('MAX_CONTENT_LENGTH')
+        chunks = []
+        size = 0
+        while True:
+            message = await self.receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if limit and size > limit:
+                raise RequestTooLarge()
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                break
+        return b''.join(chunks)
+
+
+async def send_response(send, status, body, headers):
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, data, status=200):
+    with span('serialize'):
+        body = json.dumps(data).encode('utf-8')
+    headers = [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode('latin-1')),
+    ] + SECURITY_HEADERS
+    request_id = current_request_id.get()
+    if request_id:
+        headers.append((b'x-request-id', request_id.encode('latin-1')))
+    await send_response(send, status, body, headers)
+
+
+# ===== NATIVE ENDPOINTS =====
+
+def offload(handler):
+    """Wrap a shared (payload, status) handler of the api package to run in the thread pool"""
+    async def run(request):
+        # to_thread copies the context, so the tenant and request ID follow the call
+        return await asyncio.to_thread(handler, request.args, **request.params)
+    return run
+
+
+async def upload_receipt(request):
+    """Async POST /api/upload/receipt; the body is read on the loop, parsed and saved in a thread"""
+    try:
+        environ = build_environ(request.scope, await request.body())
+    except RequestTooLarge:
+        return {'success': False, 'error': 'File too large. Maximum 5MB'}, 413
+
+    def parse_and_save():
+        _, _, files = parse_form_data(environ)
+        if 'file' not in files:
+            return {'success': False, 'error': 'No file provided'}, 400
+        file = files['file']
+        if file.filename == '':
+            return {'success': False, 'error': 'No file selected'}, 400
+
+        success, result = save_uploaded_file(file)
+        if success:
+            return {'success': True, 'message': 'File uploaded successfully', 'filepath': result}, 201
+        return {'success': False, 'error': result}, 400
+
+    try:
+        return await asyncio.to_thread(parse_and_save)
+    except Exception as e:
+        return {'success': False, 'error': f"Upload failed: {str(e)}"}, 500
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def stream_events(request, send):
+    """Async GET /api/events; events are delivered on the loop, so an open stream holds no thread"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+
+    def notify():
+        try:
+            loop.call_soon_threadsafe(ready.set)
+        except RuntimeError:
+            # The loop has closed; the stream is gone
+            pass
+
+    subscription = get_tenant_store().feed.subscribe(last_event_id)
+    subscription.notify = notify
+    disconnect = asyncio.ensure_future(wait_for_disconnect(request.receive))
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ] + SECURITY_HEADERS})
+        await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+        while not disconnect.done():
+            event = subscription.get_nowait()
+            if event is None:
+                ready.clear()
+                # An event queued before the clear would not set it again
+                event = subscription.get_nowait()
+            if event is None:
+                woken = asyncio.ensure_future(ready.wait())
+                await asyncio.wait({woken, disconnect}, timeout=HEARTBEAT_INTERVAL,
+                                   return_when=asyncio.FIRST_COMPLETED)
+                woken.cancel()
+                if not disconnect.done() and not ready.is_set():
+                    await send({'type': 'http.response.body', 'body': b': keep-alive\n\n', 'more_body': True})
+                continue
+            await send({'type': 'http.response.body', 'body': format_event(event).encode('utf-8'), 'more_body': True})
+            if subscription.overflowed and event['type'] == 'resync':
+                await send({'type': 'http.response.body', 'body': b''})
+                break
+    finally:
+        subscription.close()
+        disconnect.cancel()
+
+
+# (method, pattern, Flask rule used as the metrics endpoint label, handler)
+ROUTES = [
+    ('GET', re.compile(r'^/api/expenses$'), '/api/expenses', offload(handle_get_expenses)),
+    ('GET', re.compile(r'^/api/expenses/changes$'), '/api/expenses/changes', offload(handle_get_changes)),
+    ('GET', re.compile(r'^/api/expenses/(?P<expense_id>[^/]+)$'), '/api/expenses/<expense_id>', offload(handle_get_expense)),
+    ('GET', re.compile(r'^/api/stats$'), '/api/stats', offload(handle_get_stats)),
+    ('GET', re.compile(r'^/api/stats/daily$'), '/api/stats/daily', offload(handle_get_daily_chart)),
+    ('GET', re.compile(r'^/api/stats/category$'), '/api/stats/category', offload(handle_get_category_chart)),
+    ('GET', re.compile(r'^/api/stats/history$'), '/api/stats/history', offload(handle_get_history)),
+    ('GET', re.compile(r'^/api/stats/query$'), '/api/stats/query', offload(handle_run_stats_query)),
+    ('GET', re.compile(r'^/api/stats/timeseries$'), '/api/stats/timeseries', offload(handle_get_timeseries)),
+    ('GET', re.compile(r'^/api/stats/forecast$'), '/api/stats/forecast', offload(handle_get_forecast)),
+    ('GET', re.compile(r'^/api/stats/percentiles$'), '/api/stats/percentiles', offload(handle_get_percentiles)),
+    ('GET', re.compile(r'^/api/stats/anomalies$'), '/api/stats/anomalies', offload(handle_get_anomalies)),
+    ('GET', re.compile(r'^/api/wallets$'), '/api/wallets', offload(handle_get_wallets)),
+    ('GET', re.compile(r'^/api/wallets/(?P<wallet>[^/]+)/history$'), '/api/wallets/<wallet>/history', offload(handle_get_wallet_history)),
+    ('POST', re.compile(r'^/api/upload/receipt$'), '/api/upload/receipt', upload_receipt),
+]
+
+
+def match_route(method, path):
+    for route_method, pattern, rule, handler in ROUTES:
+        if route_method == method:
+            match = pattern.match(path)
+            if match:
+                return handler, rule, match.groupdict()
+    return None, None, None
+
+
+# ===== WSGI FALLBACK =====
+
+def build_environ(scope, body):
+    """Build a WSGI environ for an ASGI HTTP scope"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for raw_name, raw_value in scope['headers']:
+        name = raw_name.decode('latin-1').upper().replace('-', '_')
+        value = raw_value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def call_flask(scope, receive, send):
+    """Run a request through the Flask app in the thread pool"""
+    request = Request(scope, receive, {})
+    try:
+        body = await request.body()
+    except RequestTooLarge:
+        await send_json(send, {'success': False, 'error': 'File too large. Maximum 5MB'}, 413)
+        return
+    environ = build_environ(scope, body)
+
+    def run():
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers
+            ]
+
+        chunks = flask_app(environ, start_response)
+        try:
+            response['body'] = b''.join(chunks)
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        return response
+
+    response = await asyncio.to_thread(run)
+    await send_response(send, response['status'], response['body'], response['headers'])
+
+
+# ===== ASGI APPLICATION =====
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+def record_request(request, rule, status, started_at):
+    """Record the latency of a native request and write its access log"""
+    elapsed = time.perf_counter() - started_at
+    METRICS.observe_request(request.method, rule, status, elapsed)
+    log_access(request.method, request.path, rule, status, elapsed)
+
+
+async def app(scope, receive, send):
+    """ASGI application"""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    streaming = scope['method'] == 'GET' and scope['path'] == '/api/events'
+    handler, rule, params = match_route(scope['method'], scope['path'])
+    if handler is None and not streaming:
+        await call_flask(scope, receive, send)
+        return
+
+    request = Request(scope, receive, params)
+    started_at = time.perf_counter()
+    request_id_token = current_request_id.set(new_request_id(request.headers.get('X-Request-ID')))
+    try:
+        registry = get_registry()
+        try:
+            tenant_id = registry.resolve(
+                request.headers, trust_header=flask_app.config['TRUST_TENANT_HEADER']
+            )
+        except TenantError as e:
+            await send_json(send, {'success': False, 'error': str(e)}, 401)
+            if not streaming:
+                record_request(request, rule, 401, started_at)
+            return
+
+        # Pinned, so the store is not evicted while the request uses it
+        store = registry.acquire(tenant_id)
+        token = current_tenant.set(tenant_id)
+        endpoint_token = current_endpoint.set(rule)
+        try:
+            if streaming:
+                await stream_events(request, send)
+                return
+            data, status = await handler(request)
+            await send_json(send, data, status)
+            record_request(request, rule, status, started_at)
+        finally:
+            current_endpoint.reset(endpoint_token)
+            current_tenant.reset(token)
+            registry.release(store)
+    finally:
+        current_request_id.reset(request_id_token)
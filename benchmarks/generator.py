@@ -0,0 +1,68 @@
+"""
+Deterministic synthetic ledger generator
+
+The same seed and parameters always produce the same expenses, so benchmark
+reports from different runs measure the code rather than the data. Dates end
+at a fixed day rather than today, so the data does not shift from day to day.
+"""
+
+import random
+import uuid
+from datetime import date, datetime, timedelta
+
+from models.database import CATEGORIES, PAYMENT_METHODS, DEFAULT_WALLETS
+
+
+# Last day of generated ledgers unless another is given
+END_DATE = date(2026, 6, 30)
+
+DESCRIPTIONS = [
+    'Groceries', 'Coffee', 'Lunch', 'Dinner out', 'Fuel', 'Bus pass', 'Taxi',
+    'Movie tickets', 'Streaming subscription', 'Electricity bill', 'Internet bill',
+    'Pharmacy', 'Doctor visit', 'Clothes', 'Books', 'Gift', 'Gym membership'
+]
+
+
+def zipf_weights(count, skew):
+    """Weights where item k is 1/k^skew as likely as the first (skew 0 is uniform)"""
+    return [1 / (k ** skew) for k in range(1, count + 1)]
+
+
+def generate_expenses(rows, days=730, end_date=None, category_skew=1.0,
+                      tag_cardinality=50, seed=42):
+    """
+    Generate a list of expense dicts
+    rows: number of expenses
+    days: date span ending at end_date (default END_DATE)
+    category_skew: Zipf exponent of the category distribution
+    tag_cardinality: number of distinct tags (0 disables tags)
+    """
+    rng = random.Random(seed)
+    end = end_date or END_DATE
+    start_ordinal = (end - timedelta(days=days - 1)).toordinal()
+    category_weights = zipf_weights(len(CATEGORIES), category_skew)
+    wallets = [w['name'] for w in DEFAULT_WALLETS]
+    tags = [f"tag{i}" for i in range(tag_cardinality)]
+    created_base = datetime.combine(end, datetime.min.time())
+
+    expenses = []
+    for _ in range(rows):
+        day = date.fromordinal(start_ordinal + rng.randrange(days))
+        expense = {
+            'id': str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            'date': day.isoformat(),
+            'category': rng.choices(CATEGORIES, category_weights)[0],
+            'description': rng.choice(DESCRIPTIONS),
+            'amount': round(rng.lognormvariate(3, 1), 2),
+            'payment_method': rng.choice(PAYMENT_METHODS),
+            'wallet': rng.choice(wallets),
+            'receipt': None,
+            'notes': '',
+            'tags': rng.sample(tags, rng.randint(0, min(3, len(tags)))) if tags else [],
+            'recurring': rng.random() < 0.05,
+            'created_at': (created_base - timedelta(seconds=rng.randrange(days * 86400))).isoformat()
+        }
+        expenses.append(expense)
+
+    expenses.sort(key=lambda e: e['date'])
+    return expenses
@@ -0,0 +1,232 @@
+"""
+Benchmark runner
+
+Builds a synthetic ledger per size in a temporary data directory and times
+storage operations, validators and API endpoints. The JSON report keeps the
+same keys across runs so two reports can be compared directly.
+
+Usage:
+    python -m benchmarks.run --rows 10000 100000 --output bench.json
+    python -m benchmarks.run --rows 10000 --compare bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+from benchmarks.generator import END_DATE, generate_expenses
+from models import database
+from models.database import ExpenseManager, CATEGORIES, PAYMENT_METHODS
+from models.partitions import PartitionedStore
+from utils import validators
+
+
+def summarize_timings(timings):
+    """Summarise timings in seconds as milliseconds"""
+    ordered = sorted(timings)
+    return {
+        'runs': len(ordered),
+        'min_ms': ordered[0] * 1000,
+        'median_ms': statistics.median(ordered) * 1000,
+        'mean_ms': statistics.fmean(ordered) * 1000,
+        'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000
+    }
+
+
+def measure(func, repeat, setup=None):
+    """Time func over repeat runs, calling setup untimed before each"""
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return summarize_timings(timings)
+
+
+# ===== BENCHMARKS =====
+
+def bench_validators(repeat, batch=1000):
+    """Time each validator over a batch of calls"""
+    cases = {
+        'validate_amount': lambda: validators.validate_amount('123.45'),
+        'validate_date': lambda: validators.validate_date('2026-10-19'),
+        'validate_category': lambda: validators.validate_category('Food', CATEGORIES),
+        'validate_payment_method': lambda: validators.validate_payment_method('UPI', PAYMENT_METHODS),
+        'validate_description': lambda: validators.validate_description('Lunch with team'),
+        'sanitize_string': lambda: validators.sanitize_string('<b>Lunch</b> at "Joe\'s"; cafe'),
+        'sanitize_filename': lambda: validators.sanitize_filename('../My Receipt (1).jpg'),
+        'escape_html': lambda: validators.escape_html('<a href="x">Tom & Jerry\'s</a>'),
+    }
+    results = {}
+    for name, call in cases.items():
+        def run_batch(call=call):
+            for _ in range(batch):
+                call()
+        results[f"validators.{name}"] = dict(measure(run_batch, repeat), batch=batch)
+    return results
+
+
+def bench_ledger(rows, repeat, seed, days, end_date=END_DATE):
+    """Time storage operations and API endpoints on a ledger of the given size"""
+    data_dir = tempfile.mkdtemp(prefix='expense-bench-')
+    try:
+        database.set_data_dir(data_dir)
+        expenses_dir = os.path.join(data_dir, 'expenses')
+
+        start = time.perf_counter()
+        database.get_expense_store().replace_all(
+            generate_expenses(rows, days=days, end_date=end_date, seed=seed)
+        )
+        results = {'setup.generate_and_write': summarize_timings([time.perf_counter() - start])}
+
+        # Relative to the generated data, not to the day of the run
+        month_start = end_date.strftime('%Y-%m-01')
+        today = end_date.isoformat()
+        cold_repeat = max(1, repeat // 5)
+
+        results['storage.open_cold'] = measure(
+            lambda: PartitionedStore(expenses_dir).load_all(), cold_repeat
+        )
+        results['storage.open_cold_month'] = measure(
+            lambda: PartitionedStore(expenses_dir).load_range(month_start), repeat
+        )
+        results['expense_manager.load'] = measure(ExpenseManager.load, cold_repeat)
+        results['expense_manager.load_range_month'] = measure(
+            lambda: ExpenseManager.load_range(month_start), repeat
+        )
+
+        added = []
+        new_expense = {
+            'date': today, 'category': 'Food', 'description': 'Benchmark lunch',
+            'amount': 12.5, 'payment_method': 'UPI', 'wallet': 'UPI', 'tags': []
+        }
+        results['expense_manager.add'] = measure(
+            lambda: added.append(ExpenseManager.add(new_expense)[1]['id']), repeat
+        )
+
+        def add_burst(writers=32):
+            """Post one expense from each of many threads at once (group commit)"""
+            threads = [threading.Thread(target=lambda: added.append(ExpenseManager.add(new_expense)[1]['id']))
+                       for _ in range(writers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        results['expense_manager.add_burst_32'] = measure(add_burst, cold_repeat)
+        ids = iter(added)
+        results['expense_manager.update'] = measure(
+            lambda: ExpenseManager.update(next(ids), {'amount': 13.0}), repeat
+        )
+        ids = iter(added)
+        results['expense_manager.delete'] = measure(
+            lambda: ExpenseManager.delete(next(ids)), repeat
+        )
+
+        from app_new import app
+        client = app.test_client()
+        endpoints = {
+            'api.stats': '/api/stats',
+            'api.stats.daily': '/api/stats/daily',
+            'api.stats.category': '/api/stats/category',
+            'api.expenses.month': f"/api/expenses?start_date={month_start}",
+            'api.expenses.changes': '/api/expenses/changes?since=1',
+        }
+        for name, url in endpoints.items():
+            def get(url=url):
+                response = client.get(url)
+                assert response.status_code == 200, response.get_json()
+            results[name] = measure(get, repeat)
+
+        return results
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+# ===== REPORT =====
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline, threshold):
+    """Print median changes against a baseline report; return True on regression"""
+    regressed = False
+    for size, results in report['results'].items():
+        for name, result in results.items():
+            previous = baseline.get('results', {}).get(size, {}).get(name)
+            if not previous or not previous['median_ms']:
+                continue
+            change = (result['median_ms'] - previous['median_ms']) / previous['median_ms']
+            flag = ''
+            if change > threshold and not name.startswith('setup.'):
+                flag = '  REGRESSION'
+                regressed = True
+            print(f"{size:>10} {name:<40} {previous['median_ms']:>10.3f} -> "
+                  f"{result['median_ms']:>10.3f} ms ({change:+.1%}){flag}")
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Expense Tracker benchmarks')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--days', type=int, default=730)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--end-date', type=date.fromisoformat, default=END_DATE,
+                        help=f"last day of the generated ledgers (default {END_DATE.isoformat()})")
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--compare', help='baseline report to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='median slowdown reported as a regression (default 0.2 = 20%%)')
+    args = parser.parse_args(argv)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'seed': args.seed,
+            'days': args.days,
+            'end_date': args.end_date.isoformat(),
+            'repeat': args.repeat
+        },
+        'results': {'validators': bench_validators(args.repeat)}
+    }
+    for rows in args.rows:
+        print(f"Benchmarking {rows} rows...", file=sys.stderr)
+        report['results'][str(rows)] = bench_ledger(rows, args.repeat, args.seed, args.days, args.end_date)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
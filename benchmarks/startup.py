@@ -0,0 +1,151 @@
+"""
+Startup-time report
+
+Shows what a cold process pays before it can answer its first request: the
+import cost of every module (from ``python -X importtime``, grouped by top-level
+package) and the time from importing the app to the first responses, measured
+in fresh processes against a synthetic ledger.
+
+Usage:
+    python -m benchmarks.startup --rows 100000
+    python -m benchmarks.startup --data-dir data --url /api/stats --budget-ms 100
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PACKAGES = ('app_new', 'app', 'app_vercel', 'asgi', 'api', 'models', 'utils')
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)$')
+
+# Run in a fresh interpreter: import the app, then time each first request
+COLD_START = '''
+import json, sys, time
+start = time.perf_counter()
+module = __import__(sys.argv[1])
+imported = time.perf_counter()
+client = module.app.test_client()
+requests = {}
+for url in sys.argv[2:]:
+    t = time.perf_counter()
+    status = client.get(url).status_code
+    requests[url] = {'status': status, 'ms': (time.perf_counter() - t) * 1000}
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'total_ms': (time.perf_counter() - start) * 1000,
+    'requests': requests
+}))
+'''
+
+
+def child_env(data_dir):
+    env = dict(os.environ, LOG_LEVEL='WARNING', PYTHONPATH=ROOT)
+    if data_dir:
+        env['EXPENSE_TRACKER_DATA_DIR'] = data_dir
+    return env
+
+
+def import_times(module, data_dir=None):
+    """Import the module with -X importtime; returns [(name, self_ms, cumulative_ms, depth)]"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+        cwd=ROOT, env=child_env(data_dir), capture_output=True, text=True, check=True
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules.append((name, int(self_us) / 1000, int(cumulative_us) / 1000, (len(indent) - 1) // 2))
+    return modules
+
+
+def cold_start(module, urls, runs, data_dir=None):
+    """Time import and first requests in fresh processes; returns one dict per run"""
+    results = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, '-c', COLD_START, module] + urls,
+            cwd=ROOT, env=child_env(data_dir), capture_output=True, text=True, check=True
+        )
+        results.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return results
+
+
+def print_report(modules, runs, top, budget_ms):
+    by_package = defaultdict(float)
+    for name, self_ms, _, _ in modules:
+        by_package[name.split('.')[0]] += self_ms
+    total = sum(by_package.values())
+
+    print(f"Import cost by top-level package (self time, total {total:.1f} ms)")
+    for package, ms in sorted(by_package.items(), key=lambda x: x[1], reverse=True)[:top]:
+        marker = '*' if package in APP_PACKAGES else ' '
+        print(f"  {marker} {package:<30} {ms:>8.1f} ms")
+
+    print(f"\nApplication modules (* above)")
+    for name, self_ms, cumulative_ms, _ in sorted(modules, key=lambda m: m[2], reverse=True):
+        if name.split('.')[0] in APP_PACKAGES:
+            print(f"    {name:<30} self {self_ms:>7.1f} ms  cumulative {cumulative_ms:>7.1f} ms")
+
+    print(f"\nCold start over {len(runs)} fresh processes (median)")
+    import_ms = statistics.median(r['import_ms'] for r in runs)
+    print(f"    {'import':<30} {import_ms:>8.1f} ms")
+    for url in runs[0]['requests']:
+        ms = statistics.median(r['requests'][url]['ms'] for r in runs)
+        print(f"    {'first GET ' + url:<30} {ms:>8.1f} ms  ({runs[0]['requests'][url]['status']})")
+    total_ms = statistics.median(r['total_ms'] for r in runs)
+    verdict = 'within' if total_ms <= budget_ms else 'OVER'
+    print(f"    {'total':<30} {total_ms:>8.1f} ms  ({verdict} the {budget_ms:.0f} ms budget)")
+    return total_ms <= budget_ms
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Expense Tracker startup-time report')
+    parser.add_argument('--module', default='app_new', help='module exposing the Flask app')
+    parser.add_argument('--data-dir', help='existing data directory (default: generate a ledger)')
+    parser.add_argument('--rows', type=int, default=100000, help='rows of the generated ledger')
+    parser.add_argument('--url', action='append', dest='urls',
+                        help='first request(s) to time (default: the dashboard endpoints)')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--budget-ms', type=float, default=100)
+    args = parser.parse_args(argv)
+    urls = args.urls or ['/api/stats', '/api/stats/daily', '/api/stats/category']
+
+    data_dir = args.data_dir
+    generated = None
+    if data_dir is None:
+        generated = data_dir = tempfile.mkdtemp(prefix='expense-startup-')
+        print(f"Generating a {args.rows}-row ledger...", file=sys.stderr)
+        subprocess.run(
+            [sys.executable, '-c',
+             'import sys; from benchmarks.generator import generate_expenses; '
+             'from models.database import get_expense_store; '
+             'get_expense_store().replace_all(generate_expenses(int(sys.argv[1])))',
+             str(args.rows)],
+            cwd=ROOT, env=child_env(data_dir), check=True
+        )
+    try:
+        # Warm the OS page cache and any one-off manifest migration
+        cold_start(args.module, urls, 1, data_dir)
+        modules = import_times(args.module, data_dir)
+        runs = cold_start(args.module, urls, args.runs, data_dir)
+        within_budget = print_report(modules, runs, args.top, args.budget_ms)
+    finally:
+        if generated:
+            shutil.rmtree(generated, ignore_errors=True)
+    return 0 if within_budget else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
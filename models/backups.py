@@ -0,0 +1,379 @@
+"""
+Point-in-time backups
+
+A backup is a consistent snapshot of one ledger: the rows of its month
+partitions, its tombstones and documents (settings, budgets, rules, ...).
+Record blocks are immutable (every write swaps in a new block), so taking a
+snapshot only copies references to the current blocks under the ledger lock,
+between two writes or group-commit batches; rows are serialised and
+compressed afterwards, in the background, while writes carry on.
+
+Archives are gzipped JSON lines in the ledger's ``backups`` directory, named
+by their UTC time: a header (kind, base archive, the fingerprint of every
+month, change sequence), then one line per partition, the tombstones and the
+documents. A ``full`` archive holds every partition; an ``incr`` archive only
+the partitions whose fingerprint changed since the archive it is based on, so
+restoring one replays the chain back to its full archive. Every
+``BACKUP_FULL_EVERY`` archives a full one is taken, and archives older than
+the last ``BACKUP_KEEP_FULL`` full archives are pruned.
+
+Backups are taken every ``BACKUP_INTERVAL`` seconds (0, the default,
+disables the schedule) when the ledger changed, on request through
+``/api/backups``, or from the command line:
+
+    python -m models.backups [--tenant ID] list
+    python -m models.backups [--tenant ID] backup [--full]
+    python -m models.backups [--tenant ID] restore ARCHIVE
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+import weakref
+from datetime import datetime, timezone
+from .partitions import partition_fingerprint
+
+
+BACKUP_DIR_NAME = 'backups'
+BACKUP_INTERVAL = float(os.environ.get('BACKUP_INTERVAL', 0))
+# Archives in a chain before the next full one
+BACKUP_FULL_EVERY = int(os.environ.get('BACKUP_FULL_EVERY', 24))
+# Full archives (with their incremental ones) kept by the retention policy
+BACKUP_KEEP_FULL = int(os.environ.get('BACKUP_KEEP_FULL', 7))
+ARCHIVE_FORMAT = 1
+ARCHIVE_PATTERN = re.compile(r'^\d{8}T\d{12}Z-(full|incr)\.jsonl\.gz$')
+
+
+class BackupError(Exception):
+    """Raised when an archive is missing, unreadable or its chain is broken"""
+
+
+def _digest(documents):
+    return hashlib.sha1(json.dumps(documents, sort_keys=True).encode()).hexdigest()
+
+
+def capture(ledger, since=None, exclude=()):
+    """
+    Take a consistent snapshot of a ledger: the record blocks of the months
+    whose fingerprint differs from since (every month when since is None),
+    its tombstones and documents (but those in exclude)
+    """
+    with ledger._lock:
+        months = {month: partition_fingerprint(s) for month, s in ledger._open()['partitions'].items()}
+    # Read uncached partitions one lock at a time, so the capture below only takes cached blocks
+    for month, fingerprint in months.items():
+        if since is None or since.get(month) != fingerprint:
+            with ledger._lock:
+                ledger._partition(month)
+
+    with ledger._lock:
+        manifest = ledger._open()
+        months = {month: partition_fingerprint(s) for month, s in manifest['partitions'].items()}
+        blocks = {month: ledger._partition(month) for month, fingerprint in months.items()
+                  if since is None or since.get(month) != fingerprint}
+        tombstones = [dict(t) for t in ledger._load_tombstones()]
+        documents = {name: ledger.load_document(name) for name in ledger.document_names()
+                     if name not in exclude}
+        return {
+            'seq': manifest.get('seq', 0),
+            'tombstone_floor': manifest.get('tombstone_floor', 0),
+            'months': months,
+            'blocks': blocks,
+            'tombstones': tombstones,
+            'documents': documents
+        }
+
+
+def read_header(path):
+    """Read the header line of an archive"""
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+    except (OSError, EOFError, ValueError) as e:
+        raise BackupError(f"Unreadable archive {os.path.basename(path)}: {e}")
+    if header.get('format') != ARCHIVE_FORMAT:
+        raise BackupError(f"Unsupported archive format: {header.get('format')}")
+    return header
+
+
+def read_archive(path):
+    """Read an archive into its header, {month: rows}, tombstones and documents"""
+    partitions = {}
+    tombstones = []
+    documents = {}
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            for line in f:
+                entry = json.loads(line)
+                if 'partition' in entry:
+                    partitions[entry['partition']] = entry['rows']
+                elif 'tombstones' in entry:
+                    tombstones = entry['tombstones']
+                elif 'documents' in entry:
+                    documents = entry['documents']
+    except (OSError, EOFError, ValueError) as e:
+        raise BackupError(f"Unreadable archive {os.path.basename(path)}: {e}")
+    return header, partitions, tombstones, documents
+
+
+class LedgerBackups:
+    """Backup archives of one ledger"""
+
+    def __init__(self, ledger, directory, exclude=(), full_every=BACKUP_FULL_EVERY, keep_full=BACKUP_KEEP_FULL):
+        self.ledger = ledger
+        self.directory = directory
+        # Documents owned by something else than the ledger, such as shared exchange rates
+        self.exclude = frozenset(exclude)
+        self.full_every = max(1, full_every)
+        self.keep_full = max(1, keep_full)
+        self.last_error = None
+        self._running = threading.Lock()
+
+    @property
+    def running(self):
+        return self._running.locked()
+
+    def _path(self, name):
+        if not ARCHIVE_PATTERN.match(name or ''):
+            raise BackupError(f"Invalid archive name: {name}")
+        return os.path.join(self.directory, name)
+
+    def _names(self):
+        """Archive names, oldest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if ARCHIVE_PATTERN.match(name))
+
+    def archives(self):
+        """List the archives, newest first"""
+        result = []
+        for name in reversed(self._names()):
+            path = self._path(name)
+            try:
+                header = read_header(path)
+            except BackupError:
+                continue
+            result.append({
+                'name': name,
+                'kind': header['kind'],
+                'created_at': header['created_at'],
+                'base': header.get('base'),
+                'months': len(header['months']),
+                'partitions': len(header.get('written', ())),
+                'size': os.path.getsize(path)
+            })
+        return result
+
+    # ===== BACKUP =====
+
+    def start(self, full=None):
+        """Take a backup in a background thread; False when one is already running"""
+        if not self._running.acquire(blocking=False):
+            return False
+        threading.Thread(target=self._run, args=(full,), name='ledger-backup', daemon=True).start()
+        return True
+
+    def _run(self, full, if_changed=False):
+        try:
+            self._backup(full, if_changed)
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+        finally:
+            self._running.release()
+
+    def backup(self, full=None, if_changed=False):
+        """
+        Take a backup (full every full_every archives unless full is set) and
+        prune old archives; returns the archive name, or None when if_changed
+        is set and nothing changed since the last one
+        """
+        with self._running:
+            return self._backup(full, if_changed)
+
+    def _backup(self, full, if_changed):
+        names = self._names()
+        previous = None
+        if names:
+            try:
+                previous = read_header(self._path(names[-1]))
+            except BackupError:
+                # An unreadable archive cannot be a base
+                full = True
+        if full is None:
+            chain = 0
+            for name in reversed(names):
+                chain += 1
+                if name.endswith('-full.jsonl.gz'):
+                    break
+            full = previous is None or chain >= self.full_every
+
+        state = capture(self.ledger, None if full else previous['months'], self.exclude)
+        digest = _digest(state['documents'])
+        if if_changed and previous is not None and previous['months'] == state['months'] and \
+                previous['seq'] == state['seq'] and previous['digest'] == digest:
+            return None
+
+        created = datetime.now(timezone.utc)
+        name = f"{created.strftime('%Y%m%dT%H%M%S%fZ')}-{'full' if full else 'incr'}.jsonl.gz"
+        header = {
+            'format': ARCHIVE_FORMAT,
+            'kind': 'full' if full else 'incr',
+            'created_at': created.isoformat(),
+            'base': None if full else names[-1],
+            'seq': state['seq'],
+            'tombstone_floor': state['tombstone_floor'],
+            'months': state['months'],
+            'written': sorted(state['blocks']),
+            'digest': digest
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(name)
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            f.write(json.dumps(header) + '\n')
+            for month in header['written']:
+                rows = [record.to_dict() for record in state['blocks'][month]]
+                f.write(json.dumps({'partition': month, 'rows': rows}) + '\n')
+            f.write(json.dumps({'tombstones': state['tombstones']}) + '\n')
+            f.write(json.dumps({'documents': state['documents']}) + '\n')
+        os.replace(tmp_path, path)
+
+        if full:
+            self.prune()
+        return name
+
+    def prune(self):
+        """Delete the archives older than the last keep_full full archives; returns their names"""
+        names = self._names()
+        fulls = [name for name in names if name.endswith('-full.jsonl.gz')]
+        if len(fulls) <= self.keep_full:
+            return []
+        oldest = fulls[-self.keep_full]
+        pruned = [name for name in names if name < oldest]
+        for name in pruned:
+            os.remove(self._path(name))
+        return pruned
+
+    # ===== RESTORE =====
+
+    def load(self, name):
+        """Rebuild the state an archive was taken at, replaying its chain back to the full archive"""
+        chain = []
+        while name is not None:
+            path = self._path(name)
+            if not os.path.exists(path):
+                raise BackupError(f"Archive not found: {name}" if not chain else
+                                  f"Backup chain is broken: {name} is missing")
+            chain.append(name)
+            name = read_header(path).get('base')
+
+        partitions = {}
+        for name in reversed(chain):
+            header, written, _, documents = read_archive(self._path(name))
+            partitions = {month: written[month] if month in written else partitions[month]
+                          for month in header['months']}
+        return partitions, documents
+
+    def restore(self, name):
+        """
+        Restore the ledger to an archive, backing up its current state first
+        Rows come back with new versions and the rows written since get
+        tombstones, so clients resynchronise like after any other write.
+        Documents created since the archive are deleted.
+        """
+        partitions, documents = self.load(name)
+        with self._running:
+            safety = self._backup(None, False)
+        with self.ledger.batch():
+            self.ledger.replace_all([row for month in sorted(partitions) for row in partitions[month]])
+            for document in self.ledger.document_names():
+                if document not in documents and document not in self.exclude:
+                    self.ledger.delete_document(document)
+            for document, data in documents.items():
+                self.ledger.save_document(document, data)
+        return {
+            'restored': name,
+            'expenses': sum(len(rows) for rows in partitions.values()),
+            'documents': sorted(documents),
+            'backup': safety
+        }
+
+
+# ===== SCHEDULE =====
+
+class BackupScheduler:
+    """Background thread backing up every registered ledger that changed, every interval"""
+
+    def __init__(self, interval=BACKUP_INTERVAL):
+        self.interval = interval
+        self._backups = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, backups):
+        if self.interval <= 0:
+            return
+        with self._lock:
+            self._backups.add(backups)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='backup-scheduler', daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                backups = list(self._backups)
+            for ledger_backups in backups:
+                if ledger_backups._running.acquire(blocking=False):
+                    ledger_backups._run(None, if_changed=True)
+
+
+scheduler = BackupScheduler()
+
+
+# ===== COMMAND LINE =====
+
+def main(argv=None):
+    from .database import get_registry
+
+    parser = argparse.ArgumentParser(prog='python -m models.backups', description='Back up and restore expense ledgers')
+    parser.add_argument('--tenant', help='tenant ID (default: the single-user ledger)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='list the archives, newest first')
+    backup = commands.add_parser('backup', help='take a backup now')
+    backup.add_argument('--full', action='store_true', help='take a full backup')
+    restore = commands.add_parser('restore', help='restore the ledger to an archive')
+    restore.add_argument('archive')
+    args = parser.parse_args(argv)
+
+    backups = get_registry().get(args.tenant).backups
+    try:
+        if args.command == 'list':
+            for archive in backups.archives():
+                print(f"{archive['name']}  {archive['partitions']:>4}/{archive['months']:<4} months  "
+                      f"{archive['size']:>10} bytes")
+        elif args.command == 'backup':
+            print(backups.backup(True if args.full else None))
+        else:
+            result = backups.restore(args.archive)
+            print(f"Restored {result['expenses']} expenses from {result['restored']} "
+                  f"(previous state saved as {result['backup']})")
+    except BackupError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    # Run the package's module, whose BackupError the ledgers raise, rather than __main__
+    from models.backups import main
+    sys.exit(main())
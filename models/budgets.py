@@ -0,0 +1,107 @@
+"""
+Budget alerts
+
+Month-to-date spend per category is kept by the ledger itself: every write
+refreshes its partition's manifest summary, so after a write the spend of a
+category is one dictionary lookup. Each write to the current month compares
+that spend with the budget of every category and the ``monthly_limit`` and
+raises an alert when a threshold is crossed.
+
+An alert fires once per threshold, scope and month: the highest level reached
+is remembered in the ``budget_alerts`` document, so spending that drops and
+rises again, edits or repeated writes do not fire it twice. Alerts are
+appended to a bounded outbox (the ``notifications`` document, served by
+``GET /api/budgets/alerts``) and published to the tenant's change feed as
+``budget.alert`` events.
+"""
+
+from datetime import datetime
+
+
+WARNING_RATIO = 0.8
+DANGER_RATIO = 1.0
+LEVELS = ('success', 'warning', 'danger')
+MONTHLY_LIMIT = 'monthly_limit'
+STATE_DOCUMENT = 'budget_alerts'
+OUTBOX_DOCUMENT = 'notifications'
+OUTBOX_SIZE = 200
+
+
+def budget_level(spent, budget):
+    """Get the status of spending against a budget: success, warning or danger"""
+    if budget <= 0:
+        return 'success'
+    if spent >= budget * DANGER_RATIO:
+        return 'danger'
+    if spent >= budget * WARNING_RATIO:
+        return 'warning'
+    return 'success'
+
+
+def budget_scopes(budgets, categories):
+    """List (scope, budget) pairs to check: every category plus the monthly limit"""
+    scopes = [(category, budgets.get(category, 0)) for category in categories]
+    scopes.append((MONTHLY_LIMIT, budgets.get(MONTHLY_LIMIT, 0)))
+    return scopes
+
+
+class BudgetAlerts:
+    """Threshold tracking of one ledger"""
+
+    def __init__(self, ledger, feed, summaries=None):
+        self.ledger = ledger
+        self.feed = feed
+        # Summaries in the reporting currency (see fx.py)
+        self.summaries = summaries or ledger.summaries
+
+    def evaluate(self, budgets, categories, now=None):
+        """
+        Check the current month against its budgets; returns the alerts raised
+        Costs one manifest lookup per budget scope, whatever the ledger size.
+        """
+        now = now or datetime.now()
+        period = now.strftime('%Y-%m')
+        summary = self.summaries().get(period, {})
+        spent_by_category = summary.get('categories', {})
+
+        with self.ledger._lock:
+            state = self.ledger.load_document(STATE_DOCUMENT) or {}
+            if state.get('period') != period:
+                # A new month re-arms every threshold
+                state = {'period': period, 'levels': {}}
+            levels = state['levels']
+
+            alerts = []
+            for scope, budget in budget_scopes(budgets, categories):
+                if scope == MONTHLY_LIMIT:
+                    spent = summary.get('total', 0)
+                else:
+                    spent = spent_by_category.get(scope, 0)
+                level = budget_level(spent, budget)
+                if LEVELS.index(level) <= LEVELS.index(levels.get(scope, 'success')):
+                    continue
+                levels[scope] = level
+                alerts.append({
+                    'period': period,
+                    'scope': scope,
+                    'level': level,
+                    'spent': spent,
+                    'budget': budget,
+                    'percentage': spent / budget * 100,
+                    'created_at': now.isoformat()
+                })
+
+            if alerts:
+                self.ledger.save_document(STATE_DOCUMENT, state)
+                outbox = self.ledger.load_document(OUTBOX_DOCUMENT) or []
+                outbox = (outbox + alerts)[-OUTBOX_SIZE:]
+                self.ledger.save_document(OUTBOX_DOCUMENT, outbox)
+
+        for alert in alerts:
+            self.feed.publish('budget.alert', alert)
+        return alerts
+
+    def recent(self, limit=50):
+        """Get the newest alerts of the outbox, newest first"""
+        outbox = self.ledger.load_document(OUTBOX_DOCUMENT) or []
+        return outbox[::-1][:limit]
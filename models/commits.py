@@ -0,0 +1,140 @@
+"""
+Group commit of ledger writes
+
+A burst of single-expense posts would otherwise pay one partition rewrite,
+summary and fsync each. ``GroupCommitter.submit`` queues a write instead; the
+first writer to find no batch being collected leads the next one: it waits up
+to ``GROUP_COMMIT_WINDOW_MS`` (or until ``GROUP_COMMIT_MAX_OPS`` writes are
+queued), runs every queued write in one ledger batch, so each month partition
+is rewritten and summarised once (see ``PartitionedLedger.batch``), syncs it
+and only then returns to every writer of the batch. Writers arriving while a
+batch commits queue up for the next one. Each write runs in a copy of its
+writer's context, so it keeps the request ID and endpoint it was made under,
+and in a savepoint: a write that raises is undone alone, and only its writer
+gets the error.
+
+How often batches are synced to disk is set by ``WRITE_DURABILITY``:
+
+    batch     before acknowledging every batch (the default)
+    interval  at most every ``WRITE_SYNC_INTERVAL_MS``; a crash may lose that much
+    none      whenever the operating system flushes
+"""
+
+import contextvars
+import os
+import threading
+import time
+
+
+DURABILITY_MODES = ('batch', 'interval', 'none')
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get('GROUP_COMMIT_WINDOW_MS', 2))
+GROUP_COMMIT_MAX_OPS = int(os.environ.get('GROUP_COMMIT_MAX_OPS', 256))
+WRITE_DURABILITY = os.environ.get('WRITE_DURABILITY', 'batch')
+WRITE_SYNC_INTERVAL_MS = float(os.environ.get('WRITE_SYNC_INTERVAL_MS', 100))
+
+
+class _Write:
+    """A queued write and, once its batch committed, its outcome"""
+
+    __slots__ = ('op', 'context', 'taken', 'done', 'result', 'error')
+
+    def __init__(self, op, context):
+        self.op = op
+        # Context of the writer; the op may run in the thread of another writer
+        self.context = context
+        self.taken = False
+        self.done = False
+        self.result = None
+        self.error = None
+
+
+class GroupCommitter:
+    """Coalesces the concurrent writes of one ledger into batches"""
+
+    def __init__(self, ledger, window_ms=GROUP_COMMIT_WINDOW_MS, max_ops=GROUP_COMMIT_MAX_OPS,
+                 durability=WRITE_DURABILITY, sync_interval_ms=WRITE_SYNC_INTERVAL_MS):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown write durability: {durability} (expected one of {', '.join(DURABILITY_MODES)})")
+        self.ledger = ledger
+        self.window = window_ms / 1000
+        self.max_ops = max(1, max_ops)
+        self.durability = durability
+        self.sync_interval = sync_interval_ms / 1000
+        self._cond = threading.Condition()
+        self._queue = []
+        self._collecting = False
+        self._sync_timer = None
+
+    def submit(self, op):
+        """Run op() in the next batch; returns its result (or raises its error) once the batch is committed"""
+        write = _Write(op, contextvars.copy_context())
+        with self._cond:
+            self._queue.append(write)
+            if len(self._queue) >= self.max_ops:
+                self._cond.notify_all()
+        while True:
+            with self._cond:
+                while not write.done and (write.taken or self._collecting):
+                    self._cond.wait()
+                if write.done:
+                    break
+                batch = self._collect()
+            self._commit(batch)
+
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    def _collect(self):
+        """Take the next batch off the queue, waiting out the window; called holding the condition"""
+        self._collecting = True
+        deadline = time.monotonic() + self.window
+        while len(self._queue) < self.max_ops:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._cond.wait(remaining)
+        batch = self._queue[:self.max_ops]
+        del self._queue[:self.max_ops]
+        for write in batch:
+            write.taken = True
+        # The next batch is collected while this one commits
+        self._collecting = False
+        self._cond.notify_all()
+        return batch
+
+    def _commit(self, batch):
+        """Run a batch in one ledger batch and sync it; nothing is acknowledged before it is persisted"""
+        try:
+            with self.ledger.batch():
+                for write in batch:
+                    try:
+                        with self.ledger.savepoint():
+                            write.result = write.context.run(write.op)
+                    except Exception as e:
+                        write.error = e
+            self._sync()
+        except Exception as e:
+            for write in batch:
+                write.error = e
+        finally:
+            with self._cond:
+                for write in batch:
+                    write.done = True
+                self._cond.notify_all()
+
+    def _sync(self):
+        if self.durability == 'batch':
+            self.ledger.sync()
+        elif self.durability == 'interval':
+            with self._cond:
+                if self._sync_timer is not None:
+                    return
+                self._sync_timer = threading.Timer(self.sync_interval, self._sync_due)
+                self._sync_timer.daemon = True
+            self._sync_timer.start()
+
+    def _sync_due(self):
+        with self._cond:
+            self._sync_timer = None
+        self.ledger.sync()
@@ -4,20 +4,37 @@ Data models and database operations
 
 import json
 import os
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
 import uuid
 from collections import defaultdict
+from .fx import DEFAULT_CURRENCY
+from .query import run_query
+from .rules import RULES_DOCUMENT
+from .sketches import distribution, fences, merge_categories
+from .storage import BACKENDS, DEFAULT_BACKEND
+from .tenants import TenantRegistry, current_tenant
+from .wallets import is_spending
+from utils.logger import get_logger
+from utils.metrics import timed
 
 
+logger = get_logger('database')
+
 # Database file paths
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
-EXPENSES_FILE = os.path.join(BASE_DIR, 'data', 'expenses.json')
-SETTINGS_FILE = os.path.join(BASE_DIR, 'data', 'settings.json')
-BUDGETS_FILE = os.path.join(BASE_DIR, 'data', 'budgets.json')
-RECURRING_FILE = os.path.join(BASE_DIR, 'data', 'recurring.json')
+DATA_DIR = os.environ.get('EXPENSE_TRACKER_DATA_DIR', os.path.join(BASE_DIR, 'data'))
+EXPENSES_FILE = os.path.join(DATA_DIR, 'expenses.json')
+EXPENSES_DIR = os.path.join(DATA_DIR, 'expenses')
+SETTINGS_FILE = os.path.join(DATA_DIR, 'settings.json')
+BUDGETS_FILE = os.path.join(DATA_DIR, 'budgets.json')
+RECURRING_FILE = os.path.join(DATA_DIR, 'recurring.json')
+
+# Maximum number of tenant ledgers kept open in memory
+TENANT_CACHE_SIZE = int(os.environ.get('TENANT_CACHE_SIZE', 256))
 
-# Ensure data directory exists
-os.makedirs(os.path.dirname(EXPENSES_FILE), exist_ok=True)
+# Storage backend of every ledger: json, memory, journal or sqlite
+STORAGE_BACKEND = os.environ.get('EXPENSE_TRACKER_STORAGE', DEFAULT_BACKEND)
 
 # Constants
 CATEGORIES = ['Food', 'Transportation', 'Entertainment', 'Shopping', 'Utilities', 'Healthcare', 'Others']
@@ -36,6 +53,7 @@ CURRENCIES = {
     'SGD': {'symbol': 'S$', 'name': 'Singapore Dollar'}
 }
 
+# Balances are opening balances; current balances come from WalletManager
 DEFAULT_WALLETS = [
     {'id': 1, 'name': 'Cash', 'balance': 0},
     {'id': 2, 'name': 'Bank', 'balance': 0},
@@ -44,7 +62,7 @@ DEFAULT_WALLETS = [
 ]
 
 DEFAULT_SETTINGS = {
-    'currency': 'INR',
+    'currency': DEFAULT_CURRENCY,
     'theme': 'dark',
     'wallets': DEFAULT_WALLETS
 }
@@ -61,123 +79,352 @@ DEFAULT_BUDGETS = {
     'monthly_limit': 0
 }
 
+DEFAULT_RULES = {
+    'default': None,
+    'rules': []
+}
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Get the registry of open tenant ledgers"""
+    global _registry
+    registry = _registry
+    if registry is None:
+        # Created once, so concurrent first requests share its ledgers
+        with _registry_lock:
+            if _registry is None:
+                _registry = TenantRegistry(DATA_DIR, capacity=TENANT_CACHE_SIZE, backend=STORAGE_BACKEND)
+            registry = _registry
+    return registry
+
+
+def set_data_dir(data_dir):
+    """Point storage at another data directory (tests, benchmarks), dropping open ledgers"""
+    global DATA_DIR, _registry
+    DATA_DIR = data_dir
+    with _registry_lock:
+        _registry = None
+
+
+def set_storage_backend(backend):
+    """Switch the storage backend of every ledger, dropping open ledgers"""
+    global STORAGE_BACKEND, _registry
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown storage backend: {backend}")
+    STORAGE_BACKEND = backend
+    with _registry_lock:
+        _registry = None
+
+
+def get_tenant_store():
+    """Get the ledger of the current tenant"""
+    return get_registry().get(current_tenant.get())
+
+
+def get_expense_store():
+    """Get the month-partitioned ledger of the current tenant"""
+    return get_tenant_store().expenses
+
+
+def publish_change(event_type, data):
+    """Publish a change event with fresh dashboard totals to the current tenant's feed"""
+    try:
+        store = get_tenant_store()
+        now = datetime.now()
+        totals = store.expenses.dashboard_totals(
+            now.strftime('%Y-%m-%d'),
+            (now - timedelta(days=now.weekday())).strftime('%Y-%m-%d'),
+            store.fx.summaries()
+        )
+        store.feed.publish(event_type, dict(data, totals=totals))
+    except Exception as e:
+        logger.exception("Error publishing change")
+
+
+def check_budgets(month=None):
+    """Raise budget alerts after a write to the current month (or a budget change)"""
+    try:
+        now = datetime.now()
+        if month is not None and month != now.strftime('%Y-%m'):
+            return
+        get_tenant_store().alerts.evaluate(BudgetManager.load(now.strftime('%Y-%m')), CATEGORIES, now)
+    except Exception as e:
+        logger.exception("Error checking budgets")
+
 
 class ExpenseManager:
     """Handle all expense operations"""
     
     @staticmethod
+    @timed('storage.load')
     def load():
         """Load expenses from database"""
         try:
-            if os.path.exists(EXPENSES_FILE):
-                with open(EXPENSES_FILE, 'r') as f:
-                    return json.load(f)
+            return get_expense_store().load_all()
+        except Exception as e:
+            logger.exception("Error loading expenses")
+        return []
+    
+    @staticmethod
+    @timed('storage.load')
+    def load_range(start_date=None, end_date=None):
+        """Load expenses within an inclusive date range, opening only overlapping months"""
+        try:
+            return get_expense_store().load_range(start_date, end_date)
         except Exception as e:
-            print(f"Error loading expenses: {e}")
+            logger.exception("Error loading expenses")
         return []
     
     @staticmethod
+    @timed('storage.load')
+    def totals():
+        """Get all-time count and total, in the reporting currency, without loading any expenses"""
+        try:
+            store = get_tenant_store()
+            return store.expenses.totals(store.fx.summaries())
+        except Exception as e:
+            logger.exception("Error loading expense totals")
+        return {'count': 0, 'total': 0, 'highest': 0}
+    
+    @staticmethod
+    @timed('storage.load')
+    def dashboard_totals(today, week_start):
+        """Get all-time, month, week and day totals in the reporting currency from the partition summaries"""
+        try:
+            store = get_tenant_store()
+            return store.expenses.dashboard_totals(today, week_start, store.fx.summaries())
+        except Exception as e:
+            logger.exception("Error loading dashboard totals")
+        return {
+            'all_time': 0, 'this_month': 0, 'this_week': 0, 'today': 0,
+            'count': 0, 'month_count': 0, 'highest': 0, 'categories': {}, 'sketches': {}
+        }
+    
+    @staticmethod
+    @timed('storage.load')
+    def month_summary(month):
+        """Get the manifest summary (totals by day and category, in the reporting currency) of one month"""
+        try:
+            return get_tenant_store().fx.summaries().get(month, {})
+        except Exception as e:
+            logger.exception("Error loading month summary")
+        return {}
+    
+    @staticmethod
+    @timed('storage.load')
+    def unconverted(start_date=None, end_date=None):
+        """List the currencies without an exchange rate, whose amounts are added as booked, within a date range"""
+        try:
+            store = get_tenant_store()
+            return store.fx.unconverted(store.expenses.months(start_date, end_date))
+        except Exception as e:
+            logger.exception("Error loading exchange rates")
+        return []
+    
+    @staticmethod
+    @timed('aggregate')
+    def query(query):
+        """Run a group-by query (see models/query.py) in the reporting currency; returns rows and the plan used"""
+        store = get_tenant_store()
+        base, _ = store.fx.currencies()
+        return run_query(store.expenses, store.fx.summaries(), query, base, store.fx.row_factors())
+    
+    @staticmethod
+    @timed('aggregate')
+    def distribution(start=None, end=None):
+        """Get the median, p90 and p99 of amounts overall and per category between two months, from the month sketches"""
+        store = get_tenant_store()
+        summaries = store.fx.summaries()
+        return distribution(summaries.get(month, {}) for month in store.expenses.months(start, end))
+    
+    @staticmethod
+    @timed('aggregate')
+    def anomalies(start_date=None, end_date=None):
+        """Get the expenses in a date range whose amount is far outside the typical range of their category"""
+        store = get_tenant_store()
+        # Typical ranges come from the whole history, merged from the month sketches
+        typical = {c: fences(s) for c, s in merge_categories(store.fx.summaries().values()).items()}
+        factor = store.fx.row_factors()
+        
+        flagged = []
+        for expense in store.expenses.load_range(start_date, end_date):
+            bounds = typical.get(expense.get('category'))
+            if bounds is None or not is_spending(expense):
+                continue
+            amount = expense.get('amount', 0)
+            if factor is not None:
+                amount *= factor(expense.get('currency'), expense.get('date'))
+            if amount > bounds['high'] or amount < bounds['low']:
+                flagged.append(dict(expense, anomaly=dict(
+                    bounds, amount=amount, direction='high' if amount > bounds['high'] else 'low'
+                )))
+        return flagged
+    
+    @staticmethod
+    @timed('aggregate')
+    def timeseries(start=None, end=None, granularity='auto', category=None):
+        """Get gap-filled spending totals between two dates by day, week, month or year, in the reporting currency"""
+        return get_tenant_store().series.series(start, end, granularity, category)
+    
+    @staticmethod
+    @timed('aggregate')
+    def forecast(today=None):
+        """Get end-of-month and next-month spending forecasts per category, in the reporting currency"""
+        return get_tenant_store().forecasts.forecast(today)
+    
+    @staticmethod
+    @timed('storage.load')
+    def changes(since):
+        """Get expenses written and IDs deleted after a change sequence number"""
+        return get_expense_store().changes(since)
+    
+    @staticmethod
+    @timed('storage.write')
     def save(expenses):
         """Save expenses to database"""
         try:
-            with open(EXPENSES_FILE, 'w') as f:
-                json.dump(expenses, f, indent=2)
+            get_expense_store().replace_all(expenses)
+            publish_change('resync', {})
+            check_budgets()
             return True, "Expenses saved"
         except Exception as e:
             return False, f"Failed to save: {str(e)}"
     
     @staticmethod
+    def _new_expense(expense_data):
+        """Build a stored expense from validated input"""
+        expense = {
+            'id': str(uuid.uuid4()),
+            'date': expense_data.get('date'),
+            'category': expense_data.get('category'),
+            'description': expense_data.get('description'),
+            'amount': float(expense_data.get('amount', 0)),
+            'payment_method': expense_data.get('payment_method'),
+            'wallet': expense_data.get('wallet'),
+            'receipt': expense_data.get('receipt'),
+            'notes': expense_data.get('notes'),
+            'tags': expense_data.get('tags', []),
+            'recurring': expense_data.get('recurring', False),
+            'created_at': datetime.now().isoformat()
+        }
+        # Expenses without a currency are in the ledger's base currency
+        if expense_data.get('currency'):
+            expense['currency'] = expense_data['currency']
+        # Rows without a type are expenses
+        if expense_data.get('type') not in (None, 'expense'):
+            expense['type'] = expense_data['type']
+            if expense_data.get('to_wallet'):
+                expense['to_wallet'] = expense_data['to_wallet']
+        return expense
+    
+    @staticmethod
+    @timed('storage.write')
     def add(expense_data):
-        """Add new expense"""
+        """Add new expense; near-duplicates of stored expenses are added with their IDs under duplicate_of"""
         try:
-            expenses = ExpenseManager.load()
+            expense = ExpenseManager._new_expense(expense_data)
             
-            expense = {
-                'id': str(uuid.uuid4()),
-                'date': expense_data.get('date'),
-                'category': expense_data.get('category'),
-                'description': expense_data.get('description'),
-                'amount': float(expense_data.get('amount', 0)),
-                'payment_method': expense_data.get('payment_method'),
-                'wallet': expense_data.get('wallet'),
-                'receipt': expense_data.get('receipt'),
-                'notes': expense_data.get('notes'),
-                'tags': expense_data.get('tags', []),
-                'recurring': expense_data.get('recurring', False),
-                'created_at': datetime.now().isoformat()
-            }
-            
-            expenses.append(expense)
-            success, msg = ExpenseManager.save(expenses)
-            
-            if success:
-                return True, expense
-            else:
-                return False, msg
+            # Concurrent posts are written (and synced) together
+            store = get_tenant_store()
+            _, duplicates = store.commits.submit(lambda: store.duplicates.insert([expense]))
+            publish_change('expense.added', {'expense': expense})
+            check_budgets((expense['date'] or '')[:7])
+            if duplicates:
+                return True, dict(expense, duplicate_of=duplicates[0][1])
+            return True, expense
         
         except Exception as e:
             return False, f"Error adding expense: {str(e)}"
     
     @staticmethod
+    @timed('storage.write')
+    def import_expenses(rows, skip_duplicates=True):
+        """Add validated expenses in one write per month; returns the added and the near-duplicate ones"""
+        try:
+            expenses = [ExpenseManager._new_expense(row) for row in rows]
+            store = get_tenant_store()
+            added, duplicates = store.commits.submit(lambda: store.duplicates.insert(expenses, skip_duplicates))
+            if added:
+                publish_change('resync', {})
+                check_budgets()
+            return True, {
+                'added': added,
+                'duplicates': [dict(expense, duplicate_of=matches) for expense, matches in duplicates]
+            }
+        
+        except Exception as e:
+            return False, f"Error importing expenses: {str(e)}"
+    
+    @staticmethod
+    @timed('storage.write')
     def delete(expense_id):
         """Delete expense by ID"""
         try:
-            expenses = ExpenseManager.load()
-            expenses = [e for e in expenses if e['id'] != expense_id]
-            success, msg = ExpenseManager.save(expenses)
-            return success, msg
+            store = get_tenant_store()
+            if store.commits.submit(lambda: store.expenses.delete(expense_id)):
+                publish_change('expense.deleted', {'id': expense_id})
+            return True, "Expenses saved"
         except Exception as e:
             return False, f"Error deleting: {str(e)}"
     
     @staticmethod
+    @timed('storage.write')
     def update(expense_id, updated_data):
         """Update expense"""
         try:
-            expenses = ExpenseManager.load()
-            
-            for i, expense in enumerate(expenses):
-                if expense['id'] == expense_id:
-                    # Update only provided fields
-                    for key, value in updated_data.items():
-                        if key != 'id':  # Don't update ID
-                            expense[key] = value
-                    break
-            
-            success, msg = ExpenseManager.save(expenses)
-            return success, msg
+            store = get_tenant_store()
+            expense = store.commits.submit(lambda: store.expenses.update(expense_id, updated_data))
+            if expense is not None:
+                publish_change('expense.updated', {'expense': expense})
+                check_budgets((expense.get('date') or '')[:7])
+            return True, "Expenses saved"
         except Exception as e:
             return False, f"Error updating: {str(e)}"
     
     @staticmethod
+    @timed('storage.load')
     def get_by_id(expense_id):
         """Get expense by ID"""
-        expenses = ExpenseManager.load()
-        for expense in expenses:
-            if expense['id'] == expense_id:
-                return expense
-        return None
+        return get_expense_store().get(expense_id)
+    
+    @staticmethod
+    @timed('storage.load')
+    def history(expense_id):
+        """Get the revisions of an expense with the field-level changes of each, or None"""
+        return get_tenant_store().revisions.history(expense_id)
+    
+    @staticmethod
+    @timed('storage.load')
+    def as_of(timestamp, start_date=None, end_date=None):
+        """Get expenses within an inclusive date range as they were at a local ISO timestamp"""
+        return get_tenant_store().revisions.as_of(timestamp, start_date, end_date)
 
 
 class SettingsManager:
     """Handle settings operations"""
     
     @staticmethod
+    @timed('storage.load')
     def load():
         """Load settings"""
         try:
-            if os.path.exists(SETTINGS_FILE):
-                with open(SETTINGS_FILE, 'r') as f:
-                    return json.load(f)
+            settings = get_expense_store().load_document('settings')
+            if settings is not None:
+                return settings
         except Exception as e:
-            print(f"Error loading settings: {e}")
+            logger.exception("Error loading settings")
         return DEFAULT_SETTINGS.copy()
     
     @staticmethod
+    @timed('storage.write')
     def save(settings):
         """Save settings"""
         try:
-            with open(SETTINGS_FILE, 'w') as f:
-                json.dump(settings, f, indent=2)
+            get_expense_store().save_document('settings', settings)
             return True, "Settings saved"
         except Exception as e:
             return False, f"Failed to save: {str(e)}"
@@ -187,22 +434,177 @@ class BudgetManager:
     """Handle budget operations"""
     
     @staticmethod
-    def load():
-        """Load budgets"""
+    def _base():
+        budgets = get_expense_store().load_document('budgets')
+        return budgets if budgets is not None else DEFAULT_BUDGETS.copy()
+    
+    @staticmethod
+    @timed('storage.load')
+    def load(period=None):
+        """Load the default budgets, or the effective budgets of a month (YYYY-MM)"""
         try:
-            if os.path.exists(BUDGETS_FILE):
-                with open(BUDGETS_FILE, 'r') as f:
-                    return json.load(f)
+            if period is None:
+                return BudgetManager._base()
+            return get_tenant_store().history.budgets(BudgetManager._base(), period, CATEGORIES)
         except Exception as e:
-            print(f"Error loading budgets: {e}")
+            logger.exception("Error loading budgets")
         return DEFAULT_BUDGETS.copy()
     
     @staticmethod
-    def save(budgets):
-        """Save budgets"""
+    @timed('storage.load')
+    def load_period(period):
+        """Load the budget override of one month (only the fields it changes)"""
+        try:
+            return get_tenant_store().history.period(period)
+        except Exception as e:
+            logger.exception("Error loading budgets")
+        return {}
+    
+    @staticmethod
+    @timed('storage.load')
+    def is_closed(period):
+        """Check whether a month has been closed (its budgets are frozen)"""
+        return get_tenant_store().history.is_closed(period)
+    
+    @staticmethod
+    @timed('storage.load')
+    def alerts(limit=50):
+        """Get the newest budget alerts, newest first"""
+        try:
+            return get_tenant_store().alerts.recent(limit)
+        except Exception as e:
+            logger.exception("Error loading budget alerts")
+        return []
+    
+    @staticmethod
+    @timed('storage.load')
+    def history(start=None, end=None):
+        """Get budget vs actual per month, closing finished months first"""
+        store = get_tenant_store()
+        return store.history.history(BudgetManager._base(), CATEGORIES, start, end)
+    
+    @staticmethod
+    @timed('storage.write')
+    def save(budgets, period=None):
+        """Save the default budgets, or the budget override of one month"""
         try:
-            with open(BUDGETS_FILE, 'w') as f:
-                json.dump(budgets, f, indent=2)
+            if period is None:
+                get_expense_store().save_document('budgets', budgets)
+            else:
+                get_tenant_store().history.save_period(period, budgets)
+            publish_change('budget.changed', {'budgets': budgets, 'period': period})
+            check_budgets()
             return True, "Budgets saved"
         except Exception as e:
             return False, f"Failed to save: {str(e)}"
+
+
+class WalletManager:
+    """Handle wallet balance operations"""
+    
+    @staticmethod
+    def _opening():
+        """Opening balance of every wallet in the settings"""
+        wallets = SettingsManager.load().get('wallets', DEFAULT_WALLETS)
+        return {w['name']: w.get('balance', 0) for w in wallets if w.get('name')}
+    
+    @staticmethod
+    @timed('storage.load')
+    def balances(day=None):
+        """Get the balance of every wallet, now or at the end of a day (YYYY-MM-DD)"""
+        try:
+            opening = WalletManager._opening()
+            wallets = get_tenant_store().wallets
+            balances = wallets.balances(opening, day)
+            unconverted = wallets.unconverted()
+            return [
+                {'name': name, 'opening_balance': opening.get(name, 0), 'balance': balance,
+                 'unconverted': unconverted.get(name, [])}
+                for name, balance in balances.items()
+            ]
+        except Exception as e:
+            logger.exception("Error loading wallet balances")
+        return []
+    
+    @staticmethod
+    @timed('storage.load')
+    def history(wallet, start=None, end=None):
+        """Get the balance of a wallet after every day it changed between two dates"""
+        opening = WalletManager._opening().get(wallet, 0)
+        return get_tenant_store().wallets.history(wallet, opening, start, end)
+    
+    @staticmethod
+    @timed('storage.load')
+    def reconcile():
+        """Rebuild the balance index from the ledger and report any drift"""
+        return get_tenant_store().wallets.reconcile()
+
+
+class RuleManager:
+    """Handle auto-categorisation rule operations"""
+    
+    @staticmethod
+    @timed('storage.load')
+    def load():
+        """Load the rules document"""
+        try:
+            rules = get_expense_store().load_document(RULES_DOCUMENT)
+            if rules is not None:
+                return rules
+        except Exception as e:
+            logger.exception("Error loading rules")
+        return DEFAULT_RULES.copy()
+    
+    @staticmethod
+    @timed('storage.write')
+    def save(rules):
+        """Save a validated rules document; it applies from the next expense on"""
+        try:
+            get_expense_store().save_document(RULES_DOCUMENT, rules)
+            return True, "Rules saved"
+        except Exception as e:
+            return False, f"Failed to save: {str(e)}"
+    
+    @staticmethod
+    @timed('categorize')
+    def categorize(rows):
+        """Fill in the category (and rule tags) of expense data without one"""
+        try:
+            rules = get_tenant_store().rules.compiled()
+        except Exception as e:
+            logger.exception("Error loading rules")
+            return rows
+        return [rules.apply(row) if isinstance(row, dict) else row for row in rows]
+
+
+class BackupManager:
+    """Handle ledger backup and restore operations"""
+    
+    @staticmethod
+    @timed('storage.load')
+    def list():
+        """List the backup archives, newest first, and whether a backup is running"""
+        backups = get_tenant_store().backups
+        return {
+            'archives': backups.archives(),
+            'running': backups.running,
+            'last_error': backups.last_error
+        }
+    
+    @staticmethod
+    def start(full=None):
+        """Start a backup in the background; fails when one is already running"""
+        if get_tenant_store().backups.start(full):
+            return True, "Backup started"
+        return False, "A backup is already running"
+    
+    @staticmethod
+    @timed('storage.write')
+    def restore(name):
+        """Restore the ledger to a backup archive; raises BackupError when it cannot be read"""
+        store = get_tenant_store()
+        result = store.backups.restore(name)
+        store.expenses.sync()
+        publish_change('resync', {})
+        check_budgets()
+        return True, result
@@ -0,0 +1,155 @@
+"""
+Near-duplicate expense detection
+
+Two expenses are near-duplicates when they have the same amount (to the
+cent, in the same currency), payment method and normalised description
+(lower case, punctuation and repeated spaces dropped), and their dates are at
+most ``DUPLICATE_WINDOW_DAYS`` apart.
+
+``DuplicateIndex`` hashes every expense of a month partition on that key, so
+checking a new expense looks up one key in the two or three months around its
+date and compares the few dates found there: O(1) expected per expense, never
+a scan of the ledger. A month's index is built the first time it is looked up
+and reused until its partition is rewritten. Expenses added through
+``insert`` are appended to it instead, and checked and written under the
+ledger lock so two concurrent submissions cannot both pass. Rows of one
+``insert`` are also checked against the rows accepted before them in it.
+"""
+
+import os
+import re
+from collections import defaultdict
+from datetime import date, timedelta
+from .partitions import month_key
+
+
+DUPLICATE_WINDOW_DAYS = int(os.environ.get('DUPLICATE_WINDOW_DAYS', 3))
+_PUNCTUATION = re.compile(r'[^\w\s]+')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize_description(text):
+    """Lower-case a description and drop punctuation and repeated whitespace"""
+    return _SPACES.sub(' ', _PUNCTUATION.sub(' ', str(text or '').lower())).strip()
+
+
+def duplicate_key(expense):
+    """Get the hash key two near-duplicates share"""
+    try:
+        cents = round(float(expense.get('amount') or 0) * 100)
+    except (TypeError, ValueError):
+        cents = None
+    return (cents, expense.get('currency') or '', normalize_description(expense.get('description')),
+            expense.get('payment_method'))
+
+
+def _ordinal(day):
+    try:
+        return date.fromisoformat(day).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+class DuplicateIndex:
+    """Hash index of the expenses of one ledger on their near-duplicate key"""
+
+    def __init__(self, ledger, window=DUPLICATE_WINDOW_DAYS):
+        self.ledger = ledger
+        self.window = window
+        # month -> [partition revision, {key: [(day ordinal, expense ID)]}]
+        self._months = {}
+
+    def _month(self, month, summaries):
+        """Get the index of a month partition, (re)building it when it was rewritten"""
+        summary = summaries.get(month)
+        if summary is None:
+            self._months.pop(month, None)
+            return None
+        entry = self._months.get(month)
+        if entry is None or entry[0] != summary.get('rev'):
+            keys = defaultdict(list)
+            for record in self.ledger._partition(month):
+                ordinal = _ordinal(record.get('date'))
+                if ordinal is not None:
+                    keys[duplicate_key(record)].append((ordinal, record.get('id')))
+            entry = self._months[month] = [summary.get('rev'), keys]
+        return entry[1]
+
+    def _find(self, expense, summaries, batch=None):
+        """IDs of the stored expenses, and of the expenses in batch ({key: [(day ordinal, ID)]}), matching one"""
+        ordinal = _ordinal(expense.get('date'))
+        if ordinal is None:
+            return []
+        key = duplicate_key(expense)
+        first = date.fromordinal(ordinal - self.window)
+        last = date.fromordinal(ordinal + self.window)
+        months = {month_key(first.isoformat()), month_key(last.isoformat())}
+        day = first.replace(day=1)
+        while day < last:
+            months.add(month_key(day.isoformat()))
+            day = (day + timedelta(days=32)).replace(day=1)
+
+        matches = []
+        for month in sorted(months):
+            keys = self._month(month, summaries)
+            if keys is None:
+                continue
+            matches.extend(expense_id for other, expense_id in keys.get(key, ())
+                           if abs(other - ordinal) <= self.window)
+        if batch:
+            matches.extend(expense_id for other, expense_id in batch.get(key, ())
+                           if abs(other - ordinal) <= self.window)
+        return matches
+
+    def find(self, expense):
+        """Get the IDs of the stored expenses an expense is a near-duplicate of"""
+        with self.ledger._lock:
+            return self._find(expense, self.ledger.summaries())
+
+    def insert(self, expenses, skip_duplicates=False):
+        """
+        Check expenses against the ledger and add them in one write per month
+        Returns (added, duplicates): duplicates are (expense, matching IDs)
+        pairs, matching stored expenses or ones added earlier in the same
+        call; they are added too unless skip_duplicates is set.
+        """
+        with self.ledger._lock:
+            summaries = self.ledger.summaries()
+            added = []
+            duplicates = []
+            # Keys of the expenses accepted so far in this call, not in the index yet
+            batch = defaultdict(list)
+            for expense in expenses:
+                matches = self._find(expense, summaries, batch)
+                if matches:
+                    duplicates.append((expense, matches))
+                    if skip_duplicates:
+                        continue
+                added.append(expense)
+                ordinal = _ordinal(expense.get('date'))
+                if ordinal is not None:
+                    batch[duplicate_key(expense)].append((ordinal, expense.get('id')))
+            if not added:
+                return added, duplicates
+
+            by_month = defaultdict(list)
+            for expense in added:
+                by_month[month_key(expense.get('date'))].append(expense)
+            revisions = {month: self._months[month][0] for month in by_month if month in self._months}
+            self.ledger.add_many(added)
+
+            # Each month was written once: extend its index rather than rebuilding it
+            summaries = self.ledger.summaries()
+            for month, rows in by_month.items():
+                entry = self._months.get(month)
+                if entry is None:
+                    continue
+                if summaries.get(month, {}).get('rev') != revisions[month] + 1:
+                    del self._months[month]
+                    continue
+                entry[0] += 1
+                for expense in rows:
+                    ordinal = _ordinal(expense.get('date'))
+                    if ordinal is not None:
+                        entry[1][duplicate_key(expense)].append((ordinal, expense.get('id')))
+            return added, duplicates
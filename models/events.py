@@ -0,0 +1,125 @@
+"""
+In-process change feed
+
+Every mutation publishes a compact event to its tenant's feed. Subscribers
+(one per open Server-Sent Events connection) get a bounded queue; a client
+that falls too far behind is sent a ``resync`` event instead of an unbounded
+backlog. Recent events are kept in a ring buffer so a reconnecting client can
+resume from its ``Last-Event-ID``.
+
+Event IDs have the form ``<boot>-<seq>``; an ID from another process or an
+earlier run cannot be resumed and also yields ``resync``.
+"""
+
+import itertools
+import queue
+import threading
+import uuid
+from collections import deque
+
+
+BUFFER_SIZE = 1000
+QUEUE_SIZE = 100
+
+
+class Subscription:
+    """Bounded event queue of one connection"""
+
+    def __init__(self, feed, maxsize):
+        self.feed = feed
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.overflowed = False
+        # Called in the publishing thread once an event is queued; lets an event loop wait without a thread
+        self.notify = None
+
+    def get(self, timeout=None):
+        """Get the next event, or None on timeout"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def get_nowait(self):
+        """Get the next event, or None when none is queued"""
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    def _offer(self, event):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Drop the backlog and tell the client to refetch once
+            self.overflowed = True
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            self.queue.put_nowait(self.feed.resync_event())
+        if self.notify is not None:
+            self.notify()
+
+    def close(self):
+        self.feed.unsubscribe(self)
+
+
+class ChangeFeed:
+    """Publish/subscribe hub with a replay buffer"""
+
+    def __init__(self, buffer_size=BUFFER_SIZE):
+        self.boot = uuid.uuid4().hex[:8]
+        self._seq = itertools.count(1)
+        self._buffer = deque(maxlen=buffer_size)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def resync_event(self):
+        return {'id': None, 'type': 'resync', 'data': {}}
+
+    def publish(self, event_type, data):
+        """Publish an event to every subscriber"""
+        with self._lock:
+            event = {'id': f"{self.boot}-{next(self._seq)}", 'type': event_type, 'data': data}
+            self._buffer.append(event)
+            for subscriber in self._subscribers:
+                subscriber._offer(event)
+        return event
+
+    def subscribe(self, last_event_id=None, maxsize=QUEUE_SIZE):
+        """Open a subscription, replaying events after last_event_id"""
+        subscription = Subscription(self, maxsize)
+        with self._lock:
+            if last_event_id:
+                backlog = self._events_after(last_event_id)
+                if backlog is None or len(backlog) >= maxsize:
+                    subscription.queue.put_nowait(self.resync_event())
+                else:
+                    for event in backlog:
+                        subscription.queue.put_nowait(event)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def _events_after(self, last_event_id):
+        """Buffered events after an ID, or None when it cannot be resumed"""
+        boot, _, seq = last_event_id.partition('-')
+        if boot != self.boot or not seq.isdigit():
+            return None
+        seq = int(seq)
+        if not self._buffer:
+            return []
+        first = int(self._buffer[0]['id'].partition('-')[2])
+        if seq < first - 1:
+            return None
+        return [e for e in self._buffer if int(e['id'].partition('-')[2]) > seq]
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
@@ -0,0 +1,225 @@
+"""
+Spending forecasts
+
+End-of-month and next-month spending per category, fitted on the daily
+category totals kept in the manifest summaries (``category_days`` and
+``recurring``, see ``partitions.summarize``) in the reporting currency:
+
+- recurring expenses repeat on the same day of the next month, so the latest
+  occurrence of each is scheduled again (days past the end of a shorter month
+  fall on its last day) unless it is already booked;
+- everything else follows a weekday-seasonal run rate: over the last
+  ``FIT_DAYS`` days, the mean spend of each weekday blended with the overall
+  daily mean (``SEASONALITY_PRIOR`` days' worth), so a weekday seen only a few
+  times is not taken at face value.
+
+Fitting reads a few dozen daily totals per category, never rows. The daily
+series of every month are cached per summary, so a write only rebuilds the
+series of the month it touched, and the fitted forecast is cached until a
+summary it was fitted on changes or the day rolls over. The fit is vectorised
+with NumPy when it is installed.
+"""
+
+import calendar
+import threading
+from datetime import date, timedelta
+
+try:
+    import numpy as np
+except ImportError:  # the fit falls back to plain Python
+    np = None
+
+
+# Days of history the run rate is fitted on
+FIT_DAYS = 84
+# Days of the overall daily mean blended into each weekday's mean
+SEASONALITY_PRIOR = 2
+
+
+def _month_key(day):
+    return day.strftime('%Y-%m')
+
+
+def _month_days(month):
+    year, number = int(month[:4]), int(month[5:7])
+    return calendar.monthrange(year, number)[1]
+
+
+def _next_month(day):
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def _weekday_counts(first, last):
+    """Number of days of each weekday between two dates (inclusive)"""
+    counts = [0] * 7
+    day = first
+    while day <= last:
+        counts[day.weekday()] += 1
+        day += timedelta(days=1)
+    return counts
+
+
+class MonthSeries:
+    """Non-recurring spend per day of one month and its recurring expenses, per category"""
+
+    __slots__ = ('days', 'recurring')
+
+    def __init__(self, month, summary):
+        size = _month_days(month)
+        self.days = {}
+        self.recurring = {}
+        recurring = summary.get('recurring', {})
+        for category, amounts in summary.get('category_days', {}).items():
+            series = [0.0] * size
+            for day, amount in amounts.items():
+                series[int(day[8:10]) - 1] += amount
+            for day, amount in recurring.get(category, {}).items():
+                series[int(day[8:10]) - 1] -= amount
+            self.days[category] = series
+        for category, amounts in recurring.items():
+            self.recurring[category] = {int(day[8:10]): amount for day, amount in amounts.items()}
+
+
+def _fit(values, weekdays, counts, horizons):
+    """
+    Get the expected spend of every category over each horizon
+    values: one list of daily amounts per category (aligned with weekdays);
+    counts: days of each weekday in the fit; horizons: weekday counts to predict.
+    """
+    if np is not None:
+        x = np.asarray(values, dtype=float)
+        onehot = np.zeros((len(weekdays), 7))
+        onehot[np.arange(len(weekdays)), weekdays] = 1.0
+        level = x.mean(axis=1)
+        rates = (x @ onehot + SEASONALITY_PRIOR * level[:, None]) / (np.asarray(counts) + SEASONALITY_PRIOR)
+        return (rates @ np.asarray(horizons, dtype=float).T).tolist()
+
+    results = []
+    for series in values:
+        sums = [0.0] * 7
+        for amount, weekday in zip(series, weekdays):
+            sums[weekday] += amount
+        level = sum(series) / len(series)
+        rates = [(sums[w] + SEASONALITY_PRIOR * level) / (counts[w] + SEASONALITY_PRIOR) for w in range(7)]
+        results.append([sum(r * n for r, n in zip(rates, horizon)) for horizon in horizons])
+    return results
+
+
+class SpendingForecaster:
+    """Cached spending forecasts of one ledger"""
+
+    def __init__(self, ledger, summaries=None):
+        self.ledger = ledger
+        # Summaries in the reporting currency (see fx.py)
+        self.summaries = summaries or ledger.summaries
+        self._lock = threading.Lock()
+        # month -> (summary it was built from, MonthSeries)
+        self._series = {}
+        # ((today, first day), summaries fitted on, forecast)
+        self._forecast = None
+
+    def _month(self, summaries, month):
+        summary = summaries.get(month)
+        if summary is None:
+            return None
+        entry = self._series.get(month)
+        if entry is None or entry[0] is not summary:
+            entry = self._series[month] = (summary, MonthSeries(month, summary))
+        return entry[1]
+
+    def forecast(self, today=None):
+        """Get this month's spend so far and its end-of-month and next-month forecasts, per category and in total"""
+        today = today or date.today()
+        summaries = self.summaries()
+        first = min((s['first'] for s in summaries.values() if s.get('first')), default=None)
+        fit_from = max(today - timedelta(days=FIT_DAYS), date.fromisoformat(first) if first else today)
+        fit_to = max(today - timedelta(days=1), fit_from)
+        next_start = _next_month(today)
+        # The previous month (for recurring expenses) through this one
+        months = []
+        month = min(fit_from, today.replace(day=1) - timedelta(days=1)).replace(day=1)
+        while month < next_start:
+            months.append(_month_key(month))
+            month = _next_month(month)
+        used = tuple(summaries.get(m) for m in months)
+
+        with self._lock:
+            cached = self._forecast
+            if cached is not None and cached[0] == (today, first) and len(cached[1]) == len(used) and \
+                    all(a is b for a, b in zip(cached[1], used)):
+                return cached[2]
+            for month in set(self._series) - set(summaries):
+                del self._series[month]
+            series = {m: self._month(summaries, m) for m in months}
+            result = self._build(summaries, series, today, fit_from, fit_to, next_start)
+            self._forecast = ((today, first), used, result)
+            return result
+
+    def _build(self, summaries, series, today, fit_from, fit_to, next_start):
+        this_month = _month_key(today)
+        previous = series[_month_key(today.replace(day=1) - timedelta(days=1))]
+        current = series[this_month]
+
+        # Daily non-recurring spend of every category over the fit window
+        weekdays = []
+        window = []
+        day = fit_from
+        while day <= fit_to:
+            weekdays.append(day.weekday())
+            window.append((series[_month_key(day)], day.day - 1))
+            day += timedelta(days=1)
+        categories = set()
+        for month_series in (previous, current):
+            if month_series is not None:
+                categories.update(month_series.days)
+                categories.update(month_series.recurring)
+        categories.update(c for s, _ in window if s is not None for c in s.days)
+        categories = sorted(categories, key=str)
+
+        values = []
+        for category in categories:
+            row = []
+            for month_series, index in window:
+                amounts = month_series.days.get(category) if month_series is not None else None
+                row.append(amounts[index] if amounts else 0.0)
+            values.append(row)
+
+        month_end = next_start - timedelta(days=1)
+        next_end = _next_month(next_start) - timedelta(days=1)
+        remaining = _weekday_counts(today + timedelta(days=1), month_end)
+        upcoming = _weekday_counts(next_start, next_end)
+        counts = [0] * 7
+        for weekday in weekdays:
+            counts[weekday] += 1
+        predicted = _fit(values, weekdays, counts, [remaining, upcoming]) if categories else []
+
+        # Booked at the rate of each day, as the fit is
+        spent = {category: sum(amounts.values())
+                 for category, amounts in summaries.get(this_month, {}).get('category_days', {}).items()}
+        result = {}
+        for category, (rest, following) in zip(categories, predicted):
+            booked = current.recurring.get(category, {}) if current is not None else {}
+            # Latest occurrence of every recurring expense, by day of month
+            schedule = dict(previous.recurring.get(category, {}) if previous is not None else {})
+            schedule.update(booked)
+            due = sum(amount for dom, amount in schedule.items()
+                      if min(dom, month_end.day) > today.day and dom not in booked)
+            result[category] = {
+                'spent': spent.get(category, 0),
+                'end_of_month': spent.get(category, 0) + rest + due,
+                'next_month': following + sum(schedule.values())
+            }
+
+        return {
+            'as_of': today.isoformat(),
+            'month': this_month,
+            'next_month': _month_key(next_start),
+            'total': {field: sum(c[field] for c in result.values())
+                      for field in ('spent', 'end_of_month', 'next_month')},
+            'categories': result,
+            'model': {
+                'fit_from': fit_from.isoformat(),
+                'fit_to': fit_to.isoformat(),
+                'engine': 'numpy' if np is not None else 'python'
+            }
+        }
@@ -0,0 +1,256 @@
+"""
+Exchange rates and conversion into the reporting currency
+
+Expenses may carry a ``currency``; rows without one are in the ledger's base
+currency (``settings.base_currency``, defaulting to ``settings.currency``).
+Stats and charts are reported in ``settings.currency``.
+
+Rates come from ``data/fx_rates.json``, one table of rates per date against a
+pivot currency::
+
+    {"base": "USD", "rates": {"2026-10-01": {"EUR": 0.92, "INR": 83.2}}}
+
+Each currency's dated rates are expanded into a dense array with one entry per
+day from its first to its last date (days in between repeat the previous
+rate, days outside the range use the nearest end), so the rate of any
+(currency, date) is one array index.
+
+Conversion never touches rows: manifest summaries keep day and category
+totals per currency, and each partition summary is converted once per
+revision and cached, so a dashboard costs a few dictionary lookups per
+(currency, day) of the months it shows whatever the number of rows. Day and
+overall totals use the rate of each day; category totals and the largest
+expense (and the amount sketches, see ``sketches.py``) use the month's
+average rate of their currency.
+"""
+
+import json
+import os
+import threading
+from array import array
+from collections import defaultdict
+from datetime import date
+from .sketches import QuantileSketch
+
+
+RATES_NAME = 'fx_rates.json'
+DEFAULT_CURRENCY = 'INR'
+# Ordinal past every table, so undated amounts use the latest rate
+LATEST = date.max.toordinal()
+
+
+def _ordinal(day):
+    try:
+        return date.fromisoformat(day).toordinal()
+    except (TypeError, ValueError):
+        return LATEST
+
+
+class FXRates:
+    """Dated exchange rates loaded from a JSON file, reloaded when it changes"""
+
+    def __init__(self, path):
+        self.path = path
+        self.version = 0
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._tables = {}
+        self._factors = {}
+
+    def refresh(self):
+        """Re-read the rates file if it changed; returns the table version"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return self.version
+        with self._lock:
+            if mtime != self._mtime:
+                tables = {}
+                if mtime is not None:
+                    with open(self.path, 'r') as f:
+                        tables = self._build(json.load(f))
+                self._tables = tables
+                self._factors = {}
+                self._mtime = mtime
+                self.version += 1
+        return self.version
+
+    @staticmethod
+    def _build(data):
+        """Expand {date: {currency: rate}} into a dense per-day table per currency"""
+        dated = defaultdict(dict)
+        for day, rates in data.get('rates', {}).items():
+            ordinal = date.fromisoformat(day).toordinal()
+            for currency, rate in rates.items():
+                if rate and rate > 0:
+                    dated[currency][ordinal] = float(rate)
+
+        tables = {}
+        for currency, points in dated.items():
+            first = min(points)
+            table = array('d', bytes(8 * (max(points) - first + 1)))
+            rate = points[first]
+            for i in range(len(table)):
+                rate = points.get(first + i, rate)
+                table[i] = rate
+            tables[currency] = (first, table)
+        if data.get('base'):
+            tables[data['base']] = (0, array('d', [1.0]))
+        return tables
+
+    def rate(self, currency, ordinal):
+        """Units of a currency per unit of the pivot currency on a day, or None"""
+        entry = self._tables.get(currency)
+        if entry is None:
+            return None
+        first, table = entry
+        return table[min(max(ordinal - first, 0), len(table) - 1)]
+
+    def factor(self, source, target, day=None):
+        """
+        Get the multiplier converting source amounts into target on a day
+        (ISO date; None for the latest rate), or None when a rate is missing.
+        Call refresh() first; factors are memoised until the file changes.
+        """
+        if source == target:
+            return 1.0
+        key = (source, target, day)
+        factors = self._factors
+        if key in factors:
+            return factors[key]
+        ordinal = _ordinal(day)
+        source_rate = self.rate(source, ordinal)
+        target_rate = self.rate(target, ordinal)
+        factor = target_rate / source_rate if source_rate and target_rate else None
+        factors[key] = factor
+        return factor
+
+
+def convert_summary(summary, base, target, rates):
+    """Convert one partition summary into the target currency"""
+    parts = summary.get('currencies') or {'': summary}
+    result = dict(summary, total=0, max_amount=0)
+    result.pop('currencies', None)
+    categories = defaultdict(float)
+    days = defaultdict(float)
+    sketches = defaultdict(QuantileSketch)
+    category_days = {'category_days': defaultdict(_new_days), 'recurring': defaultdict(_new_days)}
+    missing = set()
+
+    for currency, part in parts.items():
+        source = currency or base
+        latest = rates.factor(source, target)
+        unconverted = latest is None
+        if unconverted:
+            # No rate for one of the currencies: these amounts are reported as booked
+            missing.add(target if rates.rate(target, LATEST) is None else source)
+            latest = 1.0
+
+        converted = 0
+        dated = 0
+        for day, amount in part['days'].items():
+            value = amount if unconverted else amount * rates.factor(source, target, day)
+            days[day] += value
+            converted += value
+            dated += amount
+        for field, totals in category_days.items():
+            for category, amounts in part.get(field, {}).items():
+                for day, amount in amounts.items():
+                    totals[category][day] += amount if unconverted else amount * rates.factor(source, target, day)
+        # Undated rows use the latest rate
+        converted += (part['total'] - dated) * latest
+
+        ratio = converted / part['total'] if part['total'] else latest
+        for category, amount in part['categories'].items():
+            categories[category] += amount * ratio
+        for category, sketch in part.get('sketches', {}).items():
+            sketches[category].merge(QuantileSketch(sketch).scaled(ratio))
+        result['total'] += converted
+        result['max_amount'] = max(result['max_amount'], part['max_amount'] * ratio)
+
+    result['categories'] = dict(categories)
+    result['days'] = dict(days)
+    result['sketches'] = {category: sketch.to_dict() for category, sketch in sketches.items()}
+    for field, totals in category_days.items():
+        result[field] = {category: dict(amounts) for category, amounts in totals.items()}
+    if missing:
+        result['unconverted'] = sorted(missing)
+    return result
+
+
+def _new_days():
+    return defaultdict(float)
+
+
+def _needs_conversion(summaries, base, target):
+    return base != target or any('currencies' in s for s in summaries.values())
+
+
+class CurrencyConverter:
+    """Manifest summaries of one ledger converted into its reporting currency"""
+
+    def __init__(self, ledger, rates):
+        self.ledger = ledger
+        self.rates = rates
+        # month -> (cache key, converted summary)
+        self._cache = {}
+
+    def currencies(self):
+        """Get the (base, reporting) currencies from the settings document"""
+        settings = self.ledger.load_document('settings') or {}
+        reporting = settings.get('currency') or DEFAULT_CURRENCY
+        return settings.get('base_currency') or reporting, reporting
+
+    def summaries(self, target=None):
+        """
+        Get the manifest summary of every partition in the reporting currency
+        (or target). A ledger booked in one currency is returned as stored.
+        """
+        base, reporting = self.currencies()
+        target = target or reporting
+        summaries = self.ledger.summaries()
+        if not _needs_conversion(summaries, base, target):
+            return summaries
+
+        version = self.rates.refresh()
+        cache = self._cache
+        converted = {}
+        for month, summary in summaries.items():
+            key = (summary.get('rev'), summary.get('max_version'), summary['count'],
+                   summary['total'], base, target, version)
+            entry = cache.get(month)
+            if entry is None or entry[0] != key:
+                entry = cache[month] = (key, convert_summary(summary, base, target, self.rates))
+            converted[month] = entry[1]
+        for month in set(cache) - set(summaries):
+            cache.pop(month, None)
+        return converted
+
+    def unconverted(self, months=None):
+        """
+        List the currencies added as booked, for want of a rate, in the
+        summaries of some months (every month by default)
+        """
+        summaries = self.summaries()
+        if months is not None:
+            summaries = {month: summaries[month] for month in months if month in summaries}
+        return sorted({c for summary in summaries.values() for c in summary.get('unconverted', ())})
+
+    def row_factors(self, target=None):
+        """
+        Get a function of (row currency, date) giving the multiplier of a row's
+        amount into the reporting currency, or None when nothing needs converting.
+        Currencies without a rate get 1.0, as in the summaries; see unconverted().
+        """
+        base, reporting = self.currencies()
+        target = target or reporting
+        if not _needs_conversion(self.ledger.summaries(), base, target):
+            return None
+        self.rates.refresh()
+        rates = self.rates
+
+        def factor(currency, day):
+            return rates.factor(currency or base, target, day) or 1.0
+        return factor
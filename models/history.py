@@ -0,0 +1,227 @@
+"""
+Budget periods and month-close snapshots
+
+Budgets are monthly. The ``budgets`` document is the default of every month;
+``budget_periods`` holds per-month overrides. With ``carry_over`` set, the
+unspent part of each category budget is added to the same category in the
+next month.
+
+Once a month has ended it is closed: its totals per category, budget vs actual
+and largest expenses are frozen into the ``month_close`` document and never
+recomputed, so budget history over many years is served without opening a
+single past partition. Months are closed in order (carry-over depends on the
+previous month) the first time anything needs them. A closed snapshot whose
+month was edited afterwards is reported as ``amended``.
+
+Snapshots are in the reporting currency they were closed in, which they
+record; when ``settings.currency`` changes they are closed again in the new
+one, since budgets are always compared with spending in the reporting currency.
+"""
+
+import heapq
+from datetime import datetime
+from .budgets import MONTHLY_LIMIT, budget_level
+from .partitions import partition_fingerprint
+from .wallets import is_spending
+
+
+CLOSED_DOCUMENT = 'month_close'
+PERIODS_DOCUMENT = 'budget_periods'
+TOP_EXPENSES = 5
+TOP_FIELDS = ('id', 'date', 'category', 'description', 'amount', 'currency')
+
+
+def previous_month(month):
+    year, month = int(month[:4]), int(month[5:7])
+    return f"{year - 1}-12" if month == 1 else f"{year}-{month - 1:02d}"
+
+
+def next_month(month):
+    year, month = int(month[:4]), int(month[5:7])
+    return f"{year + 1}-01" if month == 12 else f"{year}-{month + 1:02d}"
+
+
+def month_range(first, last):
+    """List the months from first to last inclusive"""
+    months = []
+    month = first
+    while month <= last:
+        months.append(month)
+        month = next_month(month)
+    return months
+
+
+def is_month(value):
+    """Check that a value is a YYYY-MM month"""
+    return (isinstance(value, str) and len(value) == 7 and value[4] == '-' and
+            value[:4].isdigit() and value[5:].isdigit() and 1 <= int(value[5:]) <= 12)
+
+
+def monthly_budget(budgets):
+    """Budget of a whole month: the monthly limit when set, else the sum of categories"""
+    return budgets.get(MONTHLY_LIMIT) or budgets.get('total', 0)
+
+
+def comparison(spent, budget):
+    return {
+        'budget': budget,
+        'spent': spent,
+        'remaining': max(0, budget - spent),
+        'status': budget_level(spent, budget)
+    }
+
+
+class BudgetHistory:
+    """Budget periods and closed months of one ledger"""
+
+    def __init__(self, ledger, fx=None):
+        self.ledger = ledger
+        # Converter into the reporting currency (see fx.py); None reports amounts as booked
+        self.fx = fx
+        self.summaries = fx.summaries if fx else ledger.summaries
+
+    def _closed(self):
+        return self.ledger.load_document(CLOSED_DOCUMENT) or {}
+
+    def budgets(self, base, period, categories, closed=None):
+        """Get the effective budgets of a month: default, period override and carry-over"""
+        overrides = self.ledger.load_document(PERIODS_DOCUMENT) or {}
+        budgets = dict(base)
+        budgets.update(overrides.get(period, {}))
+
+        carry_in = {}
+        if budgets.get('carry_over'):
+            if closed is None:
+                self.close_months(base, categories)
+                closed = self._closed()
+            previous = closed.get(previous_month(period))
+            if previous:
+                for category in categories:
+                    remaining = previous['categories'].get(category, {}).get('remaining', 0)
+                    if remaining:
+                        carry_in[category] = remaining
+                        budgets[category] = budgets.get(category, 0) + remaining
+
+        budgets['total'] = sum(budgets.get(category, 0) for category in categories)
+        budgets['carry_in'] = carry_in
+        return budgets
+
+    def period(self, period):
+        """Get the budget override of one month"""
+        overrides = self.ledger.load_document(PERIODS_DOCUMENT) or {}
+        return overrides.get(period, {})
+
+    def is_closed(self, period):
+        return period in self._closed()
+
+    def save_period(self, period, budgets):
+        """Store the budget override of one month; closed months cannot change"""
+        with self.ledger._lock:
+            if self.is_closed(period):
+                raise ValueError(f"Budget period {period} is closed")
+            overrides = self.ledger.load_document(PERIODS_DOCUMENT) or {}
+            overrides[period] = budgets
+            self.ledger.save_document(PERIODS_DOCUMENT, overrides)
+
+    def _month(self, month, summary, budgets, categories):
+        """Budget vs actual of one month from its manifest summary"""
+        spent = summary.get('categories', {})
+        return {
+            'month': month,
+            'count': summary.get('count', 0),
+            'total': summary.get('total', 0),
+            'carry_in': budgets['carry_in'],
+            'categories': {
+                category: comparison(spent.get(category, 0), budgets.get(category, 0))
+                for category in sorted(set(categories) | set(spent), key=str)
+            },
+            'budget': comparison(summary.get('total', 0), monthly_budget(budgets))
+        }
+
+    def _currency(self):
+        """Get the reporting currency snapshots are closed in, or None without a converter"""
+        return self.fx.currencies()[1] if self.fx else None
+
+    def _close_month(self, month, budgets, categories, now):
+        """Freeze the totals, budget vs actual and largest expenses of a finished month"""
+        summary = self.summaries().get(month, {})
+        # Largest in the reporting currency, with the per-row rates the summaries use
+        factor = self.fx.row_factors() if self.fx else None
+
+        def amount(record):
+            value = record.get('amount') or 0
+            return value * factor(record.get('currency'), record.get('date')) if factor else value
+
+        spending = (r for r in self.ledger.iter_range(f"{month}-01", f"{month}-31") if is_spending(r))
+        top = heapq.nlargest(TOP_EXPENSES, spending, key=amount) if summary else []
+        return dict(
+            self._month(month, summary, budgets, categories),
+            top_expenses=[{k: record.get(k) for k in TOP_FIELDS} for record in top],
+            currency=self._currency(),
+            max_version=summary.get('max_version', 0),
+            fingerprint=partition_fingerprint(summary),
+            closed_at=now.isoformat()
+        )
+
+    @staticmethod
+    def _amended(snapshot, summary):
+        """Check whether a closed month's partition was written (or emptied) since it was closed"""
+        if 'fingerprint' in snapshot:
+            return partition_fingerprint(summary) != snapshot['fingerprint']
+        # Closed before snapshots kept a fingerprint
+        return summary.get('max_version', 0) != snapshot['max_version']
+
+    def close_months(self, base, categories, now=None):
+        """
+        Close every finished month that is not closed yet, or was closed in
+        another reporting currency; returns the months closed
+        """
+        now = now or datetime.now()
+        current = now.strftime('%Y-%m')
+        currency = self._currency()
+        with self.ledger._lock:
+            months = [m for m in self.ledger.months() if is_month(m)]
+            closed = self._closed()
+            pending = {m for m, snapshot in closed.items() if snapshot.get('currency') != currency}
+            if months and months[0] < current:
+                pending.update(m for m in month_range(months[0], previous_month(current)) if m not in closed)
+            # In order: carry-over reads the previous month's snapshot
+            pending = sorted(pending)
+            for month in pending:
+                budgets = self.budgets(base, month, categories, closed)
+                closed[month] = self._close_month(month, budgets, categories, now)
+            if pending:
+                self.ledger.save_document(CLOSED_DOCUMENT, closed)
+            return pending
+
+    def history(self, base, categories, start=None, end=None, now=None):
+        """
+        Budget vs actual per month between two months (inclusive)
+        Past months come from their close snapshots; the current month is
+        built live from the manifest summary.
+        """
+        now = now or datetime.now()
+        current = now.strftime('%Y-%m')
+        self.close_months(base, categories, now)
+        closed = self._closed()
+        summaries = self.summaries()
+
+        first = min(closed, default=current)
+        start = max(start or first, first)
+        end = min(end or current, current)
+
+        months = []
+        for month in month_range(start, end) if start <= end else []:
+            snapshot = closed.get(month)
+            if snapshot is not None:
+                months.append(dict(
+                    snapshot, closed=True, amended=self._amended(snapshot, summaries.get(month, {}))
+                ))
+                continue
+            # The current month is still open
+            budgets = self.budgets(base, month, categories, closed)
+            months.append(dict(
+                self._month(month, summaries.get(month, {}), budgets, categories),
+                closed=False, amended=False
+            ))
+        return months
@@ -0,0 +1,998 @@
+"""
+Month-partitioned expense storage
+
+Expenses are stored as one JSON file per month (``data/expenses/2026-10.json``)
+next to a manifest holding a summary of every partition. Range queries only
+open the partitions they overlap and all-time totals come from the manifest,
+so typical dashboard requests do not depend on the length of the history.
+Cached partitions are compact ``RecordBlock`` columns; callers get dicts.
+Every partition also has a memory-mapped binary snapshot (see ``snapshot.py``)
+so reopening it does not parse JSON.
+
+Every mutation takes the next number of a per-ledger change sequence: rows
+carry the ``version`` of their last write and deletions leave tombstones, so
+clients can fetch only what changed since the version they last saw.
+
+Every write also appends field-level deltas to a revision log, persisted in
+the same batch, from which past states are rebuilt (see ``revisions.py``).
+
+Writes made inside ``batch()`` are staged in memory and every partition they
+touched is persisted and summarised once when the batch ends, with one
+manifest write; ``sync()`` then makes them durable (see ``commits.py``).
+
+The partitioning, caching, summaries and change sequence live in
+``PartitionedLedger`` and are shared by every storage backend; a backend only
+persists manifests, partitions, tombstones, revisions and documents (see
+``storage.py``).
+``PartitionedStore`` is the JSON file backend.
+"""
+
+import json
+import os
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from .records import ExpenseRecord, RecordBlock, normalize_expense
+from .revisions import field_changes
+from .sketches import QuantileSketch
+from .snapshot import open_snapshot, write_snapshot
+from .wallets import is_spending, wallet_deltas
+from utils.metrics import span
+
+
+MANIFEST_NAME = '_manifest.json'
+TOMBSTONES_NAME = '_tombstones.json'
+REVISIONS_NAME = '_revisions.jsonl'
+SNAPSHOT_SUFFIX = '.snap'
+# Bump when summarize() gains fields so older manifests are rebuilt
+MANIFEST_VERSION = 10
+# Days a deletion stays visible to delta sync before it is compacted away
+TOMBSTONE_RETENTION_DAYS = 30
+UNDATED = 'undated'
+
+
+def month_key(date_str):
+    """Get the partition key (YYYY-MM) for a date string"""
+    if isinstance(date_str, str) and len(date_str) >= 7 and date_str[4] == '-':
+        return date_str[:7]
+    return UNDATED
+
+
+def partition_fingerprint(summary):
+    """Changes whenever a partition is rewritten, even after revisions restart"""
+    return [summary.get('rev'), summary.get('count'), summary.get('max_version')]
+
+
+def _new_part():
+    return {'count': 0, 'total': 0, 'max_amount': 0,
+            'categories': defaultdict(float), 'days': defaultdict(float),
+            'sketches': defaultdict(QuantileSketch),
+            'category_days': defaultdict(_new_days), 'recurring': defaultdict(_new_days),
+            'wallets': defaultdict(_new_days)}
+
+
+def _new_days():
+    return defaultdict(float)
+
+
+def summarize(expenses):
+    """
+    Build the manifest summary for a list of expenses or records
+    Totals, counts, days, categories and sketches only count spending (see
+    ``wallets.is_spending``); income and transfers only change ``wallets``.
+    Partitions holding rows with a ``currency`` also get the same totals per
+    currency under ``currencies`` ('' for rows without one), which is what
+    conversion into the reporting currency works from (see ``fx.py``).
+    ``wallets`` holds the net change of every wallet per day ('' for undated
+    rows), kept per currency as well, which wallet balances are indexed from
+    (see ``wallets.py``) and
+    ``sketches`` the amount distribution of every category (see ``sketches.py``).
+    ``category_days`` and ``recurring`` hold the daily totals of every category,
+    of all rows and of recurring ones, which forecasts fit on (see ``forecast.py``).
+    """
+    parts = defaultdict(_new_part)
+    wallets = defaultdict(lambda: defaultdict(float))
+    max_version = 0
+    for expense in expenses:
+        amount = expense.get('amount', 0)
+        part = parts[expense.get('currency') or '']
+        for wallet, delta in wallet_deltas(expense):
+            wallets[wallet][expense.get('date') or ''] += delta
+            part['wallets'][wallet][expense.get('date') or ''] += delta
+        max_version = max(max_version, expense.get('version') or 0)
+        if not is_spending(expense):
+            continue
+        part['total'] += amount
+        part['count'] += 1
+        part['max_amount'] = max(part['max_amount'], amount)
+        part['categories'][expense.get('category')] += amount
+        part['sketches'][expense.get('category')].add(amount)
+        if expense.get('date'):
+            part['days'][expense['date']] += amount
+            part['category_days'][expense.get('category')][expense['date']] += amount
+            if expense.get('recurring'):
+                part['recurring'][expense.get('category')][expense['date']] += amount
+
+    if len(parts) == 1:
+        summary = next(iter(parts.values()))
+    else:
+        summary = _new_part()
+        for part in parts.values():
+            summary['count'] += part['count']
+            summary['total'] += part['total']
+            summary['max_amount'] = max(summary['max_amount'], part['max_amount'])
+            for category, amount in part['categories'].items():
+                summary['categories'][category] += amount
+            for day, amount in part['days'].items():
+                summary['days'][day] += amount
+            for category, sketch in part['sketches'].items():
+                summary['sketches'][category].merge(sketch)
+            for field in ('category_days', 'recurring'):
+                for category, days in part[field].items():
+                    for day, amount in days.items():
+                        summary[field][category][day] += amount
+    days = summary['days']
+    result = {
+        'count': summary['count'],
+        'total': summary['total'],
+        'max_amount': summary['max_amount'],
+        'categories': dict(summary['categories']),
+        'days': dict(days),
+        'first': min(days, default=None),
+        'last': max(days, default=None),
+        'max_version': max_version,
+        'wallets': {wallet: dict(days) for wallet, days in wallets.items()},
+        'sketches': _sketch_dicts(summary['sketches']),
+        'category_days': _day_dicts(summary['category_days']),
+        'recurring': _day_dicts(summary['recurring'])
+    }
+    if any(parts):
+        result['currencies'] = {
+            currency: dict(part, categories=dict(part['categories']), days=dict(part['days']),
+                           sketches=_sketch_dicts(part['sketches']),
+                           category_days=_day_dicts(part['category_days']),
+                           recurring=_day_dicts(part['recurring']),
+                           wallets=_day_dicts(part['wallets']))
+            for currency, part in parts.items()
+        }
+    return result
+
+
+def _sketch_dicts(sketches):
+    return {category: sketch.to_dict() for category, sketch in sketches.items()}
+
+
+def _day_dicts(categories):
+    return {category: dict(days) for category, days in categories.items()}
+
+
+def _unversioned(expense):
+    return {k: v for k, v in expense.items() if k != 'version'}
+
+
+def _date_bound(value):
+    """Convert a date filter to a day ordinal, or None when it is not an ISO date"""
+    try:
+        return date.fromisoformat(value).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+def _write_json(path, data, indent=2):
+    """Write JSON atomically so readers never see a torn file"""
+    tmp_path = f"{path}.tmp"
+    with span('file.write'):
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=indent)
+        os.replace(tmp_path, path)
+
+
+def fsync_path(path, directory=False):
+    """Flush a file (or a directory's entries) to disk"""
+    try:
+        fd = os.open(path, os.O_RDONLY if directory else os.O_RDWR)
+    except FileNotFoundError:
+        return
+    except OSError:
+        if directory:
+            # Not every platform can open a directory to sync it
+            return
+        raise
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class PartitionedLedger:
+    """
+    Month-partitioned ledger on top of a storage backend
+    Subclasses implement the persistence hooks below; queries, mutations,
+    partition caching and delta sync are shared.
+    """
+
+    # Whether the ledger survives the process (memory ledgers must not be evicted)
+    persistent = True
+    # Whether aggregate queries can be pushed down to the backend as SQL
+    supports_sql = False
+
+    def __init__(self, tombstone_retention_days=TOMBSTONE_RETENTION_DAYS):
+        self.tombstone_retention = timedelta(days=tombstone_retention_days)
+        self._lock = threading.RLock()
+        self._manifest = None
+        # Called with (month, old summary, new summary) after every partition write
+        self.listeners = []
+        self._cache = {}
+        self._tombstones = None
+        # {month: summary before the batch} while writes are batched
+        self._pending = None
+        # Revision log (loaded on first use) and the entries the next flush persists
+        self._revisions = None
+        self._revisions_seq = None
+        self._unsaved_revisions = []
+
+    # ===== BACKEND HOOKS =====
+
+    def _open(self):
+        """Get the manifest, reloading it when another process changed it"""
+        raise NotImplementedError
+
+    def _read_partition(self, month, rev):
+        """Read the record block of a partition revision"""
+        raise NotImplementedError
+
+    def _store_partition(self, month, block, rev):
+        """Persist a non-empty partition as a new revision"""
+        raise NotImplementedError
+
+    def _drop_partition(self, month):
+        """Remove a partition that no longer has rows"""
+        raise NotImplementedError
+
+    def _save_manifest(self, manifest):
+        """Persist the manifest; called last in every write"""
+        raise NotImplementedError
+
+    def _load_tombstones(self):
+        """Get the list of tombstones"""
+        raise NotImplementedError
+
+    def _save_tombstones(self, tombstones):
+        """Persist the list of tombstones"""
+        raise NotImplementedError
+
+    def _load_revisions(self):
+        """Get the revision log, oldest entry first"""
+        raise NotImplementedError
+
+    def _append_revisions(self, entries):
+        """Append entries to the revision log; called before the manifest write of their batch"""
+        raise NotImplementedError
+
+    def load_document(self, name):
+        """Get a small JSON document stored with the ledger (settings, budgets), or None"""
+        raise NotImplementedError
+
+    def save_document(self, name, data):
+        """Store a small JSON document with the ledger"""
+        raise NotImplementedError
+
+    def delete_document(self, name):
+        """Remove a document stored with the ledger; a missing one is ignored"""
+        raise NotImplementedError
+
+    def document_names(self):
+        """List the names of the documents stored with the ledger"""
+        raise NotImplementedError
+
+    def compact(self):
+        """Rewrite the backend into its most compact form; returns what was rewritten"""
+        return []
+
+    def sync(self):
+        """Flush every write persisted so far to disk"""
+
+    def _discard(self):
+        """Forget the cached state after a failed write, so it is reloaded from what was persisted"""
+        self._manifest = None
+        self._cache.clear()
+        self._tombstones = None
+        self._revisions = None
+
+    def _savepoint(self):
+        """Get the position of what the backend persisted outside batches (see ``savepoint``)"""
+        return None
+
+    def _rollback(self, position):
+        """Drop what the backend persisted outside batches since _savepoint returned position"""
+
+    # ===== MANIFEST =====
+
+    def _new_manifest(self, groups, previous=None):
+        """Build a manifest summarising {month: rows}; every partition starts at revision 1"""
+        previous = previous or {}
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'seq': previous.get('seq', 0),
+            'tombstone_floor': previous.get('tombstone_floor', 0),
+            'partitions': {}
+        }
+        for month, expenses in groups.items():
+            summary = summarize(expenses)
+            manifest['partitions'][month] = dict(summary, rev=1)
+            manifest['seq'] = max(manifest['seq'], summary['max_version'])
+        return manifest
+
+    def _drop_stale(self, manifest):
+        """Drop cached partitions another process has rewritten since"""
+        partitions = manifest['partitions']
+        for month in list(self._cache):
+            summary = partitions.get(month)
+            if summary is None or summary.get('rev') != self._cache[month][0]:
+                del self._cache[month]
+
+    # ===== PARTITIONS =====
+
+    def _partition(self, month):
+        """
+        Get the cached record block of a partition
+        Cached partitions are reused until their manifest revision changes.
+        """
+        manifest = self._open()
+        summary = manifest['partitions'].get(month)
+        if summary is None:
+            return RecordBlock()
+
+        cached = self._cache.get(month)
+        if cached is not None:
+            return cached[1]
+
+        rev = summary.get('rev')
+        block = self._read_partition(month, rev)
+        self._cache[month] = (rev, block)
+        return block
+
+    def _write_partition(self, month, records):
+        """Stage a new revision of a partition; it is persisted when the batch ends"""
+        with self.batch():
+            partitions = self._open()['partitions']
+            before = partitions.get(month)
+            self._pending.setdefault(month, before)
+            rev = (before or {}).get('rev', 0) + 1
+
+            if records:
+                block = records if isinstance(records, RecordBlock) else RecordBlock(records)
+                # Summarised once the batch ends; until then lock-free readers see the old summary
+                partitions[month] = dict(before or {}, rev=rev)
+                self._cache[month] = (rev, block)
+            else:
+                partitions.pop(month, None)
+                self._cache.pop(month, None)
+
+    @contextmanager
+    def batch(self):
+        """
+        Hold the ledger lock and batch the writes made inside: every partition
+        they touch is persisted and summarised once, with one manifest write
+        """
+        with self._lock:
+            if self._pending is not None:
+                yield
+                return
+            self._pending = {}
+            seq = self._open().get('seq', 0)
+            try:
+                yield
+            finally:
+                pending, self._pending = self._pending, None
+                if pending:
+                    self._flush(pending, seq)
+
+    @contextmanager
+    def savepoint(self):
+        """
+        Batch the writes made inside with the current batch, but undo what they
+        staged (and the tombstones they wrote) when they raise, so the rest of
+        the batch is persisted without them
+        """
+        with self.batch():
+            manifest = self._open()
+            state = (dict(manifest, partitions=dict(manifest['partitions'])), dict(self._cache),
+                     dict(self._pending), len(self._unsaved_revisions), self._load_tombstones(),
+                     self._savepoint())
+            try:
+                yield
+            except BaseException:
+                self._undo(*state)
+                raise
+
+    def _undo(self, manifest, cache, pending, revisions, tombstones, position):
+        """Restore the staged state a savepoint captured"""
+        self._manifest.clear()
+        self._manifest.update(manifest)
+        self._cache.clear()
+        self._cache.update(cache)
+        self._pending.clear()
+        self._pending.update(pending)
+        del self._unsaved_revisions[revisions:]
+        if self._load_tombstones() != tombstones:
+            self._save_tombstones(tombstones)
+        self._rollback(position)
+
+    def _flush(self, pending, seq):
+        """
+        Persist and summarise the partitions a batch touched and its revisions,
+        then notify the listeners; seq is the change sequence the batch started at
+        """
+        manifest = self._open()
+        partitions = manifest['partitions']
+        revisions, self._unsaved_revisions = self._unsaved_revisions, []
+        try:
+            for month in pending:
+                if month in partitions:
+                    rev, block = self._cache[month]
+                    self._store_partition(month, block, rev)
+                    partitions[month] = dict(summarize(block), rev=rev)
+                else:
+                    self._drop_partition(month)
+            if revisions:
+                self._append_revisions(revisions)
+            self._save_manifest(manifest)
+        except BaseException:
+            self._discard()
+            raise
+        if revisions and self._revisions is not None and self._revisions_seq == seq:
+            # The cached log was up to date when the batch started
+            self._revisions.extend(revisions)
+            self._revisions_seq = manifest.get('seq', 0)
+
+        for month, before in pending.items():
+            if before is not None or month in partitions:
+                for listener in self.listeners:
+                    listener(month, before, partitions.get(month))
+
+    def _next_version(self):
+        """Take the next change sequence number; persisted with the next manifest write"""
+        manifest = self._open()
+        manifest['seq'] = manifest.get('seq', 0) + 1
+        return manifest['seq']
+
+    # ===== TOMBSTONES =====
+
+    def _add_tombstone(self, expense_id, version):
+        """Record a deletion and compact tombstones past the retention window"""
+        now = datetime.now()
+        cutoff = (now - self.tombstone_retention).isoformat()
+        tombstones = []
+        floor = self._open().get('tombstone_floor', 0)
+        for tombstone in self._load_tombstones():
+            if tombstone['deleted_at'] >= cutoff:
+                tombstones.append(tombstone)
+            else:
+                # Clients older than a compacted tombstone need a full resync
+                floor = max(floor, tombstone['version'])
+        tombstones.append({'id': expense_id, 'version': version, 'deleted_at': now.isoformat()})
+        self._manifest['tombstone_floor'] = floor
+        self._save_tombstones(tombstones)
+
+    # ===== REVISIONS =====
+
+    def _record(self, op, version, **entry):
+        """Log a revision; it is persisted with the batch that wrote it"""
+        entry.update(op=op, version=version, at=datetime.now().isoformat())
+        self._unsaved_revisions.append(entry)
+
+    def revisions(self):
+        """Get the revision log, oldest entry first (see ``revisions.py``); do not modify it"""
+        with self._lock:
+            seq = self._open().get('seq', 0)
+            if self._revisions is None or self._revisions_seq != seq:
+                # Entries past the manifest were left by a write that failed
+                self._revisions = [e for e in self._load_revisions() if e['version'] <= seq]
+                self._revisions_seq = seq
+            return self._revisions
+
+    def months(self, start_date=None, end_date=None):
+        """List partition keys overlapping an inclusive date range"""
+        with self._lock:
+            partitions = self._open()['partitions']
+        start = start_date[:7] if start_date else None
+        end = end_date[:7] if end_date else None
+
+        months = []
+        for month in sorted(partitions):
+            if month == UNDATED:
+                # Undated rows never match a date bound
+                if start is None and end is None:
+                    months.append(month)
+                continue
+            if start and month < start:
+                continue
+            if end and month > end:
+                continue
+            months.append(month)
+        return months
+
+    def summaries(self):
+        """Get the manifest summary of every partition"""
+        with self._lock:
+            return dict(self._open()['partitions'])
+
+    # ===== QUERIES =====
+
+    def iter_range(self, start_date=None, end_date=None):
+        """Iterate stored records within an inclusive date range"""
+        start = _date_bound(start_date) if start_date else None
+        end = _date_bound(end_date) if end_date else None
+
+        for month in self.months(start_date, end_date):
+            with self._lock:
+                records = self._partition(month)
+            if month != UNDATED and (
+                    (not start_date or month > start_date[:7]) and
+                    (not end_date or month < end_date[:7])):
+                # Partition lies fully inside the range
+                yield from records
+                continue
+
+            if (start_date and start is None) or (end_date and end is None):
+                # Non-ISO bounds fall back to comparing date strings
+                for record in records:
+                    value = record.date
+                    if start_date and (not value or value < start_date):
+                        continue
+                    if end_date and (not value or value > end_date):
+                        continue
+                    yield record
+                continue
+
+            for record in records:
+                ordinal = record.ordinal
+                if ordinal is None and (start or end):
+                    continue
+                if start and ordinal < start:
+                    continue
+                if end and ordinal > end:
+                    continue
+                yield record
+
+    def load_range(self, start_date=None, end_date=None):
+        """Load expense dicts within an inclusive date range"""
+        return [r.to_dict() for r in self.iter_range(start_date, end_date)]
+
+    def load_all(self):
+        """Load copies of every expense"""
+        return self.load_range()
+
+    def totals(self, summaries=None):
+        """
+        Get all-time count, total and highest amount from the partition summaries
+        Pass converted summaries (see ``fx.py``) to total in another currency.
+        """
+        summaries = self.summaries() if summaries is None else summaries
+        return {
+            'count': sum(s['count'] for s in summaries.values()),
+            'total': sum(s['total'] for s in summaries.values()),
+            'highest': max((s['max_amount'] for s in summaries.values()), default=0)
+        }
+
+    def dashboard_totals(self, today, week_start, summaries=None):
+        """Get all-time, month, week and day totals from the partition summaries"""
+        summaries = self.summaries() if summaries is None else summaries
+        month = summaries.get(today[:7], {})
+        week = 0
+        for key in {week_start[:7], today[:7]}:
+            for day, amount in summaries.get(key, {}).get('days', {}).items():
+                if week_start <= day <= today:
+                    week += amount
+        return {
+            'all_time': sum(s['total'] for s in summaries.values()),
+            'this_month': month.get('total', 0),
+            'this_week': week,
+            'today': month.get('days', {}).get(today, 0),
+            'count': sum(s['count'] for s in summaries.values()),
+            'month_count': month.get('count', 0),
+            'highest': month.get('max_amount', 0),
+            'categories': month.get('categories', {}),
+            'sketches': month.get('sketches', {})
+        }
+
+    def changes(self, since):
+        """
+        Get rows written and IDs deleted after a change sequence number
+        Only partitions whose newest row is after ``since`` are opened. A
+        client older than the compacted tombstones (or ahead of this ledger)
+        gets the full ledger with ``reset`` set and must replace its local copy.
+        """
+        with self._lock:
+            manifest = self._open()
+            seq = manifest.get('seq', 0)
+            if since <= 0 or since > seq or since < manifest.get('tombstone_floor', 0):
+                return {'version': seq, 'reset': True, 'upserts': self.load_all(), 'deleted': []}
+
+            upserts = []
+            for month in self.months():
+                if manifest['partitions'][month].get('max_version', 0) <= since:
+                    continue
+                for record in self._partition(month):
+                    if record.get('version', 0) > since:
+                        upserts.append(record.to_dict())
+            deleted = [t['id'] for t in self._load_tombstones() if t['version'] > since]
+            return {'version': seq, 'reset': False, 'upserts': upserts, 'deleted': deleted}
+
+    def _locate(self, expense_id):
+        """Find the partition and position of an expense, newest months first"""
+        for month in reversed(self.months()):
+            i = self._partition(month).find(expense_id)
+            if i is not None:
+                return month, i
+        return None, None
+
+    def get(self, expense_id):
+        """Get an expense dict by ID"""
+        with self._lock:
+            month, i = self._locate(expense_id)
+            if month is None:
+                return None
+            return self._partition(month)[i].to_dict()
+
+    # ===== MUTATIONS =====
+
+    def add(self, expense):
+        """Append an expense to its month partition"""
+        with self._lock:
+            month = month_key(expense.get('date'))
+            expense['version'] = self._next_version()
+            self._record('add', expense['version'], ids=[expense.get('id')])
+            self._write_partition(month, self._partition(month).extended([ExpenseRecord.from_dict(expense)]))
+
+    def add_many(self, expenses):
+        """Append expenses to their month partitions, writing each partition once"""
+        groups = defaultdict(list)
+        with self.batch():
+            for expense in expenses:
+                expense['version'] = self._next_version()
+                groups[month_key(expense.get('date'))].append(ExpenseRecord.from_dict(expense))
+            if expenses:
+                self._record('add', expenses[-1]['version'], ids=[e.get('id') for e in expenses])
+            for month, records in groups.items():
+                self._write_partition(month, self._partition(month).extended(records))
+
+    def update(self, expense_id, updated_data):
+        """Update fields of an expense, moving it if its month changes"""
+        with self.batch():
+            month, i = self._locate(expense_id)
+            if month is None:
+                return None
+
+            records = list(self._partition(month))
+            changes = {k: v for k, v in updated_data.items() if k != 'id'}  # Don't update ID
+            changes['version'] = self._next_version()
+            before = records[i].to_dict()
+            record = records[i].replace(changes)
+            self._record('update', changes['version'], id=record.id, previous=before.get('version'),
+                         changes=field_changes(before, record.to_dict()))
+
+            new_month = month_key(record.get('date'))
+            if new_month == month:
+                records[i] = record
+                self._write_partition(month, records)
+            else:
+                del records[i]
+                self._write_partition(month, records)
+                self._write_partition(new_month, self._partition(new_month).extended([record]))
+            return record.to_dict()
+
+    def delete(self, expense_id):
+        """Delete an expense by ID"""
+        with self._lock:
+            month, i = self._locate(expense_id)
+            if month is None:
+                return False
+            records = list(self._partition(month))
+            version = self._next_version()
+            self._add_tombstone(records[i].id, version)
+            self._record('delete', version, id=records[i].id, row=records[i].to_dict())
+            del records[i]
+            self._write_partition(month, records)
+            return True
+
+    def replace_all(self, expenses):
+        """Replace the whole ledger, rewriting only partitions that changed"""
+        expenses = [normalize_expense(e, i) for i, e in enumerate(expenses)]
+        groups = defaultdict(list)
+        for expense in expenses:
+            groups[month_key(expense.get('date'))].append(expense)
+
+        ids = {expense.get('id') for expense in expenses}
+        # Rows of the rewritten partitions before and after, by ID
+        before = {}
+        after = {}
+        with self.batch():
+            for month in set(self.months()) | set(groups):
+                current = [r.to_dict() for r in self._partition(month)]
+                # Stored rows carry their version; incoming ones may not
+                if [_unversioned(e) for e in groups.get(month, [])] == [_unversioned(e) for e in current]:
+                    continue
+
+                # Every row of a rewritten partition counts as changed
+                version = self._next_version()
+                for expense in current:
+                    before[expense.get('id')] = expense
+                    if expense.get('id') not in ids:
+                        self._add_tombstone(expense.get('id'), version)
+                        self._record('delete', version, id=expense.get('id'), row=expense)
+                rows = [dict(e, version=version) for e in groups.get(month, [])]
+                after.update((row.get('id'), row) for row in rows)
+                self._write_partition(month, [ExpenseRecord.from_dict(row) for row in rows])
+
+            # Only the rows that really changed get revisions
+            added = [expense_id for expense_id in after if expense_id not in before]
+            if added:
+                self._record('add', max(after[expense_id]['version'] for expense_id in added), ids=added)
+            for expense_id, row in after.items():
+                if expense_id in before:
+                    changes = field_changes(before[expense_id], row)
+                    if changes:
+                        self._record('update', row['version'], id=expense_id,
+                                     previous=before[expense_id].get('version'), changes=changes)
+
+
+class PartitionedStore(PartitionedLedger):
+    """
+    Expense storage split into one JSON file per month
+    Settings and budgets are stored as JSON documents in ``documents_dir``
+    (the parent of the partition directory by default).
+    """
+
+    def __init__(self, directory, legacy_file=None, documents_dir=None,
+                 tombstone_retention_days=TOMBSTONE_RETENTION_DAYS):
+        super().__init__(tombstone_retention_days)
+        self.directory = directory
+        self.legacy_file = legacy_file
+        self.documents_dir = documents_dir or os.path.dirname(os.path.abspath(directory))
+        self._manifest_mtime = None
+        self._tombstones_mtime = None
+        # Files written since the last sync()
+        self._unsynced = set()
+
+    # ===== MANIFEST =====
+
+    def _manifest_path(self):
+        return os.path.join(self.directory, MANIFEST_NAME)
+
+    def _partition_path(self, month):
+        return os.path.join(self.directory, f"{month}.json")
+
+    def _snapshot_path(self, month):
+        return os.path.join(self.directory, f"{month}{SNAPSHOT_SUFFIX}")
+
+    def _open(self):
+        """Load the manifest, migrating or rebuilding it when needed"""
+        path = self._manifest_path()
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+
+        if mtime is not None and mtime == self._manifest_mtime:
+            return self._manifest
+
+        if mtime is None:
+            os.makedirs(self.directory, exist_ok=True)
+            manifest = self._rebuild_manifest()
+        else:
+            with open(path, 'r') as f:
+                manifest = json.load(f)
+            if manifest.get('version') != MANIFEST_VERSION:
+                manifest = self._rebuild_manifest(manifest)
+
+        self._drop_stale(manifest)
+        self._manifest = manifest
+        self._manifest_mtime = os.stat(path).st_mtime_ns
+        return manifest
+
+    def _rebuild_manifest(self, previous=None):
+        """Create the manifest from partition files or the legacy ledger"""
+        groups = defaultdict(list)
+        for name in os.listdir(self.directory):
+            if name.endswith('.json') and not name.startswith('_'):
+                month = name[:-5]
+                with open(os.path.join(self.directory, name), 'r') as f:
+                    groups[month] = [normalize_expense(e, f"{month}:{i}") for i, e in enumerate(json.load(f))]
+
+        if not groups and self.legacy_file and os.path.exists(self.legacy_file):
+            with open(self.legacy_file, 'r') as f:
+                for i, expense in enumerate(json.load(f)):
+                    expense = normalize_expense(expense, i)
+                    groups[month_key(expense.get('date'))].append(expense)
+            for month, expenses in groups.items():
+                _write_json(self._partition_path(month), expenses)
+            os.replace(self.legacy_file, f"{self.legacy_file}.bak")
+
+        # Revisions restart, so snapshots can no longer be matched to them
+        for name in os.listdir(self.directory):
+            if name.endswith(SNAPSHOT_SUFFIX):
+                os.remove(os.path.join(self.directory, name))
+
+        manifest = self._new_manifest(groups, previous)
+        _write_json(self._manifest_path(), manifest)
+        return manifest
+
+    def _save_manifest(self, manifest):
+        _write_json(self._manifest_path(), manifest)
+        self._manifest_mtime = os.stat(self._manifest_path()).st_mtime_ns
+        self._unsynced.add(self._manifest_path())
+
+    def _discard(self):
+        super()._discard()
+        self._manifest_mtime = None
+        self._tombstones_mtime = None
+
+    def sync(self):
+        with self._lock:
+            paths, self._unsynced = self._unsynced, set()
+        try:
+            with span('file.sync'):
+                for path in paths:
+                    fsync_path(path)
+                # The renames that replaced them
+                for directory in {os.path.dirname(path) for path in paths}:
+                    fsync_path(directory, directory=True)
+        except BaseException:
+            with self._lock:
+                self._unsynced |= paths
+            raise
+
+    # ===== PARTITIONS =====
+
+    def _read_partition(self, month, rev):
+        """
+        Map a partition from its binary snapshot when it matches the revision,
+        otherwise parse the JSON file and snapshot it
+        """
+        with span('file.read'):
+            block = open_snapshot(self._snapshot_path(month), rev)
+        if block is None:
+            try:
+                with span('file.read'), open(self._partition_path(month), 'r') as f:
+                    rows = json.load(f)
+                block = RecordBlock.from_dicts(normalize_expense(e, f"{month}:{i}") for i, e in enumerate(rows))
+            except FileNotFoundError:
+                block = RecordBlock()
+            else:
+                self._write_snapshot(month, block, rev)
+        return block
+
+    def _write_snapshot(self, month, block, rev):
+        try:
+            with span('file.write'):
+                write_snapshot(self._snapshot_path(month), block, rev)
+            return True
+        except OSError:
+            # Snapshots are an optimisation; the JSON partition stays authoritative
+            return False
+
+    def _remove_snapshot(self, month):
+        try:
+            os.remove(self._snapshot_path(month))
+        except OSError:
+            # Missing, or still mapped on platforms that forbid removing it
+            pass
+
+    def _store_partition(self, month, block, rev):
+        # Never leave a snapshot of the old revision next to the new JSON
+        self._remove_snapshot(month)
+        _write_json(self._partition_path(month), [r.to_dict() for r in block])
+        self._unsynced.add(self._partition_path(month))
+        self._write_snapshot(month, block, rev)
+
+    def _drop_partition(self, month):
+        self._remove_snapshot(month)
+        if os.path.exists(self._partition_path(month)):
+            os.remove(self._partition_path(month))
+
+    def compact(self):
+        """
+        Regenerate missing or stale snapshots (after a manifest rebuild, a
+        failed snapshot write or edits to the JSON files) and serve every
+        partition from its mapped snapshot; returns the months written
+        """
+        written = []
+        with self._lock:
+            partitions = self._open()['partitions']
+            for month in self.months():
+                rev = partitions[month].get('rev')
+                snapshot = open_snapshot(self._snapshot_path(month), rev)
+                if snapshot is None:
+                    # Parsing an uncached month already snapshots it
+                    block = self._partition(month)
+                    snapshot = open_snapshot(self._snapshot_path(month), rev)
+                    if snapshot is None and self._write_snapshot(month, block, rev):
+                        snapshot = open_snapshot(self._snapshot_path(month), rev)
+                    if snapshot is None:
+                        continue
+                    written.append(month)
+                self._cache[month] = (rev, snapshot)
+        return written
+
+    # ===== TOMBSTONES =====
+
+    def _tombstones_path(self):
+        return os.path.join(self.directory, TOMBSTONES_NAME)
+
+    def _load_tombstones(self):
+        try:
+            mtime = os.stat(self._tombstones_path()).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        if mtime != self._tombstones_mtime:
+            with open(self._tombstones_path(), 'r') as f:
+                self._tombstones = json.load(f)
+            self._tombstones_mtime = mtime
+        return self._tombstones
+
+    def _save_tombstones(self, tombstones):
+        _write_json(self._tombstones_path(), tombstones)
+        self._tombstones = tombstones
+        self._tombstones_mtime = os.stat(self._tombstones_path()).st_mtime_ns
+        self._unsynced.add(self._tombstones_path())
+
+    # ===== REVISIONS =====
+
+    def _revisions_path(self):
+        return os.path.join(self.directory, REVISIONS_NAME)
+
+    def _load_revisions(self):
+        entries = []
+        try:
+            with span('file.read'), open(self._revisions_path(), 'r') as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # A write torn by a crash; the next append continued its line
+                        continue
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _append_revisions(self, entries):
+        with span('file.write'), open(self._revisions_path(), 'a') as f:
+            f.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+        self._unsynced.add(self._revisions_path())
+
+    # ===== DOCUMENTS =====
+
+    def _document_path(self, name):
+        return os.path.join(self.documents_dir, f"{name}.json")
+
+    def load_document(self, name):
+        path = self._document_path(name)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def document_names(self):
+        if not os.path.isdir(self.documents_dir):
+            return []
+        legacy = os.path.basename(self.legacy_file) if self.legacy_file else None
+        return sorted(name[:-5] for name in os.listdir(self.documents_dir)
+                      if name.endswith('.json') and name != legacy
+                      and os.path.isfile(os.path.join(self.documents_dir, name)))
+
+    def save_document(self, name, data):
+        os.makedirs(self.documents_dir, exist_ok=True)
+        _write_json(self._document_path(name), data)
+        with self._lock:
+            self._unsynced.add(self._document_path(name))
+
+    def delete_document(self, name):
+        path = self._document_path(name)
+        if os.path.exists(path):
+            os.remove(path)
+            with self._lock:
+                # Syncs the directory entry that was removed
+                self._unsynced.add(path)
@@ -0,0 +1,386 @@
+"""
+Group-by / pivot queries with a small query planner
+
+A query groups expenses by any of ``DIMENSIONS``, computes any of ``METRICS``
+and may be restricted to a date range and to values of the ``FILTERS``
+fields. The planner lists the sources able to answer it, estimates the rows
+each would touch and runs the cheapest:
+
+- ``rollup``: the manifest summaries (per month, day and category totals);
+  touches one summary per month and no rows.
+- ``sql``: an aggregate query pushed down to the SQLite backend.
+- ``index_scan``: only the month partitions overlapping the date range.
+- ``columnar_scan``: every partition.
+
+Scans read the packed record columns directly (dates, amounts and string
+codes) and only materialise rows that carry overrides. Amounts are reported
+in the reporting currency (see ``fx.py``); SQL is only used when no
+conversion is needed.
+"""
+
+import calendar
+from datetime import date
+from .partitions import UNDATED
+from .records import CODE_SLOTS, _strings
+from .wallets import is_spending
+
+
+DIMENSIONS = ('year', 'month', 'date', 'category', 'payment_method', 'wallet', 'currency')
+METRICS = ('sum', 'count', 'avg', 'min', 'max')
+FILTERS = ('category', 'payment_method', 'wallet', 'currency')
+DEFAULT_METRICS = ('sum',)
+
+# Relative cost of touching one row per source; a rollup costs one unit per month
+ROW_COST = {'sql': 0.3, 'index_scan': 1.0, 'columnar_scan': 1.0}
+# Fields the SQLite backend keeps in a column; the rest are read from the JSON data
+SQL_COLUMNS = {'category': 'category', 'date': 'date'}
+# Record slots read by a columnar scan; extra fields may hold a row type that is not spending
+SCANNED_SLOTS = frozenset(('_date', 'amount', 'extra') + CODE_SLOTS)
+
+
+class QueryError(ValueError):
+    """Raised for a query that names unknown dimensions, metrics or filters"""
+
+
+def parse_query(group_by=None, metrics=None, filters=None, start=None, end=None):
+    """
+    Validate query parameters in their URL form
+    ``group_by`` and ``metrics`` are comma-separated; ``filters`` is a
+    comma-separated list of ``field:value`` with ``|`` between alternatives.
+    """
+    dims = [d for d in (group_by or '').split(',') if d]
+    for dim in dims:
+        if dim not in DIMENSIONS:
+            raise QueryError(f"Unknown group_by field: {dim}. Use: {', '.join(DIMENSIONS)}")
+    if len(set(dims)) != len(dims):
+        raise QueryError("group_by fields must be unique")
+
+    wanted = [m for m in (metrics or '').split(',') if m] or list(DEFAULT_METRICS)
+    for metric in wanted:
+        if metric not in METRICS:
+            raise QueryError(f"Unknown metric: {metric}. Use: {', '.join(METRICS)}")
+
+    conditions = {}
+    for clause in (filters or '').split(','):
+        if not clause:
+            continue
+        field, sep, values = clause.partition(':')
+        if not sep or field not in FILTERS:
+            raise QueryError(f"Invalid filter: {clause}. Use field:value with field one of: {', '.join(FILTERS)}")
+        conditions[field] = set(values.split('|'))
+
+    for bound in (start, end):
+        if bound is not None:
+            try:
+                date.fromisoformat(bound)
+            except ValueError:
+                raise QueryError("from and to must be YYYY-MM-DD dates")
+
+    return {'group_by': dims, 'metrics': list(dict.fromkeys(wanted)),
+            'filters': conditions, 'from': start, 'to': end}
+
+
+def _whole_months(start, end):
+    """Check that a date range starts and ends on month boundaries"""
+    if start and not start.endswith('-01'):
+        return False
+    if end:
+        year, month = int(end[:4]), int(end[5:7])
+        if int(end[8:]) != calendar.monthrange(year, month)[1]:
+            return False
+    return True
+
+
+def _rollup_reason(query):
+    """Get why the summaries cannot answer a query, or None when they can"""
+    dims, metrics, filters = set(query['group_by']), set(query['metrics']), query['filters']
+    if set(filters) - {'category'}:
+        return 'filters other than category are not pre-aggregated'
+    if 'date' in dims:
+        if dims - {'date', 'month', 'year'}:
+            return 'daily totals are not split by other fields'
+        if filters:
+            return 'daily totals are not split by category'
+        return None if metrics <= {'sum'} else 'daily totals only hold sums'
+    if dims - {'month', 'year', 'category'}:
+        return 'only month, year, date and category are pre-aggregated'
+    if not _whole_months(query['from'], query['to']):
+        return 'date range does not cover whole months'
+    if 'category' in dims or filters:
+        return None if metrics <= {'sum'} else 'category totals only hold sums'
+    return None if metrics <= {'sum', 'count', 'avg', 'max'} else 'monthly summaries hold no minimum'
+
+
+def plan_query(ledger, summaries, query, convert):
+    """
+    Choose the source of a query
+    Returns the plan: the source, the partitions and rows it touches, and the
+    candidates that were considered with their estimated cost.
+    """
+    months = ledger.months(query['from'], query['to'])
+    selected_rows = sum(summaries[m]['count'] for m in months if m in summaries)
+    total_rows = sum(s['count'] for s in summaries.values())
+
+    candidates = []
+    reason = _rollup_reason(query)
+    if reason is None:
+        candidates.append({'source': 'rollup', 'cost': len(months)})
+    if ledger.supports_sql and convert is None:
+        candidates.append({'source': 'sql', 'cost': selected_rows * ROW_COST['sql']})
+    if query['from'] or query['to']:
+        candidates.append({'source': 'index_scan', 'cost': selected_rows * ROW_COST['index_scan']})
+    candidates.append({'source': 'columnar_scan', 'cost': total_rows * ROW_COST['columnar_scan']})
+
+    best = min(candidates, key=lambda c: c['cost'])
+    return {
+        'source': best['source'],
+        'partitions': len(months) if best['source'] != 'columnar_scan' else len(summaries),
+        'rows': 0 if best['source'] == 'rollup' else (
+            total_rows if best['source'] == 'columnar_scan' else selected_rows),
+        'candidates': candidates,
+        'rollup_unavailable': reason,
+        'months': months
+    }
+
+
+# ===== AGGREGATION =====
+
+class _Groups:
+    """Accumulates sum, count, min and max per group key"""
+
+    def __init__(self):
+        self.groups = {}
+
+    def add(self, key, amount, count=1, low=None, high=None):
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = [0.0, 0, None, None]
+        group[0] += amount
+        group[1] += count
+        low = amount if low is None else low
+        high = amount if high is None else high
+        if group[2] is None or low < group[2]:
+            group[2] = low
+        if group[3] is None or high > group[3]:
+            group[3] = high
+
+    def rows(self, dims, metrics):
+        rows = []
+        for key in sorted(self.groups, key=lambda k: tuple('' if v is None else str(v) for v in k)):
+            total, count, low, high = self.groups[key]
+            row = dict(zip(dims, key))
+            values = {'sum': total, 'count': count, 'avg': total / count if count else 0,
+                      'min': low, 'max': high}
+            for metric in metrics:
+                row[metric] = values[metric]
+            rows.append(row)
+        return rows
+
+
+def _day_key(dims, day, month):
+    """Group key of a date dimension set for one day (or an undated month)"""
+    values = {'date': day, 'month': month, 'year': month[:4] if month else None}
+    return tuple(values[d] for d in dims)
+
+
+def _run_rollup(summaries, query, months):
+    dims = query['group_by']
+    start, end = query['from'], query['to']
+    wanted = query['filters'].get('category')
+    groups = _Groups()
+    for month in months:
+        summary = summaries[month]
+        month_value = None if month == UNDATED else month
+        if 'date' in dims:
+            if month == UNDATED:
+                groups.add(_day_key(dims, None, None), summary.get('total', 0))
+            for day, amount in summary.get('days', {}).items():
+                if (start and day < start) or (end and day > end):
+                    continue
+                groups.add(_day_key(dims, day, month_value), amount)
+            continue
+
+        if 'category' in dims or wanted:
+            for category, amount in summary.get('categories', {}).items():
+                if wanted and category not in wanted:
+                    continue
+                values = {'category': category, 'month': month_value,
+                          'year': month_value[:4] if month_value else None}
+                groups.add(tuple(values[d] for d in dims), amount)
+            continue
+
+        groups.add(_day_key(dims, None, month_value), summary.get('total', 0),
+                   count=summary.get('count', 0), high=summary.get('max_amount', 0))
+    return groups
+
+
+def _columns(block):
+    """
+    Get (dates, amounts, codes, strings, rows to materialise) of a packed
+    block, or None. Only rows whose overrides touch a scanned column (the
+    date, the amount or a string code) are materialised.
+    """
+    codes = getattr(block, '_codes', None)
+    if codes is None:
+        return None
+    dirty = set()
+    for index, override in block._overrides.items():
+        if 'set' in override or 'missing' in override:
+            # Snapshot overrides list the slots they set or clear
+            override = set(override.get('set', {})) | set(override.get('missing', ()))
+        if not SCANNED_SLOTS.isdisjoint(override):
+            dirty.add(index)
+    return block._dates, block._amounts, codes, getattr(block, '_strings', _strings), dirty
+
+
+def _record_fields(record, base):
+    """Dimension values of a materialised record"""
+    values = {field: record.get(field) for field in CODE_SLOTS}
+    if values['currency'] is None:
+        values['currency'] = base
+    day = record.date if isinstance(record.date, str) else None
+    values.update(date=day, month=day[:7] if day else None, year=day[:4] if day else None)
+    return values
+
+
+def _run_scan(ledger, query, months, convert, base):
+    dims = query['group_by']
+    start = date.fromisoformat(query['from']).toordinal() if query['from'] else None
+    end = date.fromisoformat(query['to']).toordinal() if query['to'] else None
+    width = len(CODE_SLOTS)
+    currency_slot = CODE_SLOTS.index('currency')
+    # A dimension is a prefix of the ISO date or a string code slot
+    date_parts = {'date': 10, 'month': 7, 'year': 4}
+    dim_slots = [(date_parts.get(d), None if d in date_parts else CODE_SLOTS.index(d)) for d in dims]
+    filter_slots = [(CODE_SLOTS.index(f), values) for f, values in query['filters'].items()]
+    iso_dates = {}
+    groups = _Groups()
+    add = groups.add
+
+    def add_record(record):
+        if not is_spending(record):
+            return
+        ordinal = record.ordinal
+        if (start or end) and (ordinal is None or (start and ordinal < start) or (end and ordinal > end)):
+            return
+        values = _record_fields(record, base)
+        for field, wanted in query['filters'].items():
+            if values[field] not in wanted:
+                return
+        amount = record.get('amount') or 0
+        if convert is not None:
+            amount *= convert(record.get('currency'), values['date'])
+        add(tuple(values[d] for d in dims), amount)
+
+    for month in months:
+        with ledger._lock:
+            block = ledger._partition(month)
+        columns = _columns(block)
+        if columns is None:
+            for record in block:
+                add_record(record)
+            continue
+
+        dates, amounts, codes, strings, dirty = columns
+        for i in range(len(dates)):
+            if i in dirty:
+                add_record(block[i])
+                continue
+            ordinal = dates[i]
+            if (start is not None and ordinal < start) or (end is not None and ordinal > end):
+                continue
+            offset = i * width
+            for slot, wanted in filter_slots:
+                value = strings[codes[offset + slot]]
+                if value is None and slot == currency_slot:
+                    value = base
+                if value not in wanted:
+                    break
+            else:
+                day = iso_dates.get(ordinal)
+                if day is None:
+                    day = iso_dates[ordinal] = date.fromordinal(ordinal).isoformat()
+                amount = amounts[i]
+                if convert is not None:
+                    code = codes[offset + currency_slot]
+                    amount *= convert(strings[code] if code else None, day)
+                key = []
+                for cut, slot in dim_slots:
+                    if cut:
+                        key.append(day[:cut])
+                    else:
+                        value = strings[codes[offset + slot]]
+                        key.append(base if value is None and slot == currency_slot else value)
+                add(tuple(key), amount)
+    return groups
+
+
+def _run_sql(ledger, query, months, base):
+    dims = query['group_by']
+    expressions = []
+    params = []
+    for dim in dims:
+        if dim == 'year':
+            expressions.append("substr(date, 1, 4)")
+        elif dim == 'month':
+            expressions.append(f"NULLIF(month, '{UNDATED}')")
+        elif dim in SQL_COLUMNS:
+            expressions.append(SQL_COLUMNS[dim])
+        elif dim == 'currency':
+            expressions.append("COALESCE(json_extract(data, '$.currency'), ?)")
+            params.append(base)
+        else:
+            expressions.append(f"json_extract(data, '$.{dim}')")
+
+    # Income and transfers are not spending
+    where = ["COALESCE(json_extract(data, '$.type'), 'expense') = 'expense'"]
+    if query['from'] or query['to']:
+        # The month bound lets SQLite use the primary key
+        placeholders = ', '.join('?' for _ in months)
+        where.append(f"month IN ({placeholders})")
+        params.extend(months)
+    if query['from']:
+        where.append("date >= ?")
+        params.append(query['from'])
+    if query['to']:
+        where.append("date <= ?")
+        params.append(query['to'])
+    for field, values in query['filters'].items():
+        column = SQL_COLUMNS.get(field, f"json_extract(data, '$.{field}')")
+        if field == 'currency':
+            column = "COALESCE(json_extract(data, '$.currency'), ?)"
+            params.append(base)
+        where.append(f"{column} IN ({', '.join('?' for _ in values)})")
+        params.extend(sorted(values))
+
+    select = ', '.join(expressions + ['SUM(amount)', 'COUNT(*)', 'MIN(amount)', 'MAX(amount)'])
+    sql = f"SELECT {select} FROM expenses WHERE " + ' AND '.join(where)
+    if dims:
+        sql += ' GROUP BY ' + ', '.join(str(i + 1) for i in range(len(dims)))
+
+    groups = _Groups()
+    for row in ledger.execute(sql, params):
+        key, (total, count, low, high) = tuple(row[:len(dims)]), row[len(dims):]
+        if count:
+            groups.add(key, total or 0, count=count, low=low, high=high)
+    return groups
+
+
+def run_query(ledger, summaries, query, base, convert=None):
+    """
+    Plan and run a query; returns {'rows': [...], 'plan': {...}}
+    ``summaries`` are the manifest summaries in the reporting currency, ``base``
+    the currency of rows without one and ``convert`` the per-row conversion
+    (see ``CurrencyConverter.row_factors``).
+    """
+    plan = plan_query(ledger, summaries, query, convert)
+    months = plan.pop('months')
+    source = plan['source']
+    if source == 'rollup':
+        groups = _run_rollup(summaries, query, [m for m in months if m in summaries])
+    elif source == 'sql':
+        groups = _run_sql(ledger, query, months, base)
+    else:
+        groups = _run_scan(ledger, query, months if source == 'index_scan' else ledger.months(),
+                           convert, base)
+    return {'rows': groups.rows(query['group_by'], query['metrics']), 'plan': plan}
@@ -0,0 +1,435 @@
+"""
+Memory-compact expense records
+
+A plain expense dict with 12 keys costs around 1KB once its key table and
+string values are counted. ``ExpenseRecord`` keeps the same data in slots:
+UUIDs as 16 raw bytes, dates as day ordinals, timestamps as integer
+microseconds, and interned category/payment method/wallet/currency strings
+shared by every record. ``RecordBlock`` goes further for cached partitions and stores
+those packed values column-wise in arrays, materialising records on access.
+Records are converted back to dicts only at the JSON boundary.
+"""
+
+import json
+import sys
+import threading
+import uuid
+from array import array
+from datetime import date, datetime, timedelta
+
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+# Marks a key that was absent from the source dict
+_MISSING = object()
+
+FIELDS = (
+    'id', 'date', 'category', 'description', 'amount', 'currency', 'payment_method',
+    'wallet', 'receipt', 'notes', 'tags', 'recurring', 'created_at', 'version'
+)
+# Interned string fields stored as codes, in column order
+CODE_SLOTS = ('category', 'payment_method', 'wallet', 'currency')
+_FIELD_SET = frozenset(FIELDS)
+_EMPTY_TAGS = ()
+
+# Namespace of the IDs derived for stored rows that have none
+ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, 'expense-tracker/expense')
+
+
+def _intern(value):
+    """Intern short repeated strings so every record shares one copy"""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _pack_id(value):
+    """Store canonical UUID strings as 16 bytes"""
+    if isinstance(value, str) and len(value) == 36:
+        try:
+            packed = uuid.UUID(value)
+        except ValueError:
+            return value
+        if str(packed) == value:
+            return packed.bytes
+    return value
+
+
+def _pack_date(value):
+    """Store ISO dates as day ordinals"""
+    if isinstance(value, str) and len(value) == 10:
+        try:
+            return date.fromisoformat(value).toordinal()
+        except ValueError:
+            pass
+    return value
+
+
+def _pack_timestamp(value):
+    """Store naive ISO timestamps as integer microseconds since the epoch"""
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            return value
+        if parsed.tzinfo is None and parsed.isoformat() == value:
+            return (parsed - EPOCH) // MICROSECOND
+    return value
+
+
+def _pack_tags(value):
+    if value == []:
+        return _EMPTY_TAGS
+    if isinstance(value, list) and all(isinstance(t, str) for t in value):
+        return tuple(_intern(t) for t in value)
+    return value
+
+
+def normalize_expense(data, position=None):
+    """
+    Map an expense dict written by an older entry point onto the current schema
+    ``categories`` lists (app_vercel.py) become ``category`` (the list is kept
+    when it has more than one entry), ``timestamp`` (app.py) becomes
+    ``created_at`` and numeric strings become float amounts. Rows without an
+    ID get one derived from their content and ``position``, so it stays the
+    same every time the row is read. Current rows are returned unchanged.
+    """
+    if 'id' in data and 'category' in data and 'timestamp' not in data and \
+            not isinstance(data.get('amount'), str):
+        return data
+
+    data = dict(data)
+    categories = data.pop('categories', None)
+    if 'category' not in data:
+        if isinstance(categories, list):
+            data['category'] = categories[0] if categories else None
+            if len(categories) > 1:
+                data['categories'] = categories
+        elif categories is not None:
+            data['category'] = categories
+    elif categories is not None:
+        data['categories'] = categories
+
+    timestamp = data.pop('timestamp', None)
+    if timestamp is not None:
+        data.setdefault('created_at', timestamp)
+
+    if isinstance(data.get('amount'), str):
+        try:
+            data['amount'] = float(data['amount'])
+        except ValueError:
+            pass
+
+    if 'id' not in data:
+        content = json.dumps([position, data], sort_keys=True, default=str)
+        data['id'] = str(uuid.uuid5(ID_NAMESPACE, content))
+    return data
+
+
+class ExpenseRecord:
+    """Compact, read-only view of a stored expense"""
+
+    __slots__ = (
+        '_id', '_date', 'category', 'description', 'amount', 'currency', 'payment_method',
+        'wallet', 'receipt', 'notes', '_tags', 'recurring', '_created_at', 'version',
+        'extra'
+    )
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a record from an expense dict"""
+        record = cls.__new__(cls)
+        get = data.get
+        record._id = _pack_id(get('id', _MISSING))
+        record._date = _pack_date(get('date', _MISSING))
+        record.category = _intern(get('category', _MISSING))
+        record.description = get('description', _MISSING)
+        record.amount = get('amount', _MISSING)
+        record.currency = _intern(get('currency', _MISSING))
+        record.payment_method = _intern(get('payment_method', _MISSING))
+        record.wallet = _intern(get('wallet', _MISSING))
+        record.receipt = get('receipt', _MISSING)
+        record.notes = get('notes', _MISSING)
+        record._tags = _pack_tags(get('tags', _MISSING))
+        record.recurring = get('recurring', _MISSING)
+        record._created_at = _pack_timestamp(get('created_at', _MISSING))
+        record.version = get('version', _MISSING)
+
+        extra = None
+        if len(data) > len(FIELDS) or not _FIELD_SET.issuperset(data):
+            extra = {k: v for k, v in data.items() if k not in _FIELD_SET} or None
+        record.extra = extra
+        return record
+
+    # ===== DECODED FIELDS =====
+
+    @property
+    def id(self):
+        value = self._id
+        return str(uuid.UUID(bytes=value)) if isinstance(value, bytes) else value
+
+    @property
+    def ordinal(self):
+        """Day ordinal of the expense date, or None when it is not an ISO date"""
+        return self._date if isinstance(self._date, int) else None
+
+    @property
+    def date(self):
+        value = self._date
+        return date.fromordinal(value).isoformat() if isinstance(value, int) else value
+
+    @property
+    def tags(self):
+        value = self._tags
+        return list(value) if isinstance(value, tuple) else value
+
+    @property
+    def created_at(self):
+        value = self._created_at
+        if isinstance(value, int):
+            return (EPOCH + value * MICROSECOND).isoformat()
+        return value
+
+    def matches_id(self, expense_id):
+        """Compare against an ID string without decoding this record's ID"""
+        return self._id == _pack_id(expense_id)
+
+    # ===== DICT BOUNDARY =====
+
+    def to_dict(self):
+        """Convert to a plain expense dict for JSON responses and storage"""
+        result = {}
+        for key in FIELDS:
+            value = getattr(self, key)
+            if value is not _MISSING:
+                result[key] = value
+        if self.extra:
+            result.update(self.extra)
+        return result
+
+    def get(self, key, default=None):
+        """Dict-style field access for code written against expense dicts"""
+        if key in _FIELD_SET:
+            value = getattr(self, key)
+            return default if value is _MISSING else value
+        if self.extra:
+            return self.extra.get(key, default)
+        return default
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def replace(self, updates):
+        """Get a new record with some fields replaced"""
+        data = self.to_dict()
+        data.update(updates)
+        return ExpenseRecord.from_dict(data)
+
+    def __repr__(self):
+        return f"ExpenseRecord({self.to_dict()!r})"
+
+
+# ===== COLUMNAR BLOCKS =====
+
+_NO_ID = bytes(16)
+
+# Category, payment method, wallet and currency strings are stored as codes into this table
+_strings = [None]
+_codes = {None: 0}
+_strings_lock = threading.Lock()
+
+
+def _code(value):
+    code = _codes.get(value)
+    if code is None:
+        with _strings_lock:
+            code = _codes.get(value)
+            if code is None:
+                code = len(_strings)
+                _strings.append(value)
+                _codes[value] = code
+    return code
+
+
+class RecordBlock:
+    """
+    Column-oriented, immutable list of records
+
+    Each row costs roughly 70 bytes plus its description string: fixed-width
+    arrays hold the ID, date, amount, codes and timestamp, while values that
+    do not fit a column (missing keys, legacy IDs, extra fields) are kept in
+    a sparse per-row override table.
+    """
+
+    __slots__ = (
+        '_ids', '_dates', '_amounts', '_codes', '_descriptions', '_notes',
+        '_receipts', '_tags', '_recurring', '_created', '_versions', '_overrides'
+    )
+
+    def __init__(self, records=()):
+        self._ids = bytearray()
+        self._dates = array('i')
+        self._amounts = array('d')
+        self._codes = array('I')
+        self._descriptions = []
+        self._notes = []
+        self._receipts = []
+        self._tags = []
+        self._recurring = array('b')
+        self._created = array('q')
+        self._versions = array('q')
+        self._overrides = {}
+        for record in records:
+            self._append(record)
+        self._ids = bytes(self._ids)
+
+    @classmethod
+    def from_dicts(cls, expenses):
+        """Pack a list of expense dicts"""
+        return cls(ExpenseRecord.from_dict(e) for e in expenses)
+
+    def _append(self, record):
+        index = len(self._amounts)
+        override = {}
+
+        value = record._id
+        if isinstance(value, bytes) and len(value) == 16:
+            self._ids += value
+        else:
+            self._ids += _NO_ID
+            override['_id'] = value
+
+        value = record._date
+        if type(value) is int:
+            self._dates.append(value)
+        else:
+            self._dates.append(0)
+            override['_date'] = value
+
+        value = record.amount
+        if type(value) is float:
+            self._amounts.append(value)
+        else:
+            self._amounts.append(0.0)
+            override['amount'] = value
+
+        for slot in CODE_SLOTS:
+            value = getattr(record, slot)
+            if slot == 'currency' and value is _MISSING:
+                # Most rows have no currency; code 0 marks it absent without an override
+                self._codes.append(0)
+            elif (value is None and slot != 'currency') or type(value) is str:
+                self._codes.append(_code(value))
+            else:
+                self._codes.append(0)
+                override[slot] = value
+
+        self._descriptions.append(record.description)
+        self._notes.append(record.notes)
+        self._receipts.append(record.receipt)
+        self._tags.append(record._tags)
+
+        value = record.recurring
+        if value is True or value is False:
+            self._recurring.append(value)
+        else:
+            self._recurring.append(0)
+            override['recurring'] = value
+
+        value = record._created_at
+        if type(value) is int:
+            self._created.append(value)
+        else:
+            self._created.append(0)
+            override['_created_at'] = value
+
+        # Change sequence numbers start at 1, so 0 marks an unversioned row
+        value = record.version
+        if type(value) is int and value > 0:
+            self._versions.append(value)
+        else:
+            self._versions.append(0)
+            if value is not _MISSING:
+                override['version'] = value
+
+        if record.extra:
+            override['extra'] = record.extra
+        if override:
+            self._overrides[index] = override
+
+    def __len__(self):
+        return len(self._amounts)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        record = ExpenseRecord.__new__(ExpenseRecord)
+        record._id = self._ids[index * 16:index * 16 + 16]
+        record._date = self._dates[index]
+        record.amount = self._amounts[index]
+        codes = self._codes
+        base = index * len(CODE_SLOTS)
+        record.category = _strings[codes[base]]
+        record.payment_method = _strings[codes[base + 1]]
+        record.wallet = _strings[codes[base + 2]]
+        record.currency = _strings[codes[base + 3]] if codes[base + 3] else _MISSING
+        record.description = self._descriptions[index]
+        record.notes = self._notes[index]
+        record.receipt = self._receipts[index]
+        record._tags = self._tags[index]
+        record.recurring = bool(self._recurring[index])
+        record._created_at = self._created[index]
+        record.version = self._versions[index] or _MISSING
+        record.extra = None
+        override = self._overrides.get(index)
+        if override:
+            for slot, value in override.items():
+                setattr(record, slot, value)
+        return record
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def extended(self, records):
+        """Get a new block with records appended; the existing rows are copied column by column"""
+        block = RecordBlock.__new__(RecordBlock)
+        block._ids = bytearray(self._ids)
+        block._dates = array('i', self._dates)
+        block._amounts = array('d', self._amounts)
+        block._codes = array('I', self._codes)
+        block._descriptions = list(self._descriptions)
+        block._notes = list(self._notes)
+        block._receipts = list(self._receipts)
+        block._tags = list(self._tags)
+        block._recurring = array('b', self._recurring)
+        block._created = array('q', self._created)
+        block._versions = array('q', self._versions)
+        block._overrides = dict(self._overrides)
+        for record in records:
+            block._append(record)
+        block._ids = bytes(block._ids)
+        return block
+
+    def max_version(self):
+        """Highest change sequence number in the block"""
+        return max(self._versions, default=0)
+
+    def find(self, expense_id):
+        """Get the row index of an expense ID, or None"""
+        packed = _pack_id(expense_id)
+        if isinstance(packed, bytes) and len(packed) == 16:
+            start = 0
+            while True:
+                pos = self._ids.find(packed, start)
+                if pos < 0:
+                    break
+                if pos % 16 == 0:
+                    return pos // 16
+                start = pos + 1
+        for index, override in self._overrides.items():
+            if override.get('_id', _MISSING) == packed:
+                return index
+        return None
@@ -0,0 +1,149 @@
+"""
+Expense revision history
+
+Every write appends entries to the ledger's revision log (persisted by the
+storage backend next to the rows it changed, in the same batch):
+
+    {"op": "add", "ids": [...], "version": 12, "at": "2026-10-19T09:30:00"}
+    {"op": "update", "id": "...", "version": 13, "previous": 12, "at": "...",
+     "changes": {"amount": [35.5, 40.0], "category": ["Food", "Shopping"]}}
+    {"op": "delete", "id": "...", "version": 14, "at": "...", "row": {...}}
+
+An update only stores the fields it changed, with their old and new values;
+``version`` is kept apart, as ``previous``. Added rows are not copied: the
+current ledger is the newest snapshot of every live expense and a deletion
+keeps the last state of its row, so a past state is rebuilt from the nearest
+snapshot by undoing, newest first, only the revisions made after it. The
+ledger as of a timestamp costs one read of the ledger plus the revisions since
+then, however long the history.
+
+History starts with this log: rows written earlier are taken as they are,
+from their ``created_at`` on.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+
+
+# Bookkeeping fields that are not part of an expense's history
+UNTRACKED_FIELDS = ('version',)
+
+
+def field_changes(before, after):
+    """Get {field: [old, new]} for the fields two versions of an expense differ in"""
+    changes = {}
+    for field in before.keys() | after.keys():
+        if field in UNTRACKED_FIELDS:
+            continue
+        old = before.get(field)
+        new = after.get(field)
+        if old != new:
+            changes[field] = [old, new]
+    return changes
+
+
+def parse_timestamp(value):
+    """
+    Parse an ISO timestamp into the naive local time revisions are stamped in
+    A date alone means the end of that day. Raises ValueError.
+    """
+    if len(value) == 10:
+        value = f"{value}T23:59:59.999999"
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return moment.isoformat()
+
+
+def _undo(rows, entry):
+    """Undo one revision on {id: row}"""
+    if entry['op'] == 'add':
+        for expense_id in entry['ids']:
+            rows.pop(expense_id, None)
+    elif entry['op'] == 'delete':
+        rows[entry['id']] = dict(entry['row'])
+    else:
+        row = rows.get(entry['id'])
+        if row is None:
+            return
+        row = dict(row)
+        for field, (old, new) in entry['changes'].items():
+            row[field] = old
+        row['version'] = entry.get('previous')
+        rows[entry['id']] = row
+
+
+class RevisionHistory:
+    """Index of one ledger's revision log by expense"""
+
+    def __init__(self, ledger):
+        self.ledger = ledger
+        self._log = None
+        # expense ID -> positions of its revisions in the log
+        self._positions = defaultdict(list)
+        self._indexed = 0
+
+    def _index(self, log):
+        """Index the log entries appended since the last call; called holding the ledger lock"""
+        if log is not self._log:
+            # The ledger reloaded its log
+            self._log = log
+            self._positions = defaultdict(list)
+            self._indexed = 0
+        for position in range(self._indexed, len(log)):
+            entry = log[position]
+            for expense_id in entry['ids'] if entry['op'] == 'add' else (entry['id'],):
+                self._positions[expense_id].append(position)
+        self._indexed = len(log)
+        return self._positions
+
+    def history(self, expense_id):
+        """
+        Get the revisions of an expense, oldest first, each with the expense as
+        it was after it (None once deleted); None when the ID is unknown
+        """
+        with self.ledger._lock:
+            log = self.ledger.revisions()
+            positions = list(self._index(log).get(expense_id, ()))
+            current = self.ledger.get(expense_id)
+        if not positions and current is None:
+            return None
+
+        # Walk back from the current row, undoing one revision at a time
+        rows = {expense_id: current} if current is not None else {}
+        revisions = []
+        for position in reversed(positions):
+            entry = log[position]
+            revision = {'op': entry['op'], 'version': entry['version'], 'at': entry['at'],
+                        'expense': rows.get(expense_id)}
+            if entry['op'] == 'update':
+                revision['changes'] = {field: {'from': old, 'to': new}
+                                       for field, (old, new) in entry['changes'].items()}
+            revisions.append(revision)
+            _undo(rows, entry)
+        revisions.reverse()
+        return {'id': expense_id, 'current': current, 'revisions': revisions}
+
+    def as_of(self, timestamp, start_date=None, end_date=None):
+        """Get the expenses (within an inclusive date range) as they were at a timestamp"""
+        with self.ledger._lock:
+            log = self.ledger.revisions()
+            count = len(log)
+            rows = {row.get('id'): row for row in self.ledger.load_all()}
+        # Revisions are logged in time order: undo the ones after the timestamp, newest first
+        for position in range(count - 1, -1, -1):
+            entry = log[position]
+            if entry['at'] <= timestamp:
+                break
+            _undo(rows, entry)
+
+        expenses = []
+        for row in rows.values():
+            if (row.get('created_at') or '') > timestamp:
+                continue
+            day = row.get('date') or ''
+            if (start_date and day < start_date) or (end_date and day > end_date):
+                continue
+            expenses.append(row)
+        expenses.sort(key=lambda row: row.get('date') or '')
+        return expenses
@@ -0,0 +1,336 @@
+"""
+Rule-based auto-categorisation
+
+Expenses that arrive without a category (typically imported bank lines) are
+categorised by user-defined rules, stored in the ``rules`` document of the
+ledger::
+
+    {"default": "Others",
+     "rules": [{"contains": ["swiggy", "zomato"], "category": "Food", "tags": ["delivery"]},
+               {"regex": "^uber\\\\b", "max_amount": 2000, "payment_method": "UPI",
+                "category": "Transportation"}]}
+
+Every condition a rule has must hold: ``contains`` (any of the substrings,
+ignoring case), ``regex`` (searched in the description, ignoring case),
+``min_amount`` / ``max_amount`` and ``payment_method``. The first matching
+rule wins; expenses no rule matches get ``default`` when it is set.
+
+Rules are compiled into one matcher. Every substring of every rule goes into a
+single Aho-Corasick automaton, so one pass over the description finds all the
+rules whose substrings occur. The same automaton also holds a literal every
+match of each regex must contain (``uber`` for ``^uber\\b``), so a regex only
+runs on descriptions holding its literal. Regexes without one are combined into
+one pattern, which is tried before any of them runs; those with groups or
+inline flags, which would clash or be renumbered in a combined pattern, run on
+their own. The rules whose text
+conditions hold are memoised per description, as imported statements repeat
+merchants. The compiled matcher is cached until the document changes, so
+edits apply without a restart.
+"""
+
+import json
+import re
+from collections import deque
+
+
+RULES_DOCUMENT = 'rules'
+# Descriptions whose text matches are memoised before the memo is cleared
+MEMO_SIZE = 100000
+# Shortest literal worth filtering a regex on
+MIN_LITERAL = 3
+_QUANTIFIERS = '*?{'
+# Inline flags: global ones are only valid at the start of a whole pattern
+_INLINE_FLAGS = re.compile(r'\(\?[aiLmsux-]')
+
+
+class RuleError(ValueError):
+    """Raised when a rules document is invalid"""
+
+
+def validate_rules(document, categories, payment_methods):
+    """Check a rules document; returns it normalised or raises RuleError"""
+    if not isinstance(document, dict) or not isinstance(document.get('rules', []), list):
+        raise RuleError('Rules must be {"default": ..., "rules": [...]}')
+    default = document.get('default')
+    if default is not None and default not in categories:
+        raise RuleError(f"Invalid default category: {default}")
+
+    rules = []
+    for i, rule in enumerate(document.get('rules', []), 1):
+        if not isinstance(rule, dict):
+            raise RuleError(f"Rule {i} must be an object")
+        if rule.get('category') not in categories:
+            raise RuleError(f"Rule {i}: category must be one of: {', '.join(categories)}")
+        normalised = {'category': rule['category']}
+
+        contains = rule.get('contains')
+        if contains is not None:
+            contains = [contains] if isinstance(contains, str) else contains
+            if not isinstance(contains, list) or not contains or \
+                    not all(isinstance(s, str) and s.strip() for s in contains):
+                raise RuleError(f"Rule {i}: contains must be a non-empty string or list of strings")
+            normalised['contains'] = [s.strip().lower() for s in contains]
+
+        if rule.get('regex') is not None:
+            try:
+                re.compile(rule['regex'])
+            except (re.error, TypeError) as e:
+                raise RuleError(f"Rule {i}: invalid regex: {e}")
+            normalised['regex'] = rule['regex']
+
+        for bound in ('min_amount', 'max_amount'):
+            if rule.get(bound) is not None:
+                try:
+                    normalised[bound] = float(rule[bound])
+                except (TypeError, ValueError):
+                    raise RuleError(f"Rule {i}: {bound} must be a number")
+
+        if rule.get('payment_method') is not None:
+            if rule['payment_method'] not in payment_methods:
+                raise RuleError(f"Rule {i}: payment_method must be one of: {', '.join(payment_methods)}")
+            normalised['payment_method'] = rule['payment_method']
+
+        if len(normalised) == 1:
+            raise RuleError(f"Rule {i} has no condition")
+        tags = rule.get('tags', [])
+        if not isinstance(tags, list) or not all(isinstance(t, str) for t in tags):
+            raise RuleError(f"Rule {i}: tags must be a list of strings")
+        if tags:
+            normalised['tags'] = tags
+        rules.append(normalised)
+    return {'default': default, 'rules': rules}
+
+
+def combinable(pattern):
+    """
+    Check that a regex means the same inside a larger alternation: no groups
+    (whose names could clash and whose backreferences would be renumbered)
+    and no inline flags
+    """
+    return re.compile(pattern).groups == 0 and not _INLINE_FLAGS.search(pattern)
+
+
+def required_literal(pattern):
+    """
+    Get a lower-cased literal every match of a regex contains, or None
+    Only top-level runs of plain characters count; alternations, groups,
+    classes and optional characters end a run.
+    """
+    if '|' in pattern or re.compile(pattern).flags & re.VERBOSE:
+        return None
+    runs = []
+    run = ''
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        literal = None
+        if ch == '\\' and i + 1 < len(pattern):
+            i += 1
+            if not pattern[i].isalnum():
+                literal = pattern[i]
+        elif ch == '[':
+            # Skip the class, which may open with ] and hold escapes
+            i += 2 if pattern[i + 1:i + 2] in (']', '^') else 1
+            while i < len(pattern) and pattern[i] != ']':
+                i += 2 if pattern[i] == '\\' else 1
+        elif ch == '{':
+            while i + 1 < len(pattern) and pattern[i] != '}':
+                i += 1
+        elif ch == '(':
+            depth = 1
+            while depth and i + 1 < len(pattern):
+                i += 1
+                if pattern[i] == '\\':
+                    i += 1
+                elif pattern[i] in '()':
+                    depth += 1 if pattern[i] == '(' else -1
+        elif ch not in '.^$+*?)':
+            literal = ch
+        i += 1
+
+        if literal is not None and (i >= len(pattern) or pattern[i] not in _QUANTIFIERS):
+            run += literal
+        else:
+            runs.append(run)
+            run = ''
+    runs.append(run)
+    longest = max(runs, key=len)
+    return longest.lower() if len(longest) >= MIN_LITERAL else None
+
+
+class Automaton:
+    """Aho-Corasick automaton: one pass over a text finds every pattern in it"""
+
+    def __init__(self, patterns):
+        """patterns: (substring, bitmask) pairs; search() ORs the masks of those found"""
+        goto = [{}]
+        out = [0]
+        for pattern, mask in patterns:
+            state = 0
+            for ch in pattern:
+                if ch not in goto[state]:
+                    goto.append({})
+                    out.append(0)
+                    goto[state][ch] = len(goto) - 1
+                state = goto[state][ch]
+            out[state] |= mask
+
+        # Breadth-first, fold failure links into a full transition table
+        fail = [0] * len(goto)
+        delta = [dict(goto[0])] + [None] * (len(goto) - 1)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            out[state] |= out[fail[state]]
+            delta[state] = dict(delta[fail[state]], **goto[state])
+            for ch, child in goto[state].items():
+                fail[child] = delta[fail[state]].get(ch, 0)
+                queue.append(child)
+        self._delta = delta
+        self._out = out
+
+    def search(self, text):
+        delta = self._delta
+        out = self._out
+        state = 0
+        found = 0
+        for ch in text:
+            state = delta[state].get(ch, 0)
+            found |= out[state]
+        return found
+
+
+class CompiledRules:
+    """A rules document compiled into one matcher"""
+
+    def __init__(self, document):
+        document = document or {}
+        self.default = document.get('default')
+        self._rules = document.get('rules', [])
+        count = len(self._rules)
+        patterns = []
+        unfiltered = []
+        # Rules whose text conditions always hold
+        self._textless = 0
+        self._contains_only = 0
+        # Regexes run when the automaton finds their gate: {gate bit: (rule bit, regex)}
+        self._gated = {}
+        self._gates = 0
+        # Regexes without a gate, run when the combined pattern matches: (rule bit, regex)
+        self._unfiltered = []
+        # Regexes without a gate that cannot be combined, run on every description
+        self._standalone = []
+        for i, rule in enumerate(self._rules):
+            bit = 1 << i
+            if 'contains' in rule:
+                patterns.extend((s, bit) for s in rule['contains'])
+            if 'regex' not in rule:
+                if 'contains' in rule:
+                    self._contains_only |= bit
+                else:
+                    self._textless |= bit
+                continue
+
+            regex = re.compile(rule['regex'], re.IGNORECASE)
+            gate = bit if 'contains' in rule else 0
+            if not gate:
+                literal = required_literal(rule['regex'])
+                if literal is not None:
+                    # Literals use the bits above the rules'
+                    gate = 1 << (count + i)
+                    patterns.append((literal, gate))
+            if gate:
+                self._gated[gate] = (bit, regex)
+                self._gates |= gate
+            elif combinable(rule['regex']):
+                self._unfiltered.append((bit, regex))
+                unfiltered.append(rule['regex'])
+            else:
+                self._standalone.append((bit, regex))
+        self._automaton = Automaton(patterns) if patterns else None
+        self._combined = None
+        if unfiltered:
+            try:
+                self._combined = re.compile('|'.join(f'(?:{r})' for r in unfiltered), re.IGNORECASE)
+            except re.error:
+                # Never expected after combinable(); run every regex on its own rather than none
+                self._standalone.extend(self._unfiltered)
+                self._unfiltered = []
+        self._memo = {}
+
+    def _text_matches(self, description):
+        """Bitmask of the rules whose substring and regex conditions hold for a description"""
+        matches = self._memo.get(description)
+        if matches is not None:
+            return matches
+        found = self._automaton.search(description.lower()) if self._automaton else 0
+        matches = self._textless | (found & self._contains_only)
+        gated = found & self._gates
+        while gated:
+            gate = gated & -gated
+            gated ^= gate
+            bit, regex = self._gated[gate]
+            if regex.search(description):
+                matches |= bit
+        # Regexes without a gate run only when one of them matches
+        if self._combined is not None and self._combined.search(description):
+            for bit, regex in self._unfiltered:
+                if regex.search(description):
+                    matches |= bit
+        for bit, regex in self._standalone:
+            if regex.search(description):
+                matches |= bit
+        if len(self._memo) >= MEMO_SIZE:
+            self._memo.clear()
+        self._memo[description] = matches
+        return matches
+
+    def match(self, description, amount=None, payment_method=None):
+        """Get the first rule matching an expense, or None"""
+        matches = self._text_matches(description or '')
+        rules = self._rules
+        while matches:
+            bit = matches & -matches
+            rule = rules[bit.bit_length() - 1]
+            matches ^= bit
+            if 'payment_method' in rule and rule['payment_method'] != payment_method:
+                continue
+            if 'min_amount' in rule or 'max_amount' in rule:
+                try:
+                    value = float(amount)
+                except (TypeError, ValueError):
+                    continue
+                if value < rule.get('min_amount', value) or value > rule.get('max_amount', value):
+                    continue
+            return rule
+        return None
+
+    def apply(self, expense):
+        """Get an expense without a category categorised (and tagged) by the rules"""
+        if expense.get('category'):
+            return expense
+        rule = self.match(expense.get('description'), expense.get('amount'), expense.get('payment_method'))
+        if rule is not None:
+            tags = list(expense.get('tags') or [])
+            tags.extend(t for t in rule.get('tags', ()) if t not in tags)
+            return dict(expense, category=rule['category'], tags=tags)
+        if self.default:
+            return dict(expense, category=self.default)
+        return expense
+
+
+class RuleEngine:
+    """Compiled rules of one ledger, recompiled when its rules document changes"""
+
+    def __init__(self, ledger):
+        self.ledger = ledger
+        self._source = None
+        self._compiled = CompiledRules(None)
+
+    def compiled(self):
+        document = self.ledger.load_document(RULES_DOCUMENT)
+        source = json.dumps(document, sort_keys=True)
+        if source != self._source:
+            self._compiled = CompiledRules(document)
+            self._source = source
+        return self._compiled
@@ -0,0 +1,141 @@
+"""
+Quantile sketches of expense amounts
+
+Amount distributions are kept as log-bucket sketches (DDSketch style): an
+amount x is counted in bucket ceil(log(x) / log(GAMMA)), so each bucket spans
+a relative width of 2 * RELATIVE_ACCURACY and any quantile read from a sketch
+is within RELATIVE_ACCURACY of the exact one. Merging two sketches adds their
+bucket counts, which loses nothing, so the median or p99 over any range of
+months and categories is read from the merge of their stored sketches instead
+of sorting the amounts.
+
+Every partition summary keeps one sketch per category under ``sketches`` (see
+``partitions.summarize``), stored as ``{"zeros": n, "buckets": {index: count}}``.
+An amount is an anomaly when it lies beyond Tukey's fences of its category,
+taken on the log of the amounts since spending is spread multiplicatively: more
+than ``FENCE`` interquartile ratios above the upper quartile or below the
+lower one.
+"""
+
+import math
+from collections import defaultdict
+
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(GAMMA)
+# Amounts at or below this are counted as zero
+MIN_AMOUNT = 1e-9
+QUANTILES = (('median', 0.5), ('p90', 0.9), ('p99', 0.99))
+# Interquartile ratios past the quartiles beyond which an amount is an anomaly
+FENCE = 1.5
+# A category needs this many amounts before it has a typical range
+MIN_SAMPLES = 8
+
+
+class QuantileSketch:
+    """Mergeable log-bucket sketch of positive amounts"""
+
+    __slots__ = ('buckets', 'zeros', 'count')
+
+    def __init__(self, data=None):
+        self.buckets = defaultdict(int)
+        self.zeros = 0
+        self.count = 0
+        if data:
+            self.zeros = data.get('zeros', 0)
+            for index, count in data.get('buckets', {}).items():
+                self.buckets[int(index)] += count
+            self.count = self.zeros + sum(self.buckets.values())
+
+    def add(self, amount, count=1):
+        if amount > MIN_AMOUNT:
+            self.buckets[math.ceil(math.log(amount) / _LOG_GAMMA)] += count
+        else:
+            self.zeros += count
+        self.count += count
+
+    def merge(self, other):
+        """Add the counts of another sketch (or stored sketch dict) to this one"""
+        if not isinstance(other, QuantileSketch):
+            other = QuantileSketch(other)
+        for index, count in other.buckets.items():
+            self.buckets[index] += count
+        self.zeros += other.zeros
+        self.count += other.count
+        return self
+
+    def scaled(self, factor):
+        """Get a sketch of every amount multiplied by factor (e.g. an exchange rate)"""
+        sketch = QuantileSketch()
+        sketch.zeros = self.zeros
+        sketch.count = self.zeros
+        for index, count in self.buckets.items():
+            sketch.add(_value(index) * factor, count)
+        return sketch
+
+    def quantiles(self, qs):
+        """Get the amounts at the given quantiles (0..1, ascending), or None when empty"""
+        if not self.count:
+            return [None] * len(qs)
+        values = []
+        ranks = iter(q * (self.count - 1) for q in qs)
+        rank = next(ranks)
+        seen = self.zeros
+        while rank is not None and seen > rank:
+            values.append(0.0)
+            rank = next(ranks, None)
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            while rank is not None and seen > rank:
+                values.append(_value(index))
+                rank = next(ranks, None)
+            if rank is None:
+                break
+        return values
+
+    def to_dict(self):
+        return {'zeros': self.zeros, 'buckets': {str(i): c for i, c in self.buckets.items()}}
+
+
+def _value(index):
+    """Amount a bucket stands for: the point within RELATIVE_ACCURACY of both bounds"""
+    return 2 * GAMMA ** index / (GAMMA + 1)
+
+
+def describe(sketch):
+    """Get the count, median, p90 and p99 of a sketch"""
+    values = sketch.quantiles([q for _, q in QUANTILES])
+    result = {'count': sketch.count}
+    result.update((name, value) for (name, _), value in zip(QUANTILES, values))
+    return result
+
+
+def merge_categories(summaries):
+    """Merge the category sketches of partition summaries into {category: sketch}"""
+    merged = defaultdict(QuantileSketch)
+    for summary in summaries:
+        for category, sketch in summary.get('sketches', {}).items():
+            merged[category].merge(sketch)
+    return merged
+
+
+def distribution(summaries):
+    """Get the overall and per-category median, p90 and p99 of partition summaries"""
+    categories = merge_categories(summaries)
+    overall = QuantileSketch()
+    for sketch in categories.values():
+        overall.merge(sketch)
+    return dict(describe(overall), categories={c: describe(s) for c, s in categories.items()})
+
+
+def fences(sketch):
+    """Get the (low, high) typical range of a sketch, or None with too few amounts"""
+    if sketch.count < MIN_SAMPLES:
+        return None
+    q1, median, q3 = sketch.quantiles([0.25, 0.5, 0.75])
+    if q1 <= MIN_AMOUNT:
+        return None
+    # Never narrower than a bucket, so equal amounts are not told apart
+    spread = max(q3 / q1, GAMMA) ** FENCE
+    return {'median': median, 'low': q1 / spread, 'high': q3 * spread}
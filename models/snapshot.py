@@ -0,0 +1,284 @@
+"""
+Memory-mapped binary partition snapshots
+
+A snapshot (``data/expenses/2026-09.snap``) holds the same rows as a partition's
+JSON file in fixed-width native columns: 16-byte IDs, day ordinals, amounts,
+category/payment method/wallet/currency codes, flags, timestamps and versions, followed
+by offset tables into string heaps for descriptions, notes, receipts and tags.
+A small JSON trailer holds the code table and the rare values that do not fit
+a column. Snapshots are opened with ``mmap``: opening one only parses the
+header and trailer, pages are read lazily and rows are decoded on access.
+
+The JSON partition stays the source of truth. A snapshot records the manifest
+revision it was built from and is ignored once the partition is rewritten.
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from .records import CODE_SLOTS, ExpenseRecord, RecordBlock, _MISSING, _intern, _pack_id, _pack_tags, _strings
+
+
+MAGIC = b'EXPSNAP1'
+FORMAT_VERSION = 2
+# magic, format version, row count, partition revision, trailer offset, trailer length
+HEADER = struct.Struct('<8sIIQQQ')
+TAG_SEPARATOR = '\x1f'
+
+# Null flags of the text columns
+DESCRIPTION_NULL = 1
+NOTES_NULL = 2
+RECEIPT_NULL = 4
+
+# Fixed-width columns in file order: (name, array typecode, values per row)
+COLUMNS = (
+    ('ids', 'B', 16),
+    ('dates', 'i', 1),
+    ('amounts', 'd', 1),
+    ('codes', 'I', len(CODE_SLOTS)),
+    ('recurring', 'b', 1),
+    ('created', 'q', 1),
+    ('versions', 'q', 1),
+    ('nulls', 'B', 1),
+)
+TEXT_COLUMNS = ('descriptions', 'notes', 'receipts', 'tags')
+
+
+def _pad(out):
+    """Align the next section to 8 bytes"""
+    out.extend(bytes(-len(out) % 8))
+
+
+def _text_column(values, null_flag, nulls, overrides, slot):
+    """Encode a text column as (offsets, heap); non-string values become overrides"""
+    offsets = array('I', [0])
+    heap = bytearray()
+    for index, value in enumerate(values):
+        if type(value) is str:
+            heap += value.encode('utf-8')
+        elif value is None and null_flag:
+            nulls[index] |= null_flag
+        else:
+            _override(overrides, index, slot, value)
+        offsets.append(len(heap))
+    return offsets, heap
+
+
+def _override(overrides, index, slot, value):
+    entry = overrides.setdefault(index, {})
+    if value is _MISSING:
+        entry.setdefault('missing', []).append(slot)
+    else:
+        entry.setdefault('set', {})[slot] = value
+
+
+def write_snapshot(path, block, rev):
+    """Write a record block as a snapshot of the given partition revision"""
+    if not isinstance(block, RecordBlock):
+        block = RecordBlock(block)
+    rows = len(block)
+
+    # Translate the process-wide string codes into a table local to the file
+    local_strings = [None]
+    local_codes = {0: 0}
+    codes = array('I')
+    for code in block._codes:
+        local = local_codes.get(code)
+        if local is None:
+            local = local_codes[code] = len(local_strings)
+            local_strings.append(_strings[code])
+        codes.append(local)
+
+    overrides = {}
+    for index, override in block._overrides.items():
+        for slot, value in override.items():
+            _override(overrides, index, slot, value)
+
+    nulls = array('B', bytes(rows))
+    tags = []
+    for index, value in enumerate(block._tags):
+        if type(value) is tuple and not (len(value) == 1 and value[0] == '') and \
+                not any(TAG_SEPARATOR in tag for tag in value):
+            tags.append(TAG_SEPARATOR.join(value))
+        else:
+            tags.append(_MISSING if value is _MISSING else list(value) if type(value) is tuple else value)
+    text = [
+        _text_column(block._descriptions, DESCRIPTION_NULL, nulls, overrides, 'description'),
+        _text_column(block._notes, NOTES_NULL, nulls, overrides, 'notes'),
+        _text_column(block._receipts, RECEIPT_NULL, nulls, overrides, 'receipt'),
+        _text_column(tags, 0, nulls, overrides, '_tags'),
+    ]
+
+    columns = {
+        'ids': block._ids,
+        'dates': block._dates,
+        'amounts': block._amounts,
+        'codes': codes,
+        'recurring': block._recurring,
+        'created': block._created,
+        'versions': block._versions,
+        'nulls': nulls,
+    }
+    out = bytearray(HEADER.size)
+    _pad(out)
+    sections = {}
+    for name, _, _ in COLUMNS:
+        data = columns[name]
+        sections[name] = len(out)
+        out += data if isinstance(data, (bytes, bytearray)) else data.tobytes()
+        _pad(out)
+    for name, (offsets, heap) in zip(TEXT_COLUMNS, text):
+        sections[f"{name}_offsets"] = len(out)
+        out += offsets.tobytes()
+        _pad(out)
+        sections[f"{name}_heap"] = len(out)
+        out += heap
+        _pad(out)
+
+    trailer = json.dumps({
+        'byteorder': sys.byteorder,
+        'sections': sections,
+        'strings': local_strings,
+        'overrides': overrides
+    }).encode('utf-8')
+    trailer_offset = len(out)
+    out += trailer
+    out[:HEADER.size] = HEADER.pack(MAGIC, FORMAT_VERSION, rows, rev, trailer_offset, len(trailer))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(out)
+    os.replace(tmp_path, path)
+
+
+def open_snapshot(path, rev):
+    """Map a snapshot; None when it is missing, unreadable or not of this revision"""
+    try:
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        magic, version, rows, snapshot_rev, trailer_offset, trailer_length = HEADER.unpack_from(mm)
+        if magic != MAGIC or version != FORMAT_VERSION or snapshot_rev != rev:
+            mm.close()
+            return None
+        trailer = json.loads(mm[trailer_offset:trailer_offset + trailer_length])
+        if trailer['byteorder'] != sys.byteorder:
+            mm.close()
+            return None
+        return SnapshotBlock(mm, rows, trailer)
+    except (struct.error, ValueError, KeyError):
+        mm.close()
+        return None
+
+
+class SnapshotBlock:
+    """Read-only record block backed by a mapped snapshot"""
+
+    __slots__ = (
+        '_mm', '_rows', '_ids_start', '_dates', '_amounts', '_codes', '_recurring',
+        '_created', '_versions', '_nulls', '_text', '_strings', '_overrides'
+    )
+
+    def __init__(self, mm, rows, trailer):
+        self._mm = mm
+        self._rows = rows
+        sections = trailer['sections']
+        view = memoryview(mm)
+
+        def column(name, typecode, width):
+            start = sections[name]
+            size = array(typecode).itemsize * width * rows
+            return view[start:start + size].cast(typecode)
+
+        self._ids_start = sections['ids']
+        self._dates = column('dates', 'i', 1)
+        self._amounts = column('amounts', 'd', 1)
+        self._codes = column('codes', 'I', len(CODE_SLOTS))
+        self._recurring = column('recurring', 'b', 1)
+        self._created = column('created', 'q', 1)
+        self._versions = column('versions', 'q', 1)
+        self._nulls = column('nulls', 'B', 1)
+        # Offset tables hold rows + 1 entries
+        self._text = tuple(
+            (view[sections[f"{name}_offsets"]:sections[f"{name}_offsets"] + 4 * (rows + 1)].cast('I'),
+             sections[f"{name}_heap"])
+            for name in TEXT_COLUMNS
+        )
+        self._strings = [_intern(s) for s in trailer['strings']]
+        self._overrides = {int(k): v for k, v in trailer['overrides'].items()}
+
+    def _string(self, column, index):
+        offsets, heap = self._text[column]
+        return self._mm[heap + offsets[index]:heap + offsets[index + 1]].decode('utf-8')
+
+    def __len__(self):
+        return self._rows
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._rows
+        if not 0 <= index < self._rows:
+            raise IndexError('snapshot row out of range')
+        start = self._ids_start + index * 16
+        nulls = self._nulls[index]
+        codes = self._codes
+        record = ExpenseRecord.__new__(ExpenseRecord)
+        record._id = self._mm[start:start + 16]
+        record._date = self._dates[index]
+        record.amount = self._amounts[index]
+        base = index * len(CODE_SLOTS)
+        record.category = self._strings[codes[base]]
+        record.payment_method = self._strings[codes[base + 1]]
+        record.wallet = self._strings[codes[base + 2]]
+        record.currency = self._strings[codes[base + 3]] if codes[base + 3] else _MISSING
+        record.description = None if nulls & DESCRIPTION_NULL else self._string(0, index)
+        record.notes = None if nulls & NOTES_NULL else self._string(1, index)
+        record.receipt = None if nulls & RECEIPT_NULL else self._string(2, index)
+        tags = self._string(3, index)
+        record._tags = tuple(_intern(t) for t in tags.split(TAG_SEPARATOR)) if tags else ()
+        record.recurring = bool(self._recurring[index])
+        record._created_at = self._created[index]
+        record.version = self._versions[index] or _MISSING
+        record.extra = None
+        override = self._overrides.get(index)
+        if override:
+            for slot, value in override.get('set', {}).items():
+                setattr(record, slot, _pack_tags(value) if slot == '_tags' else value)
+            for slot in override.get('missing', ()):
+                setattr(record, slot, _MISSING)
+        return record
+
+    def __iter__(self):
+        for index in range(self._rows):
+            yield self[index]
+
+    def extended(self, records):
+        """Get a new in-memory block with records appended"""
+        return RecordBlock(list(self) + list(records))
+
+    def max_version(self):
+        """Highest change sequence number in the block"""
+        return max(self._versions, default=0)
+
+    def find(self, expense_id):
+        """Get the row index of an expense ID, or None"""
+        packed = _pack_id(expense_id)
+        if isinstance(packed, bytes) and len(packed) == 16:
+            start = self._ids_start
+            end = start + self._rows * 16
+            while True:
+                pos = self._mm.find(packed, start, end)
+                if pos < 0:
+                    break
+                if (pos - self._ids_start) % 16 == 0:
+                    return (pos - self._ids_start) // 16
+                start = pos + 1
+        for index, override in self._overrides.items():
+            if override.get('set', {}).get('_id', _MISSING) == packed:
+                return index
+        return None
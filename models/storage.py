@@ -0,0 +1,548 @@
+"""
+Pluggable storage backends
+
+Every entry point (app_new.py, asgi.py, app.py, app_vercel.py) stores its
+ledger through one ``PartitionedLedger``: month partitions, manifest summaries,
+the change sequence and the record caches are shared, and a backend only
+decides where they are persisted.
+
+    json     one JSON file (+ binary snapshot) per month, the default
+    memory   nothing persisted; for serverless deployments and tests
+    journal  in memory, replayed from an append-only JSON-lines log
+    sqlite   one SQLite database file per ledger
+
+Every backend normalises rows written by older schemas on the way in (see
+``normalize_expense``). Select a backend with ``EXPENSE_TRACKER_STORAGE``.
+"""
+
+import copy
+import json
+import os
+import sqlite3
+from collections import defaultdict
+from .partitions import (
+    MANIFEST_VERSION, PartitionedLedger, PartitionedStore, TOMBSTONE_RETENTION_DAYS, fsync_path, month_key,
+    summarize
+)
+from .records import RecordBlock, normalize_expense
+from utils.metrics import span
+
+
+BACKENDS = ('json', 'memory', 'journal', 'sqlite')
+DEFAULT_BACKEND = 'json'
+JOURNAL_NAME = 'journal.jsonl'
+SQLITE_NAME = 'expenses.db'
+
+
+def open_backend(kind, directory):
+    """Open the ledger of a data directory with a storage backend"""
+    legacy_file = os.path.join(directory, 'expenses.json')
+    if kind == 'json':
+        return PartitionedStore(
+            os.path.join(directory, 'expenses'), legacy_file=legacy_file, documents_dir=directory
+        )
+    if kind == 'memory':
+        return MemoryStore()
+    if kind == 'journal':
+        return JournalStore(os.path.join(directory, JOURNAL_NAME), legacy_file=legacy_file)
+    if kind == 'sqlite':
+        return SQLiteStore(os.path.join(directory, SQLITE_NAME), legacy_file=legacy_file)
+    raise ValueError(f"Unknown storage backend: {kind} (expected one of {', '.join(BACKENDS)})")
+
+
+def _group_by_month(expenses):
+    """Normalise rows and group them into {month: [expense]}, keeping their order"""
+    groups = defaultdict(list)
+    for i, expense in enumerate(expenses):
+        expense = normalize_expense(expense, i)
+        groups[month_key(expense.get('date'))].append(expense)
+    return groups
+
+
+def _load_legacy(legacy_file):
+    """Read a single-file ledger to import, or None"""
+    if not legacy_file or not os.path.exists(legacy_file):
+        return None
+    with open(legacy_file, 'r') as f:
+        return json.load(f)
+
+
+# ===== MEMORY =====
+
+class MemoryStore(PartitionedLedger):
+    """Ledger kept entirely in memory"""
+
+    persistent = False
+
+    def __init__(self, expenses=(), documents=None, tombstone_retention_days=TOMBSTONE_RETENTION_DAYS):
+        super().__init__(tombstone_retention_days)
+        self._load(expenses, documents or {}, [], {})
+
+    def _load(self, expenses, documents, tombstones, previous, revisions=()):
+        """Reset the ledger to the given rows, documents, tombstones and revision log"""
+        self._blocks = {
+            month: RecordBlock.from_dicts(rows) for month, rows in _group_by_month(expenses).items()
+        }
+        self._documents = documents
+        self._tombstones = tombstones
+        self._revision_log = list(revisions)
+        self._revisions = None
+        self._cache.clear()
+        self._manifest = self._new_manifest(self._blocks, previous)
+
+    def _open(self):
+        return self._manifest
+
+    def _discard(self):
+        # Nothing was persisted but the stored blocks: summarise them again
+        self._cache.clear()
+        self._manifest = self._new_manifest(self._blocks, self._manifest)
+
+    def _read_partition(self, month, rev):
+        return self._blocks.get(month, RecordBlock())
+
+    def _store_partition(self, month, block, rev):
+        self._blocks[month] = block
+
+    def _drop_partition(self, month):
+        self._blocks.pop(month, None)
+
+    def _save_manifest(self, manifest):
+        pass
+
+    def _load_tombstones(self):
+        return self._tombstones
+
+    def _save_tombstones(self, tombstones):
+        self._tombstones = tombstones
+
+    def _load_revisions(self):
+        return self._revision_log
+
+    def _append_revisions(self, entries):
+        self._revision_log.extend(entries)
+
+    def load_document(self, name):
+        with self._lock:
+            # Copies, so callers can edit what they load before saving it
+            return copy.deepcopy(self._documents.get(name))
+
+    def save_document(self, name, data):
+        with self._lock:
+            self._documents[name] = copy.deepcopy(data)
+
+    def delete_document(self, name):
+        with self._lock:
+            self._documents.pop(name, None)
+
+    def document_names(self):
+        with self._lock:
+            self._open()
+            return sorted(self._documents)
+
+
+# ===== JOURNAL =====
+
+class JournalStore(MemoryStore):
+    """
+    In-memory ledger made durable by an append-only JSON-lines journal
+    Every write appends one small entry instead of rewriting a partition.
+    Opening the ledger replays the journal; ``compact()`` rewrites it as one
+    entry per live row. A journal belongs to a single process.
+    """
+
+    persistent = True
+
+    def __init__(self, path, legacy_file=None, tombstone_retention_days=TOMBSTONE_RETENTION_DAYS):
+        super().__init__(tombstone_retention_days=tombstone_retention_days)
+        self.path = path
+        self.legacy_file = legacy_file
+        self._file = None
+        self._replayed = False
+
+    def _replay(self):
+        """Rebuild the in-memory ledger from the journal, importing the legacy ledger first"""
+        rows = {}
+        tombstones = []
+        documents = {}
+        revisions = []
+        meta = {'seq': 0, 'tombstone_floor': 0}
+
+        if os.path.exists(self.path):
+            with span('file.read'), open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A write torn by a crash can only be the last line
+                        break
+                    op = entry.get('op')
+                    if op == 'put':
+                        row = entry['row']
+                        previous = rows.get(row.get('id'))
+                        if previous is not None and month_key(previous.get('date')) != month_key(row.get('date')):
+                            # Rows moved to another month go to its end
+                            del rows[row['id']]
+                        rows[row.get('id')] = row
+                    elif op == 'delete':
+                        rows.pop(entry['id'], None)
+                        meta['tombstone_floor'] = max(meta['tombstone_floor'], entry.get('floor', 0))
+                        tombstones.append({k: entry[k] for k in ('id', 'version', 'deleted_at')})
+                    elif op == 'document':
+                        documents[entry['name']] = entry['data']
+                    elif op == 'drop_document':
+                        documents.pop(entry['name'], None)
+                    elif op == 'revision':
+                        revisions.append(entry['entry'])
+                    elif op == 'meta':
+                        meta['seq'] = max(meta['seq'], entry.get('seq', 0))
+                        meta['tombstone_floor'] = max(meta['tombstone_floor'], entry.get('tombstone_floor', 0))
+                    seq = entry.get('version') or entry.get('row', {}).get('version') or 0
+                    meta['seq'] = max(meta['seq'], seq)
+        else:
+            legacy = _load_legacy(self.legacy_file)
+            if legacy is not None:
+                self._load(legacy, documents, tombstones, meta)
+                self._replayed = True
+                self.compact()
+                os.replace(self.legacy_file, f"{self.legacy_file}.bak")
+                return
+
+        tombstones = [t for t in tombstones if t['version'] > meta['tombstone_floor']]
+        self._load(list(rows.values()), documents, tombstones, meta, revisions)
+        self._replayed = True
+
+    def _open(self):
+        if not self._replayed:
+            self._replay()
+        return self._manifest
+
+    def _discard(self):
+        # The journal holds every write that was appended
+        self._cache.clear()
+        self._replayed = False
+
+    def _savepoint(self):
+        # Every append is flushed, so the file size is the journal's end
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def _rollback(self, position):
+        # Entries appended by the undone writes
+        if os.path.exists(self.path) and os.path.getsize(self.path) > position:
+            os.truncate(self.path, position)
+
+    def sync(self):
+        with self._lock:
+            if self._file is not None:
+                with span('file.sync'):
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+
+    def _append(self, entry):
+        """Append one entry to the journal"""
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._file = open(self.path, 'a')
+        with span('file.write'):
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+
+    # ===== MUTATIONS =====
+
+    def add(self, expense):
+        with self._lock:
+            super().add(expense)
+            self._append({'op': 'put', 'row': expense})
+
+    def add_many(self, expenses):
+        with self._lock:
+            super().add_many(expenses)
+            for expense in expenses:
+                self._append({'op': 'put', 'row': expense})
+
+    def update(self, expense_id, updated_data):
+        with self._lock:
+            expense = super().update(expense_id, updated_data)
+            if expense is not None:
+                self._append({'op': 'put', 'row': expense})
+            return expense
+
+    def _add_tombstone(self, expense_id, version):
+        super()._add_tombstone(expense_id, version)
+        tombstone = self._tombstones[-1]
+        self._append(dict(tombstone, op='delete', floor=self._manifest.get('tombstone_floor', 0)))
+
+    def replace_all(self, expenses):
+        with self._lock:
+            super().replace_all(expenses)
+            self.compact()
+
+    def _append_revisions(self, entries):
+        super()._append_revisions(entries)
+        for entry in entries:
+            self._append({'op': 'revision', 'entry': entry})
+
+    def save_document(self, name, data):
+        with self._lock:
+            self._open()
+            super().save_document(name, data)
+            self._append({'op': 'document', 'name': name, 'data': data})
+
+    def delete_document(self, name):
+        with self._lock:
+            self._open()
+            if name in self._documents:
+                super().delete_document(name)
+                self._append({'op': 'drop_document', 'name': name})
+
+    def load_document(self, name):
+        with self._lock:
+            self._open()
+            return super().load_document(name)
+
+    def compact(self):
+        """Rewrite the journal as one entry per live row, tombstone, document and revision"""
+        with self._lock:
+            manifest = self._open()
+            tmp_path = f"{self.path}.tmp"
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with span('file.write'), open(tmp_path, 'w') as f:
+                meta = {'op': 'meta', 'seq': manifest.get('seq', 0),
+                        'tombstone_floor': manifest.get('tombstone_floor', 0)}
+                f.write(json.dumps(meta) + '\n')
+                # Tombstones go first: an ID deleted and written again is live
+                for tombstone in self._tombstones:
+                    f.write(json.dumps(dict(tombstone, op='delete')) + '\n')
+                for month in self.months():
+                    for record in self._partition(month):
+                        f.write(json.dumps({'op': 'put', 'row': record.to_dict()}) + '\n')
+                for name, data in self._documents.items():
+                    f.write(json.dumps({'op': 'document', 'name': name, 'data': data}) + '\n')
+                for entry in self._revision_log:
+                    f.write(json.dumps({'op': 'revision', 'entry': entry}) + '\n')
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            os.replace(tmp_path, self.path)
+            return [self.path]
+
+
+# ===== SQLITE =====
+
+class SQLiteStore(PartitionedLedger):
+    """
+    Ledger stored in one SQLite database
+    Rows are kept per month in insertion order, so partitions are read with
+    one indexed query; the manifest summaries are stored alongside them.
+    Changes committed by other processes are noticed through ``data_version``.
+    """
+
+    supports_sql = True
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS expenses (
+            month TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            id TEXT,
+            date TEXT,
+            category TEXT,
+            amount REAL,
+            version INTEGER,
+            data TEXT NOT NULL,
+            PRIMARY KEY (month, position)
+        );
+        CREATE INDEX IF NOT EXISTS expenses_id ON expenses (id);
+        CREATE TABLE IF NOT EXISTS partitions (month TEXT PRIMARY KEY, summary TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS tombstones (id TEXT, version INTEGER, deleted_at TEXT);
+        CREATE TABLE IF NOT EXISTS documents (name TEXT PRIMARY KEY, data TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS revisions (position INTEGER PRIMARY KEY, data TEXT NOT NULL);
+    '''
+
+    def __init__(self, path, legacy_file=None, tombstone_retention_days=TOMBSTONE_RETENTION_DAYS):
+        super().__init__(tombstone_retention_days)
+        self.path = path
+        self.legacy_file = legacy_file
+        self._db = None
+        self._data_version = None
+
+    def _connect(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            # Commits are made durable by sync(), not one fsync each
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.executescript(self.SCHEMA)
+            self._db = db
+        return self._db
+
+    def _open(self):
+        """Load the manifest, importing the legacy ledger into an empty database"""
+        db = self._connect()
+        data_version = db.execute('PRAGMA data_version').fetchone()[0]
+        if self._manifest is not None and data_version == self._data_version:
+            return self._manifest
+
+        meta = dict(db.execute('SELECT key, value FROM meta'))
+        if 'version' not in meta:
+            self._import(db)
+            meta = dict(db.execute('SELECT key, value FROM meta'))
+
+        manifest = {
+            'version': int(meta['version']),
+            'seq': int(meta.get('seq', 0)),
+            'tombstone_floor': int(meta.get('tombstone_floor', 0)),
+            'partitions': {month: json.loads(summary) for month, summary in db.execute(
+                'SELECT month, summary FROM partitions')}
+        }
+        if manifest['version'] != MANIFEST_VERSION:
+            # Summaries written by an older version lack fields added since
+            for month, summary in manifest['partitions'].items():
+                manifest['partitions'][month] = dict(
+                    summarize(self._read_partition(month, summary['rev'])), rev=summary['rev'])
+            manifest['version'] = MANIFEST_VERSION
+            with db:
+                self._write_manifest(db, manifest)
+        self._drop_stale(manifest)
+        self._manifest = manifest
+        self._tombstones = None
+        self._data_version = data_version
+        return manifest
+
+    def _import(self, db):
+        """Initialise an empty database, importing the legacy single-file ledger"""
+        legacy = _load_legacy(self.legacy_file)
+        groups = _group_by_month(legacy or [])
+        manifest = self._new_manifest(groups)
+        with db:
+            for month, expenses in groups.items():
+                self._insert_rows(db, month, expenses)
+            self._write_manifest(db, manifest)
+        if legacy is not None:
+            os.replace(self.legacy_file, f"{self.legacy_file}.bak")
+
+    def _insert_rows(self, db, month, expenses):
+        db.executemany(
+            'INSERT INTO expenses (month, position, id, date, category, amount, version, data) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            ((month, i, e.get('id'), e.get('date'), e.get('category'), e.get('amount'),
+              e.get('version'), json.dumps(e)) for i, e in enumerate(expenses))
+        )
+
+    def _write_manifest(self, db, manifest):
+        db.execute('DELETE FROM partitions')
+        db.executemany('INSERT INTO partitions (month, summary) VALUES (?, ?)', (
+            (month, json.dumps(summary)) for month, summary in manifest['partitions'].items()))
+        db.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (
+            (key, str(manifest.get(key, 0))) for key in ('version', 'seq', 'tombstone_floor')))
+
+    def _save_manifest(self, manifest):
+        # Commits the partition and tombstone writes of the same mutation too
+        db = self._connect()
+        with span('file.write'), db:
+            self._write_manifest(db, manifest)
+        self._data_version = db.execute('PRAGMA data_version').fetchone()[0]
+
+    def _discard(self):
+        super()._discard()
+        if self._db is not None:
+            self._db.rollback()
+        self._data_version = None
+
+    def sync(self):
+        # Committed transactions are in the write-ahead log; checkpoints sync what they copy out
+        with self._lock, span('file.sync'):
+            fsync_path(f"{self.path}-wal")
+
+    # ===== PARTITIONS =====
+
+    def _read_partition(self, month, rev):
+        with span('file.read'):
+            rows = self._connect().execute(
+                'SELECT data FROM expenses WHERE month = ? ORDER BY position', (month,)).fetchall()
+        return RecordBlock.from_dicts(
+            normalize_expense(json.loads(data), f"{month}:{i}") for i, (data,) in enumerate(rows)
+        )
+
+    def _store_partition(self, month, block, rev):
+        db = self._connect()
+        with span('file.write'):
+            db.execute('DELETE FROM expenses WHERE month = ?', (month,))
+            self._insert_rows(db, month, [r.to_dict() for r in block])
+
+    def _drop_partition(self, month):
+        self._connect().execute('DELETE FROM expenses WHERE month = ?', (month,))
+
+    def _locate(self, expense_id):
+        """Find the partition of an expense through the ID index"""
+        row = self._connect().execute(
+            'SELECT month FROM expenses WHERE id = ? LIMIT 1', (expense_id,)).fetchone()
+        if row is None or row[0] not in self._open()['partitions']:
+            return super()._locate(expense_id)
+        i = self._partition(row[0]).find(expense_id)
+        return (row[0], i) if i is not None else super()._locate(expense_id)
+
+    def execute(self, sql, params=()):
+        """Run a read-only query against the ledger tables (SQL pushdown)"""
+        with self._lock:
+            self._open()
+            return self._connect().execute(sql, params).fetchall()
+
+    def compact(self):
+        """Reclaim the space of deleted rows; returns the database path"""
+        with self._lock:
+            self._connect().execute('VACUUM')
+            return [self.path]
+
+    # ===== TOMBSTONES =====
+
+    def _load_tombstones(self):
+        if self._tombstones is None:
+            self._tombstones = [
+                {'id': i, 'version': v, 'deleted_at': d} for i, v, d in self._connect().execute(
+                    'SELECT id, version, deleted_at FROM tombstones ORDER BY version')
+            ]
+        return self._tombstones
+
+    def _save_tombstones(self, tombstones):
+        db = self._connect()
+        db.execute('DELETE FROM tombstones')
+        db.executemany('INSERT INTO tombstones (id, version, deleted_at) VALUES (?, ?, ?)', (
+            (t['id'], t['version'], t['deleted_at']) for t in tombstones))
+        self._tombstones = tombstones
+
+    # ===== REVISIONS =====
+
+    def _load_revisions(self):
+        with span('file.read'):
+            return [json.loads(data) for data, in self._connect().execute(
+                'SELECT data FROM revisions ORDER BY position')]
+
+    def _append_revisions(self, entries):
+        # Committed with the manifest
+        self._connect().executemany(
+            'INSERT INTO revisions (data) VALUES (?)', ((json.dumps(entry),) for entry in entries))
+
+    # ===== DOCUMENTS =====
+
+    def load_document(self, name):
+        with self._lock:
+            row = self._connect().execute('SELECT data FROM documents WHERE name = ?', (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_document(self, name, data):
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute('INSERT OR REPLACE INTO documents (name, data) VALUES (?, ?)', (name, json.dumps(data)))
+
+    def delete_document(self, name):
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute('DELETE FROM documents WHERE name = ?', (name,))
+
+    def document_names(self):
+        with self._lock:
+            return [name for name, in self._connect().execute('SELECT name FROM documents ORDER BY name')]
@@ -0,0 +1,200 @@
+"""
+Tenant-scoped ledgers
+
+Every tenant gets its own data directory with the same layout as the default
+``data/`` directory (expense ledger, settings, budgets) in the configured
+storage backend. Open tenant stores
+are kept in a bounded LRU so one process can serve thousands of small ledgers:
+cold tenants are evicted and reopened from disk on their next request.
+"""
+
+import contextvars
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from .backups import BACKUP_DIR_NAME, LedgerBackups, scheduler
+from .budgets import BudgetAlerts
+from .commits import GroupCommitter
+from .duplicates import DuplicateIndex
+from .events import ChangeFeed
+from .forecast import SpendingForecaster
+from .fx import RATES_NAME, CurrencyConverter, FXRates
+from .history import BudgetHistory
+from .revisions import RevisionHistory
+from .rules import RuleEngine
+from .storage import DEFAULT_BACKEND, open_backend
+from .timeseries import SpendingSeries
+from .wallets import WalletBalances
+
+
+TENANT_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+TOKENS_NAME = 'tokens.json'
+
+# Tenant of the request being handled; None is the default single-user ledger
+current_tenant = contextvars.ContextVar('current_tenant', default=None)
+
+
+class TenantError(Exception):
+    """Raised when a request names an unknown or invalid tenant"""
+
+
+def validate_tenant_id(tenant_id):
+    """Validate that a tenant ID is safe to use as a directory name"""
+    return isinstance(tenant_id, str) and bool(TENANT_ID_PATTERN.match(tenant_id))
+
+
+class TenantStore:
+    """
+    Open ledger of one tenant's data directory
+    Holds the ledger (``expenses``) with everything built on it: write
+    batching, backups, the change feed and the derived indexes.
+    """
+
+    def __init__(self, directory, backend=DEFAULT_BACKEND, rates=None):
+        self.directory = directory
+        self.recurring_file = os.path.join(directory, 'recurring.json')
+        # Expenses plus the settings and budgets documents
+        self.expenses = open_backend(backend, directory)
+        self.commits = GroupCommitter(self.expenses)
+        # Exchange rates are shared by every tenant, so restoring a ledger leaves them alone
+        self.backups = LedgerBackups(self.expenses, os.path.join(directory, BACKUP_DIR_NAME),
+                                     exclude=(os.path.splitext(RATES_NAME)[0],))
+        scheduler.add(self.backups)
+        self.revisions = RevisionHistory(self.expenses)
+        self.feed = ChangeFeed()
+        # Summaries in the reporting currency; exchange rates are shared by every tenant
+        self.fx = CurrencyConverter(self.expenses, rates or FXRates(os.path.join(directory, RATES_NAME)))
+        self.alerts = BudgetAlerts(self.expenses, self.feed, self.fx.summaries)
+        self.history = BudgetHistory(self.expenses, self.fx)
+        self.wallets = WalletBalances(self.expenses, self.fx)
+        self.duplicates = DuplicateIndex(self.expenses)
+        self.rules = RuleEngine(self.expenses)
+        self.series = SpendingSeries(self.expenses, self.fx.summaries)
+        self.forecasts = SpendingForecaster(self.expenses, self.fx.summaries)
+        # Requests using the store; pinned stores are never evicted (see TenantRegistry.acquire)
+        self.pins = 0
+
+
+class TenantRegistry:
+    """Bounded LRU of open tenant stores"""
+
+    def __init__(self, data_dir, capacity=256, backend=DEFAULT_BACKEND):
+        self.data_dir = data_dir
+        self.backend = backend
+        self.tenants_dir = os.path.join(data_dir, 'tenants')
+        self.rates = FXRates(os.path.join(data_dir, RATES_NAME))
+        self.capacity = capacity
+        self._default = None
+        self._stores = OrderedDict()
+        self._lock = threading.Lock()
+        self._tokens = None
+        self._tokens_mtime = None
+
+    def get(self, tenant_id=None):
+        """Get the store of a tenant, opening it if it is not cached"""
+        if tenant_id is None:
+            if self._default is None:
+                # Opened once, even when the first requests arrive together
+                with self._lock:
+                    if self._default is None:
+                        self._default = TenantStore(self.data_dir, self.backend, self.rates)
+            return self._default
+
+        if not validate_tenant_id(tenant_id):
+            raise TenantError(f"Invalid tenant: {tenant_id}")
+
+        with self._lock:
+            store = self._stores.get(tenant_id)
+            if store is not None:
+                self._stores.move_to_end(tenant_id)
+                return store
+
+            store = TenantStore(os.path.join(self.tenants_dir, tenant_id), self.backend, self.rates)
+            self._stores[tenant_id] = store
+            self._evict_idle()
+            return store
+
+    def acquire(self, tenant_id=None):
+        """
+        Get the store of a tenant and pin it until release(), so it is not
+        evicted (and reopened as a second ledger on the same directory) while
+        a request still writes through it
+        """
+        store = self.get(tenant_id)
+        with self._lock:
+            store.pins += 1
+        return store
+
+    def release(self, store):
+        """Unpin a store taken with acquire()"""
+        with self._lock:
+            store.pins -= 1
+            self._evict_idle()
+
+    @staticmethod
+    def _idle(store):
+        # In-memory ledgers would be lost
+        return store.expenses.persistent and store.pins == 0 and store.feed.subscriber_count() == 0
+
+    def _evict_idle(self):
+        """Evict least recently used tenants, keeping those in use or with live subscribers"""
+        excess = len(self._stores) - self.capacity
+        # The most recently used store was just handed out
+        for tenant_id in list(self._stores)[:-1]:
+            if excess <= 0:
+                break
+            if self._idle(self._stores[tenant_id]):
+                del self._stores[tenant_id]
+                excess -= 1
+
+    def cached(self):
+        """List cached tenant IDs, least recently used first"""
+        with self._lock:
+            return list(self._stores)
+
+    def evict(self, tenant_id):
+        """Drop a tenant store from memory unless it is in use; returns whether it was dropped"""
+        with self._lock:
+            store = self._stores.get(tenant_id)
+            if store is None or store.pins or store.feed.subscriber_count():
+                return False
+            del self._stores[tenant_id]
+            return True
+
+    # ===== TOKENS =====
+
+    def _load_tokens(self):
+        """Load the token -> tenant map, re-reading it when the file changes"""
+        path = os.path.join(self.tenants_dir, TOKENS_NAME)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        if mtime != self._tokens_mtime:
+            with open(path, 'r') as f:
+                self._tokens = json.load(f)
+            self._tokens_mtime = mtime
+        return self._tokens
+
+    def resolve(self, headers, trust_header=False):
+        """
+        Resolve the tenant of a request from its headers
+        A bearer token listed in tenants/tokens.json wins; the X-Tenant-ID
+        header is only honoured behind a trusted authenticating proxy.
+        Returns None for the default ledger.
+        """
+        auth = headers.get('Authorization', '')
+        if auth.startswith('Bearer '):
+            tenant_id = self._load_tokens().get(auth[7:].strip())
+            if tenant_id is None:
+                raise TenantError("Unknown access token")
+            return tenant_id
+
+        tenant_id = headers.get('X-Tenant-ID')
+        if tenant_id and trust_header:
+            if not validate_tenant_id(tenant_id):
+                raise TenantError(f"Invalid tenant: {tenant_id}")
+            return tenant_id
+        return None
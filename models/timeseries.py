@@ -0,0 +1,175 @@
+"""
+Spending time series at day, week, month and year granularity
+
+Series are read from a hierarchy of buckets built on the manifest summaries
+(in the reporting currency, see ``fx.py``): every month keeps a dense array of
+its daily totals (overall and per category, from ``days`` and
+``category_days``) and their sum, and a year is the sum of its months. A
+range reads whole months and years from their sums and only the months it
+cuts through day by day, so a five-year series by month costs about sixty
+additions. Week buckets (starting on Monday) are summed from the days.
+
+Every bucket in the range is returned, empty ones as zero, clipped to the
+range at both ends. ``granularity='auto'`` picks the finest granularity that
+fits in ``MAX_POINTS`` buckets.
+"""
+
+import calendar
+import threading
+from array import array
+from datetime import date, timedelta
+
+
+GRANULARITIES = ('day', 'week', 'month', 'year')
+# Most buckets 'auto' returns: a quarter by day, two years by week, eight years by month
+MAX_POINTS = 100
+
+
+def _month_key(day):
+    return day.strftime('%Y-%m')
+
+
+class MonthBuckets:
+    """Dense daily totals of one month, overall (None) and per category, with their sums"""
+
+    __slots__ = ('days', 'totals')
+
+    def __init__(self, month, summary):
+        size = calendar.monthrange(int(month[:4]), int(month[5:7]))[1]
+        self.days = {}
+        self.totals = {}
+        series = {None: summary.get('days', {})}
+        series.update(summary.get('category_days', {}))
+        for key, amounts in series.items():
+            days = array('d', bytes(8 * size))
+            for day, amount in amounts.items():
+                days[int(day[8:10]) - 1] += amount
+            self.days[key] = days
+            self.totals[key] = sum(days)
+
+
+def bucket_count(start, end, granularity):
+    """Number of buckets of a granularity between two dates"""
+    if granularity == 'day':
+        return (end - start).days + 1
+    if granularity == 'week':
+        return (end - timedelta(days=end.weekday()) - (start - timedelta(days=start.weekday()))).days // 7 + 1
+    if granularity == 'month':
+        return (end.year - start.year) * 12 + end.month - start.month + 1
+    return end.year - start.year + 1
+
+
+def pick_granularity(start, end):
+    """Finest granularity with at most MAX_POINTS buckets between two dates"""
+    for granularity in GRANULARITIES[:-1]:
+        if bucket_count(start, end, granularity) <= MAX_POINTS:
+            return granularity
+    return 'year'
+
+
+class SpendingSeries:
+    """Cached bucket hierarchy of one ledger"""
+
+    def __init__(self, ledger, summaries=None):
+        self.ledger = ledger
+        # Summaries in the reporting currency (see fx.py)
+        self.summaries = summaries or ledger.summaries
+        self._lock = threading.Lock()
+        # month -> (summary it was built from, MonthBuckets)
+        self._months = {}
+
+    def _buckets(self, summaries):
+        """Get {month: MonthBuckets}, rebuilding the months whose summary changed"""
+        with self._lock:
+            cache = self._months
+            for month in set(cache) - set(summaries):
+                del cache[month]
+            for month, summary in summaries.items():
+                entry = cache.get(month)
+                if entry is None or entry[0] is not summary:
+                    if not summary.get('first'):
+                        continue
+                    cache[month] = (summary, MonthBuckets(month, summary))
+            return {month: entry[1] for month, entry in cache.items()}
+
+    def series(self, start=None, end=None, granularity='auto', category=None):
+        """
+        Get the spending between two dates (ISO; default the first expense and
+        today) as {'granularity', 'from', 'to', 'labels', 'data'}
+        """
+        summaries = self.summaries()
+        months = self._buckets(summaries)
+        end = date.fromisoformat(end) if end else date.today()
+        if start:
+            start = date.fromisoformat(start)
+        else:
+            first = min((s['first'] for s in summaries.values() if s.get('first')), default=None)
+            start = min(date.fromisoformat(first), end) if first else end.replace(day=1)
+        if granularity == 'auto':
+            granularity = pick_granularity(start, end)
+
+        def days(month):
+            """Daily totals of a month for the series, or None when it has none"""
+            buckets = months.get(month)
+            return buckets.days.get(category) if buckets is not None else None
+
+        def span_total(first, last):
+            """Total between two dates in one month; whole months use their sum"""
+            buckets = months.get(_month_key(first))
+            if buckets is None or category not in buckets.totals:
+                return 0.0
+            if first.day == 1 and (last + timedelta(days=1)).day == 1:
+                return buckets.totals[category]
+            return sum(buckets.days[category][first.day - 1:last.day])
+
+        labels = []
+        data = []
+        if granularity == 'day':
+            day = start
+            while day <= end:
+                month_end = min(end, date(day.year, day.month, calendar.monthrange(day.year, day.month)[1]))
+                amounts = days(_month_key(day))
+                for offset in range(day.day - 1, month_end.day):
+                    labels.append(date(day.year, day.month, offset + 1).isoformat())
+                    data.append(amounts[offset] if amounts is not None else 0.0)
+                day = month_end + timedelta(days=1)
+        elif granularity == 'week':
+            week = start - timedelta(days=start.weekday())
+            while week <= end:
+                first = max(week, start)
+                last = min(week + timedelta(days=6), end)
+                total = 0.0
+                while first <= last:
+                    # A week may straddle two months
+                    month_last = min(last, date(first.year, first.month,
+                                                calendar.monthrange(first.year, first.month)[1]))
+                    total += span_total(first, month_last)
+                    first = month_last + timedelta(days=1)
+                labels.append(week.isoformat())
+                data.append(total)
+                week += timedelta(days=7)
+        elif granularity == 'month':
+            month = start.replace(day=1)
+            while month <= end:
+                last = date(month.year, month.month, calendar.monthrange(month.year, month.month)[1])
+                labels.append(_month_key(month))
+                data.append(span_total(max(month, start), min(last, end)))
+                month = last + timedelta(days=1)
+        else:
+            for year in range(start.year, end.year + 1):
+                total = 0.0
+                for number in range(1, 13):
+                    month = date(year, number, 1)
+                    last = date(year, number, calendar.monthrange(year, number)[1])
+                    if last >= start and month <= end:
+                        total += span_total(max(month, start), min(last, end))
+                labels.append(str(year))
+                data.append(total)
+
+        return {
+            'granularity': granularity,
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'labels': labels,
+            'data': data
+        }
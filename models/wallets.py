@@ -0,0 +1,310 @@
+"""
+Wallet balances
+
+Expenses debit their ``wallet``; rows with ``type: income`` credit it and
+``type: transfer`` rows move the amount to ``to_wallet``. Only expenses are
+spending: income and transfers change wallet balances and nothing else. Every manifest
+summary keeps the net change of each wallet per day, and ``WalletBalances``
+loads those into one Fenwick tree (prefix-sum index) per wallet, keyed by day
+ordinal. The balance of a wallet on any date is then a prefix sum: O(log n)
+in the number of days, without reading a single row.
+
+The index is maintained on write: the ledger reports every partition rewrite
+with its old and new summary and only the days that changed are applied.
+Since increments can drift (float rounding, another process writing the same
+ledger), a full reconciliation rebuilds the index from the summaries once per
+``RECONCILE_INTERVAL`` and records any difference in the
+``wallet_reconciliation`` document.
+
+Opening balances are the ``balance`` of each wallet in the settings.
+Balances are in the ledger's base currency: amounts booked in another
+currency are converted with the rate of their day, as the summaries are (see
+``fx.py``). The index is rebuilt when the rates or the base currency change.
+Amounts in a currency without a rate are added as booked and the currency is
+reported under the wallet's ``unconverted``.
+"""
+
+import os
+from array import array
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+
+RECONCILE_INTERVAL = timedelta(seconds=int(os.environ.get('WALLET_RECONCILE_INTERVAL', 3600)))
+RECONCILE_DOCUMENT = 'wallet_reconciliation'
+# Balances closer than this are considered equal when reconciling
+TOLERANCE = 1e-6
+# Days covered by a new index before it grows
+INITIAL_DAYS = 1024
+LATEST = date.max.toordinal()
+# Row types; rows without one are expenses
+ENTRY_TYPES = ('expense', 'income', 'transfer')
+
+
+def is_spending(entry):
+    """Check that a row is an expense, the only type counted as spending"""
+    return entry.get('type') in (None, 'expense')
+
+
+def wallet_deltas(entry):
+    """Get the (wallet, signed amount) pairs of an expense, income or transfer"""
+    amount = entry.get('amount') or 0
+    wallet = entry.get('wallet')
+    kind = entry.get('type')
+    deltas = []
+    if wallet:
+        deltas.append((wallet, amount if kind == 'income' else -amount))
+    if kind == 'transfer' and entry.get('to_wallet'):
+        deltas.append((entry['to_wallet'], amount))
+    return deltas
+
+
+def summary_wallets(summary, factor=None, unconverted=None):
+    """
+    Get {wallet: {day: net change}} of a partition summary, converting the
+    amounts booked in a currency with factor(currency, day) when given.
+    Amounts factor() has no rate (None) for are added as booked and their
+    currency recorded in unconverted ({wallet: set of currencies}).
+    """
+    parts = summary.get('currencies')
+    if factor is None or not parts:
+        return summary.get('wallets', {})
+    wallets = defaultdict(lambda: defaultdict(float))
+    for currency, part in parts.items():
+        for wallet, days in part.get('wallets', {}).items():
+            for day, delta in days.items():
+                rate = factor(currency, day) if currency else 1.0
+                if rate is None:
+                    rate = 1.0
+                    if unconverted is not None:
+                        unconverted.setdefault(wallet, set()).add(currency)
+                wallets[wallet][day] += delta * rate
+    return wallets
+
+
+def day_ordinal(day):
+    """Day ordinal of an ISO date, or None"""
+    try:
+        return date.fromisoformat(day).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+class PrefixSums:
+    """Fenwick tree of amounts per day: O(log n) updates and prefix sums"""
+
+    def __init__(self, origin, size=INITIAL_DAYS):
+        self.origin = origin
+        self._values = array('d', bytes(8 * size))
+        self._tree = array('d', bytes(8 * (size + 1)))
+
+    def _resize(self, origin, size):
+        """Re-lay the tree over a wider day range"""
+        values = self._values
+        shift = self.origin - origin
+        self.origin = origin
+        self._values = array('d', bytes(8 * size))
+        self._values[shift:shift + len(values)] = values
+        # Linear-time Fenwick construction
+        tree = array('d', bytes(8)) + self._values
+        for i in range(1, size + 1):
+            parent = i + (i & -i)
+            if parent <= size:
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def add(self, ordinal, delta):
+        index = ordinal - self.origin
+        size = len(self._values)
+        if not 0 <= index < size:
+            # Grow with room to spare on the side that overflowed
+            origin = self.origin if index >= 0 else ordinal - size // 2
+            end = max(self.origin + size, ordinal + 1)
+            while end - origin > size:
+                size *= 2
+            self._resize(origin, size)
+            index = ordinal - self.origin
+        self._values[index] += delta
+        tree = self._tree
+        i = index + 1
+        while i <= size:
+            tree[i] += delta
+            i += i & -i
+
+    def prefix(self, ordinal):
+        """Sum of the amounts of every day up to and including ordinal"""
+        i = min(ordinal - self.origin, len(self._values) - 1) + 1
+        tree = self._tree
+        total = 0.0
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+
+class WalletBalances:
+    """Running balances of the wallets of one ledger"""
+
+    def __init__(self, ledger, fx=None):
+        self.ledger = ledger
+        # Converter of the ledger's currencies (see fx.py); None adds amounts as booked
+        self.fx = fx
+        self._index = None
+        # Conversion the index was built with: factor(currency, day) and its (rates version, base)
+        self._factor = None
+        self._conversion = None
+        # Net change of rows without an ISO date, per wallet
+        self._undated = {}
+        # Currencies without a rate added as booked, per wallet
+        self._unconverted = {}
+        # Manifest the index was built from; another object means it was reloaded
+        self._manifest = None
+        self._reconciled_at = None
+        ledger.listeners.append(self._apply)
+
+    def _conversion_key(self):
+        """Get the (rates version, base currency) amounts are converted with, or None"""
+        if self.fx is None:
+            return None
+        return self.fx.rates.refresh(), self.fx.currencies()[0]
+
+    def _converter(self, key):
+        """Get factor(currency, day) into the base currency of a conversion key, None without a rate"""
+        if key is None:
+            return None
+        rates = self.fx.rates
+        base = key[1]
+
+        def factor(currency, day):
+            return rates.factor(currency, base, day)
+        return factor
+
+    @staticmethod
+    def _build(partitions, factor=None):
+        """Build the prefix-sum index (and the unconverted currencies) from every partition summary"""
+        index = {}
+        undated = {}
+        unconverted = {}
+        for summary in partitions.values():
+            for wallet, days in summary_wallets(summary, factor, unconverted).items():
+                for day, delta in days.items():
+                    _add(index, undated, wallet, day, delta)
+        return index, undated, unconverted
+
+    def _apply(self, month, before, after):
+        """Apply the days of one rewritten partition to the index"""
+        if self._index is None:
+            return
+        before = summary_wallets(before or {}, self._factor)
+        after = summary_wallets(after or {}, self._factor, self._unconverted)
+        for wallet in set(before) | set(after):
+            old = before.get(wallet, {})
+            new = after.get(wallet, {})
+            for day in set(old) | set(new):
+                delta = new.get(day, 0) - old.get(day, 0)
+                if delta:
+                    _add(self._index, self._undated, wallet, day, delta)
+
+    def _current(self, now=None):
+        """Get the index, rebuilding it after a reload and reconciling when due"""
+        now = now or datetime.now()
+        manifest = self.ledger._open()
+        conversion = self._conversion_key()
+        if self._index is None or manifest is not self._manifest or conversion != self._conversion:
+            self._factor = self._converter(conversion)
+            self._index, self._undated, self._unconverted = self._build(manifest['partitions'], self._factor)
+            self._manifest = manifest
+            self._conversion = conversion
+            self._reconciled_at = now
+        elif now - self._reconciled_at >= RECONCILE_INTERVAL:
+            self.reconcile(now)
+        return self._index
+
+    def reconcile(self, now=None):
+        """Rebuild the index from the partition summaries and record any drift"""
+        now = now or datetime.now()
+        with self.ledger._lock:
+            manifest = self.ledger._open()
+            conversion = self._conversion_key()
+            factor = self._converter(conversion)
+            index, undated, unconverted = self._build(manifest['partitions'], factor)
+
+            drift = {}
+            if self._index is not None and manifest is self._manifest and conversion == self._conversion:
+                for wallet in set(self._index) | set(self._undated) | set(index) | set(undated):
+                    difference = (_balance(self._index, self._undated, wallet) -
+                                  _balance(index, undated, wallet))
+                    if abs(difference) > TOLERANCE:
+                        drift[wallet] = difference
+
+            self._index, self._undated, self._unconverted = index, undated, unconverted
+            self._manifest = manifest
+            self._factor, self._conversion = factor, conversion
+            self._reconciled_at = now
+            report = {
+                'checked_at': now.isoformat(),
+                'drift': drift,
+                'balances': {w: _balance(index, undated, w) for w in sorted(set(index) | set(undated), key=str)}
+            }
+            self.ledger.save_document(RECONCILE_DOCUMENT, report)
+            return report
+
+    def balances(self, opening, day=None):
+        """Get {wallet: balance} on a day (ISO date; None for now) given opening balances"""
+        ordinal = day_ordinal(day) if day else None
+        with self.ledger._lock:
+            index = self._current()
+            wallets = list(opening) + [w for w in sorted(set(index) | set(self._undated), key=str)
+                                       if w not in opening]
+            return {w: opening.get(w, 0) + _balance(index, self._undated, w, ordinal) for w in wallets}
+
+    def unconverted(self):
+        """Get {wallet: currencies} of the amounts added as booked for want of a rate"""
+        with self.ledger._lock:
+            self._current()
+            return {wallet: sorted(currencies) for wallet, currencies in self._unconverted.items()}
+
+    def history(self, wallet, opening=0, start=None, end=None):
+        """
+        Get the balance of a wallet after every day it changed between two dates
+        One prefix-sum query for the starting balance, then the days in range.
+        """
+        with self.ledger._lock:
+            index = self._current()
+            summaries = self.ledger.summaries()
+            start_ordinal = day_ordinal(start) if start else None
+            balance = opening
+            if start_ordinal is not None:
+                balance += _balance(index, self._undated, wallet, start_ordinal - 1)
+
+            changes = {}
+            for month in self.ledger.months(start, end):
+                for day, delta in summary_wallets(summaries[month], self._factor).get(wallet, {}).items():
+                    if day_ordinal(day) is not None and (not start or day >= start) and \
+                            (not end or day <= end):
+                        changes[day] = delta
+
+            points = []
+            for day in sorted(changes):
+                balance += changes[day]
+                points.append({'date': day, 'change': changes[day], 'balance': balance})
+            return points
+
+
+def _add(index, undated, wallet, day, delta):
+    ordinal = day_ordinal(day)
+    if ordinal is None:
+        undated[wallet] = undated.get(wallet, 0) + delta
+        return
+    tree = index.get(wallet)
+    if tree is None:
+        tree = index[wallet] = PrefixSums(ordinal)
+    tree.add(ordinal, delta)
+
+
+def _balance(index, undated, wallet, ordinal=None):
+    """Balance change of a wallet up to a day ordinal, or in total (undated rows included)"""
+    tree = index.get(wallet)
+    if ordinal is not None:
+        return tree.prefix(ordinal) if tree else 0.0
+    return (tree.prefix(LATEST) if tree else 0.0) + undated.get(wallet, 0)
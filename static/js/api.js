@@ -333,13 +333,15 @@ async function handleBudgetUpdate() {
         if (data.success) {
             app.budgets = data.data;
             app.saveData();
-            app.clearCache('stats'); // Clear dashboard cache to force refresh
-            app.clearCache('daily_chart');
-            app.clearCache('category_chart');
             showToast('✓ Budgets updated successfully!', 'success');
             console.log('Budgets saved successfully');
-            // Optionally update dashboard
-            setTimeout(() => app.updateDashboard(), 100);
+            // The change feed re-renders the dashboard; refetch only without it
+            if (!app.changeFeed) {
+                app.clearCache('stats'); // Clear dashboard cache to force refresh
+                app.clearCache('daily_chart');
+                app.clearCache('category_chart');
+                setTimeout(() => app.updateDashboard(), 100);
+            }
         } else {
             showToast(data.error || 'Failed to update budgets', 'error');
             console.error('Budget update error:', data.error);
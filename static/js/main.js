@@ -18,6 +18,7 @@ const app = {
     chartsUpdateTimeout: null,
     cacheTimeout: 60000, // 60 seconds
     lastUpdate: {},
+    syncVersion: 0, // Change version of the last expense sync
 
     // Utility: Debounce function to prevent excessive calls
     debounce(func, delay) {
@@ -65,6 +66,9 @@ const app = {
         // Update UI
         this.updateDashboard();
         
+        // Receive changes from other tabs and devices instead of polling
+        this.connectChangeFeed();
+        
         console.log('✅ Initialization complete');
     },
     
@@ -233,6 +237,7 @@ const app = {
             this.expenses = data.expenses || [];
             this.budgets = data.budgets || {};
             this.settings = data.settings || {};
+            this.syncVersion = data.syncVersion || 0;
         }
     },
     
@@ -240,17 +245,28 @@ const app = {
         const data = {
             expenses: this.expenses,
             budgets: this.budgets,
-            settings: this.settings
+            settings: this.settings,
+            syncVersion: this.syncVersion
         };
         localStorage.setItem('expenseTrackerData', JSON.stringify(data));
     },
     
     loadExpenses: async function() {
         try {
-            const response = await fetch('/api/expenses');
+            // Only transfer what changed since the last sync
+            const response = await fetch(`/api/expenses/changes?since=${this.syncVersion}`);
             const data = await response.json();
             if (data.success) {
-                this.expenses = data.data || [];
+                const changes = data.data;
+                if (changes.reset) {
+                    this.expenses = changes.upserts;
+                } else {
+                    const byId = new Map(this.expenses.map(e => [e.id, e]));
+                    changes.upserts.forEach(e => byId.set(e.id, e));
+                    changes.deleted.forEach(id => byId.delete(id));
+                    this.expenses = Array.from(byId.values());
+                }
+                this.syncVersion = changes.version;
                 this.saveData();
             }
         } catch (error) {
@@ -338,6 +354,75 @@ const app = {
         }
     },
     
+    // ===== REAL-TIME CHANGE FEED =====
+    
+    connectChangeFeed: function() {
+        if (!window.EventSource) return;
+        
+        // EventSource reconnects by itself and resumes from Last-Event-ID
+        const source = new EventSource('/api/events');
+        this.changeFeed = source;
+        const on = (type, handler) => source.addEventListener(type, (e) => handler(JSON.parse(e.data)));
+        
+        on('expense.added', (data) => {
+            if (!this.expenses.some(e => e.id === data.expense.id)) {
+                this.expenses.push(data.expense);
+            }
+            this.applyChange(data.totals);
+        });
+        
+        on('expense.updated', (data) => {
+            this.expenses = this.expenses.map(e => e.id === data.expense.id ? data.expense : e);
+            this.applyChange(data.totals);
+        });
+        
+        on('expense.deleted', (data) => {
+            this.expenses = this.expenses.filter(e => e.id !== data.id);
+            this.applyChange(data.totals);
+        });
+        
+        on('budget.changed', (data) => {
+            this.budgets = data.budgets;
+            this.applyChange(data.totals);
+        });
+        
+        on('resync', async () => {
+            this.clearCache('stats');
+            await this.loadExpenses();
+            await this.loadBudgets();
+            this.updateDashboard();
+        });
+    },
+    
+    // Patch the cached dashboard with totals pushed by the server
+    applyChange: function(totals) {
+        this.saveData();
+        this.clearCache('daily_chart');
+        this.clearCache('category_chart');
+        
+        const stats = this.getCache('stats');
+        if (!stats || !totals) {
+            this.updateDashboard();
+            return;
+        }
+        
+        stats.total = {
+            all_time: totals.all_time,
+            this_month: totals.this_month,
+            this_week: totals.this_week,
+            today: totals.today
+        };
+        stats.count.total = totals.count;
+        stats.count.this_month = totals.month_count;
+        stats.category_breakdown = totals.categories;
+        this.setCache('stats', stats);
+        
+        updateSummaryCards(stats);
+        updateBudgetProgress(stats);
+        updateQuickStats(stats);
+        this.debouncedUpdateCharts();
+    },
+    
     // ===== MONTH NAVIGATION =====
     
     previousMonth: function() {
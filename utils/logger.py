@@ -0,0 +1,159 @@
+"""
+Structured logging
+
+Records are put on an in-memory queue by the calling thread and formatted as
+one JSON object per line by a background listener thread, so a request only
+pays for building the record. The request ID of the current request is
+attached to every record logged while handling it.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import secrets
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+
+LOGGER_NAME = 'expense_tracker'
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+# Attributes every LogRecord has; anything else was passed via extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'request_id'}
+
+# ID of the request being handled, attached to its log records
+current_request_id = contextvars.ContextVar('current_request_id', default=None)
+
+_listener = None
+_queue_handler = None
+_setup_lock = threading.Lock()
+_access_sample_rate = 1.0
+
+
+def new_request_id(header_value=None):
+    """Reuse a well-formed incoming request ID, or generate one"""
+    if header_value and REQUEST_ID_PATTERN.match(header_value):
+        return header_value
+    return secrets.token_hex(8)
+
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as a single-line JSON object"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.message if hasattr(record, 'message') else record.getMessage(),
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['request_id'] = request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class ContextQueueHandler(QueueHandler):
+    """
+    Queue handler that defers formatting to the listener thread
+    Only the message and traceback are rendered in the calling thread, since
+    their arguments may change or go away once the call returns.
+    """
+
+    def prepare(self, record):
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        record.request_id = current_request_id.get()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level=None, access_sample_rate=None, stream=None):
+    """
+    Route the application loggers through a queue to a JSON stream handler
+    level: defaults to LOG_LEVEL (INFO)
+    access_sample_rate: share of successful requests written to the access log,
+        defaults to ACCESS_LOG_SAMPLE_RATE (1.0); errors are always logged
+    """
+    global _listener, _queue_handler, _access_sample_rate
+    with _setup_lock:
+        if access_sample_rate is None:
+            access_sample_rate = float(os.environ.get('ACCESS_LOG_SAMPLE_RATE', 1.0))
+        _access_sample_rate = access_sample_rate
+        if _listener is not None:
+            return
+
+        handler = logging.StreamHandler(stream or sys.stdout)
+        handler.setFormatter(JsonFormatter())
+        log_queue = queue.SimpleQueue()
+        _listener = QueueListener(log_queue, handler, respect_handler_level=True)
+        _listener.start()
+        # Registered once, however often logging is set up again after a shutdown
+        atexit.unregister(shutdown_logging)
+        atexit.register(shutdown_logging)
+
+        logger = logging.getLogger(LOGGER_NAME)
+        logger.setLevel(level or os.environ.get('LOG_LEVEL', 'INFO').upper())
+        # A queue handler left by an earlier setup would log every record twice
+        for handler in [h for h in logger.handlers if isinstance(h, ContextQueueHandler)]:
+            logger.removeHandler(handler)
+        _queue_handler = ContextQueueHandler(log_queue)
+        logger.addHandler(_queue_handler)
+        logger.propagate = False
+
+
+def shutdown_logging():
+    """Flush queued records, stop the listener thread and detach the queue handler"""
+    global _listener, _queue_handler
+    with _setup_lock:
+        if _queue_handler is not None:
+            logging.getLogger(LOGGER_NAME).removeHandler(_queue_handler)
+            _queue_handler = None
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def get_logger(name):
+    """Get a logger below the application logger"""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+access_logger = get_logger('access')
+
+
+def log_access(method, path, endpoint, status, seconds):
+    """Write an access log record; successful requests are sampled"""
+    if status < 400 and _access_sample_rate < 1.0 and random.random() >= _access_sample_rate:
+        return
+    if not access_logger.isEnabledFor(logging.INFO):
+        return
+    # Built directly to skip the caller lookup, which is meaningless here
+    record = access_logger.makeRecord(
+        access_logger.name, logging.INFO, '', 0, '%s %s %s', (method, path, status), None,
+        extra={
+            'method': method,
+            'path': path,
+            'endpoint': endpoint,
+            'status': status,
+            'duration_ms': round(seconds * 1000, 3)
+        }
+    )
+    access_logger.handle(record)
@@ -0,0 +1,210 @@
+"""
+Request timing metrics
+
+Requests are timed per endpoint, and named spans inside a request (storage
+load, filtering, aggregation, serialisation, file I/O) are timed per endpoint
+and span. Timings go into fixed log-scale histograms so memory stays constant
+however long the process runs; percentiles are estimated from the buckets and
+exposed in the Prometheus text format. An opt-in sampling profiler dumps
+cProfile stats of whole requests to disk.
+"""
+
+import contextvars
+import functools
+import itertools
+import os
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+
+# Bucket upper bounds in seconds: 50us up to ~110s, each 20% above the previous
+BUCKET_BOUNDS = tuple(50e-6 * 1.2 ** i for i in range(80))
+QUANTILES = (0.5, 0.9, 0.99)
+METRIC_PREFIX = 'expense_tracker'
+
+# Endpoint of the request being timed; spans outside a request are not recorded
+current_endpoint = contextvars.ContextVar('current_endpoint', default=None)
+
+
+class Histogram:
+    """Log-bucketed latency histogram"""
+
+    __slots__ = ('counts', 'count', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside its bucket"""
+        if not self.count:
+            return float('nan')
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = BUCKET_BOUNDS[i - 1] if i else 0.0
+                upper = BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else lower
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return BUCKET_BOUNDS[-1]
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+
+
+class Metrics:
+    """Request and span timings of one process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._statuses = {}
+        self._spans = {}
+
+    def observe_request(self, method, endpoint, status, seconds):
+        with self._lock:
+            histogram = self._requests.get((method, endpoint))
+            if histogram is None:
+                histogram = self._requests[(method, endpoint)] = Histogram()
+            histogram.observe(seconds)
+            key = (method, endpoint, status)
+            self._statuses[key] = self._statuses.get(key, 0) + 1
+
+    def observe_span(self, endpoint, name, seconds):
+        with self._lock:
+            histogram = self._spans.get((endpoint, name))
+            if histogram is None:
+                histogram = self._spans[(endpoint, name)] = Histogram()
+            histogram.observe(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._requests.clear()
+            self._statuses.clear()
+            self._spans.clear()
+
+    def _summary(self, lines, name, help_text, series):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} summary")
+        for labels, histogram in series:
+            for q in QUANTILES:
+                lines.append(f"{name}{{{_labels(**labels, quantile=q)}}} {histogram.quantile(q):.6g}")
+            lines.append(f"{name}_sum{{{_labels(**labels)}}} {histogram.sum:.6g}")
+            lines.append(f"{name}_count{{{_labels(**labels)}}} {histogram.count}")
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        with self._lock:
+            requests = sorted(self._requests.items())
+            statuses = sorted(self._statuses.items())
+            spans = sorted(self._spans.items())
+
+        lines = []
+        self._summary(
+            lines, f"{METRIC_PREFIX}_request_duration_seconds", 'Request latency by endpoint',
+            [({'method': m, 'endpoint': e}, h) for (m, e), h in requests]
+        )
+        lines.append(f"# HELP {METRIC_PREFIX}_requests_total Requests by endpoint and status")
+        lines.append(f"# TYPE {METRIC_PREFIX}_requests_total counter")
+        for (method, endpoint, status), count in statuses:
+            labels = _labels(method=method, endpoint=endpoint, status=status)
+            lines.append(f"{METRIC_PREFIX}_requests_total{{{labels}}} {count}")
+        self._summary(
+            lines, f"{METRIC_PREFIX}_span_duration_seconds", 'Time spent in a request phase by endpoint',
+            [({'endpoint': e, 'span': s}, h) for (e, s), h in spans]
+        )
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+
+
+@contextmanager
+def span(name):
+    """Time a block as a span of the current request"""
+    endpoint = current_endpoint.get()
+    if endpoint is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        METRICS.observe_span(endpoint, name, time.perf_counter() - start)
+
+
+def timed(name):
+    """Decorator timing every call of a function as a span"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ===== PROFILING =====
+
+class Profiler:
+    """
+    Opt-in sampling profiler
+    Disabled unless a directory is configured. A request is profiled when it
+    sends the trigger header or is picked at the sample rate; only one request
+    is profiled at a time, others run unprofiled.
+    """
+
+    HEADER = 'X-Profile'
+
+    def __init__(self, directory=None, sample_rate=0.0):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+
+    def wants(self, headers):
+        """Decide whether to profile a request"""
+        if not self.directory:
+            return False
+        return headers.get(self.HEADER) == '1' or random.random() < self.sample_rate
+
+    def start(self):
+        """Start profiling the current thread; None if another profile is running"""
+        if not self._lock.acquire(blocking=False):
+            return None
+        import cProfile  # only needed once profiling is enabled
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            self._lock.release()
+            return None
+        return profile
+
+    def stop(self, profile, endpoint, seconds):
+        """Stop a profile and dump it; returns the dump path"""
+        profile.disable()
+        self._lock.release()
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', endpoint).strip('_') or 'root'
+        filename = (f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(self._counter)}"
+                    f"-{slug}-{seconds * 1000:.0f}ms.prof")
+        path = os.path.join(self.directory, filename)
+        profile.dump_stats(path)
+        return path
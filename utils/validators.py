@@ -35,6 +35,11 @@ def validate_payment_method(method, valid_methods):
     return method in valid_methods
 
 
+def validate_currency(currency, valid_currencies):
+    """Validate that currency is a known currency code"""
+    return isinstance(currency, str) and currency in valid_currencies
+
+
 def validate_description(description, min_length=2):
     """Validate description length"""
     if not description or not isinstance(description, str):